@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import Dict, Optional
 import os
 from dotenv import load_dotenv
 
@@ -12,6 +12,20 @@ class Settings(BaseSettings):
     
     # База данных
     database_url: str = os.getenv("DATABASE_URL", "sqlite:///./nuclei_controller.db")
+    db_auto_migrate: bool = os.getenv("DB_AUTO_MIGRATE", "true").lower() == "true"  # Применять миграции при старте
+    db_index_check: bool = True  # Сообщать при старте о частых запросах без индекса
+    db_pool_size: int = int(os.getenv("DB_POOL_SIZE", "20"))  # Постоянных подключений в пуле
+    db_max_overflow: int = int(os.getenv("DB_MAX_OVERFLOW", "20"))  # Дополнительных подключений при пиковой нагрузке
+    db_pool_timeout: int = 30  # Ожидание свободного подключения (секунды)
+    db_pool_recycle: int = 1800  # Пересоздание подключений старше N секунд (PostgreSQL)
+    db_statement_timeout: int = int(os.getenv("DB_STATEMENT_TIMEOUT", "300000"))  # Лимит запроса PostgreSQL (мс, 0 - без лимита)
+    db_lock_timeout: int = 30000  # Ожидание блокировки PostgreSQL (мс, 0 - без лимита)
+    db_single_writer: str = os.getenv("DB_SINGLE_WRITER", "auto")  # Запись находок одним потоком: auto (для SQLite), true, false
+    sqlite_journal_mode: str = "WAL"  # Чтение не блокируется записью
+    sqlite_synchronous: str = "NORMAL"  # С WAL не теряет целостность при сбое процесса
+    sqlite_mmap_size: int = 256 * 1024 * 1024  # Отображение файла БД в память (байты)
+    sqlite_busy_timeout: int = 30000  # Ожидание снятия блокировки вместо "database is locked" (мс)
+    sqlite_cache_size: int = -64 * 1024  # Кэш страниц (отрицательное значение - в КиБ)
     
 
     # Базовый путь
@@ -35,12 +49,101 @@ class Settings(BaseSettings):
     templates_dir: str = os.path.join(upload_dir, "templates")
     targets_dir: str = os.path.join(upload_dir, "targets")
     worker_scripts_dir: str = os.path.join(base_dir, "worker_scripts")
+    artifacts_dir: str = os.path.join(upload_dir, "artifacts")  # Кэш бинарников и бандла воркера
+    results_dir: str = os.path.join(upload_dir, "results")  # Файлы результатов, загруженные с воркеров
+    transfer_cache_dir: str = os.path.join(upload_dir, "transfer")  # Сжатые копии для передачи
+    checkpoints_dir: str = os.path.join(upload_dir, "checkpoints")  # Файлы возобновления nuclei прерванных частей
+    blobs_dir: str = os.path.join(upload_dir, "blobs")  # Сжатый сырой вывод находок (по SHA-256)
+    archive_dir: str = os.path.join(upload_dir, "archive")  # Архив находок (JSONL.gz) и манифест
     
     # Настройки воркеров
     worker_timeout: int = 300  # Таймаут SSH подключения в секундах
     max_workers: int = 50  # Максимальное количество воркеров
+    max_scans_per_worker: int = 4  # Максимум одновременных сканов (screen сессий) на воркере
+    scheduler_throughput_window: int = 20  # Последних частей для оценки скорости воркера
+    
+    # Очередь задач
+    max_running_scans: int = 200  # Максимум одновременных сканов на весь парк
+    max_queued_tasks: int = 1000  # Максимум задач в очереди (новые отклоняются)
+    dispatch_interval: int = 5  # Интервал раунда диспетчера (секунды)
+    default_batch_size: int = 0  # Размер пакета целей по умолчанию (0 - без пакетного режима)
+    straggler_factor: float = 2.0  # Пакет отстает, если выполняется дольше медианы в N раз
+    straggler_min_seconds: int = 300  # Минимальное время пакета до запуска резервной копии
+    straggler_min_completed: int = 3  # Завершенных пакетов задачи для оценки медианы
+    graceful_stop_timeout: int = 60  # Ожидание завершения nuclei после SIGINT (секунды)
+    
+    # Прием целей
+    targets_read_chunk_size: int = 1024 * 1024  # Размер куска при чтении загруженного файла
+    targets_dedup_capacity: int = 1000000  # Начальная емкость фильтра дедупликации (растет по мере заполнения)
+    targets_dedup_error_rate: float = 0.000001  # Вероятность ложного отсева уникальной цели
+    targets_dedup_exact_limit: int = 500000  # До стольких целей дедупликация точная (множество хэшей), затем фильтр Блума
+    
+    # Кэш результатов сканирования (цель + шаблон)
+    scan_cache_enabled: bool = os.getenv("SCAN_CACHE_ENABLED", "true").lower() == "true"
+    scan_cache_ttl: int = 86400  # Время жизни записи (секунды)
+    scan_cache_copy_findings: bool = True  # Копировать находки пропущенных целей в новую задачу
+    scan_cache_batch_size: int = 1000  # Целей в одном запросе к кэшу
+    scan_cache_evict_interval: int = 3600  # Интервал удаления просроченных записей (секунды)
+    
+    # Хранение и архивирование находок
+    retention_enabled: bool = os.getenv("RETENTION_ENABLED", "false").lower() == "true"  # Фоновое применение политик
+    retention_days: int = int(os.getenv("RETENTION_DAYS", "180"))  # Находка, не встречавшаяся N дней, уходит в архив (0 - хранить)
+    retention_severity_days: Dict[str, int] = {"info": 30, "low": 90}  # Свой срок для уровней серьезности (0 - хранить)
+    retention_interval: int = 86400  # Интервал применения политик (секунды)
+    retention_batch_size: int = 10000  # Находок в одном файле архива (и одной транзакции)
+    targets_retention_days: int = 30  # Файлы целей завершенных задач удаляются через N дней (0 - хранить)
+    
+    # Мониторинг здоровья воркеров
+    heartbeat_interval: int = 30  # Интервал heartbeat (секунды)
+    heartbeat_timeout: int = 10  # Таймаут одного heartbeat (секунды)
+    heartbeat_concurrency: int = 50  # Одновременных проверок
+    worker_degraded_after: int = 1  # Ошибок подряд до статуса degraded
+    worker_offline_after: int = 3  # Ошибок подряд до статуса offline и размыкания автомата
+    circuit_recovery_successes: int = 2  # Успехов подряд для возврата воркера в работу
+    
+    # Пул SSH подключений
+    ssh_pool_max_per_worker: int = 4  # Максимум подключений на воркер
+    ssh_max_channels_per_connection: int = 8  # Параллельных каналов на подключение (MaxSessions)
+    ssh_pool_idle_timeout: int = 600  # Закрытие простаивающих подключений (секунды)
+    ssh_keepalive_interval: int = 30  # Интервал keepalive пакетов (секунды)
+    ssh_health_check_interval: int = 120  # Проверка подключения после простоя (секунды)
+    ssh_command_timeout: int = 120  # Таймаут одной удаленной команды (секунды)
+    ssh_transfer_timeout: int = 1800  # Таймаут передачи файла по SFTP (секунды)
+    
+    # Установка воркеров
+    provision_concurrency: int = int(os.getenv("PROVISION_CONCURRENCY", "10"))  # Параллельных установок
+    
+    # Опрос статуса сканирований
+    status_poll_min_interval: float = 5.0  # Минимальный интервал (начало и конец скана)
+    status_poll_max_interval: float = 60.0  # Максимальный интервал для долгих сканов
+    status_poll_backoff: float = 1.5  # Множитель увеличения интервала
+    status_poll_max_failures: int = 3  # Ошибок опроса подряд до признания сессии завершенной
+    
+    # Агент воркера (опционально, SSH опрос остается резервным путем)
+    agent_enabled: bool = os.getenv("AGENT_ENABLED", "false").lower() == "true"
+    agent_controller_url: str = os.getenv("AGENT_CONTROLLER_URL", "")  # Адрес контроллера, доступный с воркеров
+    agent_push_interval: int = 5  # Интервал отправки данных агентом (секунды)
+    agent_timeout: int = 30  # Агент считается недоступным после этой паузы (секунды)
+    
+    # Передача файлов
+    transfer_chunk_size: int = 4 * 1024 * 1024  # Размер куска SFTP передачи (байты)
+    transfer_retries: int = 3  # Попыток докачки после обрыва соединения
+    transfer_compression: str = os.getenv("TRANSFER_COMPRESSION", "auto")  # auto, zstd, gzip, none
+    
+    # Потоковый прием результатов
+    results_chunk_size: int = 4 * 1024 * 1024  # Размер чтения файла результатов за раз (байты)
+    results_max_line_size: int = 64 * 1024 * 1024  # Максимальная длина одной JSONL строки (байты)
+    results_bulk_threshold: int = 64 * 1024 * 1024  # Непрочитанный объем, после которого файл загружается целиком
+    results_insert_batch_size: int = 2000  # Находок в одном пакете вставки (и одной транзакции)
+    results_use_copy: bool = True  # COPY вместо insert на PostgreSQL (psycopg2)
+    results_blob_store: bool = True  # Сырой вывод находок в blobs_dir, в БД только ссылка
+    blob_compression: str = os.getenv("BLOB_COMPRESSION", "auto")  # auto, zstd, zlib
+    blob_gc_grace_seconds: int = 3600  # Блобы моложе не удаляются сборкой мусора (ссылка может быть еще не зафиксирована)
     
     # Nuclei настройки
+    nuclei_version: str = os.getenv("NUCLEI_VERSION", "3.1.7")  # Версия, раздаваемая воркерам
+    nuclei_stats_interval: int = 10  # Интервал JSON статистики nuclei (-stats-interval, секунды)
+    stats_sample_interval: int = 30  # Интервал записи статистики части в task_stats (секунды)
     nuclei_rate_limit: int = 150  # Лимит запросов в секунду
     nuclei_concurrency: int = 50  # Количество параллельных процессов
     
@@ -53,4 +156,10 @@ settings = Settings()
 os.makedirs(settings.upload_dir, exist_ok=True)
 os.makedirs(settings.templates_dir, exist_ok=True)
 os.makedirs(settings.targets_dir, exist_ok=True)
-os.makedirs(settings.worker_scripts_dir, exist_ok=True)
\ No newline at end of file
+os.makedirs(settings.worker_scripts_dir, exist_ok=True)
+os.makedirs(settings.artifacts_dir, exist_ok=True)
+os.makedirs(settings.results_dir, exist_ok=True)
+os.makedirs(settings.transfer_cache_dir, exist_ok=True)
+os.makedirs(settings.checkpoints_dir, exist_ok=True)
+os.makedirs(settings.blobs_dir, exist_ok=True)
+os.makedirs(settings.archive_dir, exist_ok=True)
\ No newline at end of file
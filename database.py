@@ -1,13 +1,160 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean, Text, ForeignKey, Float
+from sqlalchemy import create_engine, event, exc, Column, Integer, BigInteger, String, DateTime, Boolean, Text, ForeignKey, Float, UniqueConstraint, Index
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
 from datetime import datetime
+import time
 import bcrypt
 from config import settings
 
+def _new_pool_metrics() -> dict:
+    return {
+        "checkouts": 0,
+        "waits": 0,  # Получений подключения с ожиданием дольше 1 мс
+        "wait_seconds": 0.0,
+        "max_wait_seconds": 0.0,
+        "timeouts": 0
+    }
+
+# Ожидание свободного подключения пула (общие для пересозданных пулов)
+pool_metrics = {"sync": _new_pool_metrics(), "async": _new_pool_metrics()}
+
+class _MeteredPool:
+    """Учет времени ожидания подключения для QueuePool"""
+    
+    metrics_key = "sync"
+    
+    def _do_get(self):
+        metrics = pool_metrics[self.metrics_key]
+        started = time.monotonic()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            metrics["timeouts"] += 1
+            raise
+        finally:
+            waited = time.monotonic() - started
+            metrics["checkouts"] += 1
+            metrics["wait_seconds"] += waited
+            if waited > 0.001:
+                metrics["waits"] += 1
+            metrics["max_wait_seconds"] = max(metrics["max_wait_seconds"], waited)
+
+class MeteredQueuePool(_MeteredPool, QueuePool):
+    pass
+
+class MeteredAsyncQueuePool(_MeteredPool, AsyncAdaptedQueuePool):
+    metrics_key = "async"
+
+# Драйверы асинхронного движка (aiosqlite и asyncpg)
+ASYNC_DRIVERS = {"sqlite": "aiosqlite", "postgresql": "asyncpg"}
+
+def _pool_options(asynchronous: bool) -> dict:
+    return {
+        "poolclass": MeteredAsyncQueuePool if asynchronous else MeteredQueuePool,
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout
+    }
+
+def _sqlite_engine(url, asynchronous: bool = False):
+    """SQLite: WAL (читатели не блокируют запись), ожидание блокировки вместо ошибки"""
+    memory = url.database in (None, "", ":memory:")
+    options = {"connect_args": {"check_same_thread": False, "timeout": settings.sqlite_busy_timeout / 1000}}
+    if not memory:
+        options.update(_pool_options(asynchronous))
+    sqlite_engine = create_async_engine(url, **options) if asynchronous else create_engine(url, **options)
+    
+    @event.listens_for(sqlite_engine.sync_engine if asynchronous else sqlite_engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if not memory:
+            cursor.execute(f"PRAGMA journal_mode={settings.sqlite_journal_mode}")
+            cursor.execute(f"PRAGMA mmap_size={int(settings.sqlite_mmap_size)}")
+        cursor.execute(f"PRAGMA synchronous={settings.sqlite_synchronous}")
+        cursor.execute(f"PRAGMA busy_timeout={int(settings.sqlite_busy_timeout)}")
+        cursor.execute(f"PRAGMA cache_size={int(settings.sqlite_cache_size)}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+    
+    return sqlite_engine
+
+def _postgresql_engine(url, asynchronous: bool = False):
+    """PostgreSQL: пул с проверкой подключений и ограничением времени запросов"""
+    timeouts = {}
+    if settings.db_statement_timeout:
+        timeouts["statement_timeout"] = str(int(settings.db_statement_timeout))
+    if settings.db_lock_timeout:
+        timeouts["lock_timeout"] = str(int(settings.db_lock_timeout))
+    
+    connect_args = {}
+    if timeouts and url.get_driver_name() == "asyncpg":
+        connect_args["server_settings"] = timeouts
+    elif timeouts and url.get_driver_name() in ("psycopg2", "psycopg"):  # Параметры сессии через libpq options
+        connect_args["options"] = " ".join(f"-c {name}={value}" for name, value in timeouts.items())
+    
+    options = dict(
+        pool_recycle=settings.db_pool_recycle,
+        pool_pre_ping=True,
+        connect_args=connect_args,
+        **_pool_options(asynchronous)
+    )
+    return create_async_engine(url, **options) if asynchronous else create_engine(url, **options)
+
+def create_db_engine(database_url: str, asynchronous: bool = False):
+    """Движок с профилем настроек по типу БД из database_url
+
+    Для асинхронного движка драйвер заменяется на aiosqlite или asyncpg.
+    """
+    url = make_url(database_url)
+    backend = url.get_backend_name()
+    if asynchronous:
+        if backend not in ASYNC_DRIVERS:
+            raise Exception(f"No async driver for database backend {backend}")
+        url = url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+    if backend == "sqlite":
+        return _sqlite_engine(url, asynchronous)
+    if backend == "postgresql":
+        return _postgresql_engine(url, asynchronous)
+    return create_engine(url, pool_pre_ping=True)
+
+def _pool_stats(pool, metrics: dict) -> dict:
+    stats = {"pool": type(pool).__name__, **metrics}
+    if isinstance(pool, QueuePool):
+        capacity = pool.size() + max(pool._max_overflow, 0)
+        stats.update(
+            size=pool.size(),
+            checked_out=pool.checkedout(),
+            checked_in=pool.checkedin(),
+            overflow=max(pool.overflow(), 0),
+            saturation=round(pool.checkedout() / capacity, 3) if capacity else None
+        )
+    checkouts = metrics["checkouts"]
+    stats["wait_seconds"] = round(metrics["wait_seconds"], 3)
+    stats["max_wait_seconds"] = round(metrics["max_wait_seconds"], 3)
+    stats["avg_wait_ms"] = round(metrics["wait_seconds"] / checkouts * 1000, 3) if checkouts else None
+    return stats
+
+def get_pool_stats() -> dict:
+    """Заполненность пулов подключений и ожидание свободного подключения"""
+    stats = {"dialect": engine.dialect.name, **_pool_stats(engine.pool, pool_metrics["sync"])}
+    if async_engine is not None:
+        stats["async"] = _pool_stats(async_engine.sync_engine.pool, pool_metrics["async"])
+    return stats
+
 # Создание движка базы данных
-engine = create_engine(settings.database_url, connect_args={"check_same_thread": False} if "sqlite" in settings.database_url else {})
+engine = create_db_engine(settings.database_url)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Асинхронный движок для обработчиков запросов (aiosqlite или asyncpg)
+try:
+    async_engine = create_db_engine(settings.database_url, asynchronous=True)
+except Exception as e:
+    print(f"Async database engine is not available: {str(e)}")
+    async_engine = None
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False) if async_engine is not None else None
 Base = declarative_base()
 
 # Модели
@@ -29,6 +176,7 @@ class User(Base):
 
 class Worker(Base):
     __tablename__ = "workers"
+    __table_args__ = (Index("ix_workers_status", "status"),)
     
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(100), unique=True, nullable=False)
@@ -36,12 +184,21 @@ class Worker(Base):
     ssh_port = Column(Integer, default=22)
     username = Column(String(50), nullable=False)
     password = Column(String(255))  # Зашифрованный пароль
-    status = Column(String(20), default="offline")  # online, offline, error
+    status = Column(String(20), default="offline")  # online, degraded, offline, error, provisioning
     last_ping = Column(DateTime)
+    latency_ms = Column(Float)  # Время отклика последнего heartbeat
+    load_avg = Column(Float)  # Load average за 1 минуту
+    cpu_count = Column(Integer)
+    mem_usage = Column(Float)  # Занятая память, %
+    consecutive_failures = Column(Integer, default=0)
+    agent_token = Column(String(64), unique=True)  # Токен агента воркера
+    agent_last_seen = Column(DateTime)
     created_at = Column(DateTime, default=datetime.utcnow)
     
     # Связи
     tasks = relationship("Task", back_populates="worker")
+    shards = relationship("TaskShard", back_populates="worker")
+    templates = relationship("WorkerTemplate", back_populates="worker", cascade="all, delete-orphan")
 
 class Template(Base):
     __tablename__ = "templates"
@@ -53,22 +210,50 @@ class Template(Base):
     file_size = Column(Integer)
     uploaded_at = Column(DateTime, default=datetime.utcnow)
     is_active = Column(Boolean, default=True)
+    content_hash = Column(String(64))  # SHA-256 содержимого (ключ кэша результатов)
     
     # Связи
     tasks = relationship("Task", back_populates="template")
+    deployments = relationship("WorkerTemplate", back_populates="template", cascade="all, delete-orphan")
+
+class WorkerTemplate(Base):
+    __tablename__ = "worker_templates"
+    __table_args__ = (UniqueConstraint("worker_id", "template_id"),)
+    
+    id = Column(Integer, primary_key=True, index=True)
+    worker_id = Column(Integer, ForeignKey("workers.id"), nullable=False)
+    template_id = Column(Integer, ForeignKey("templates.id"), nullable=False)
+    deployed_at = Column(DateTime, default=datetime.utcnow)
+    
+    # Связи
+    worker = relationship("Worker", back_populates="templates")
+    template = relationship("Template", back_populates="deployments")
 
 class Task(Base):
     __tablename__ = "tasks"
+    __table_args__ = (
+        Index("ix_tasks_status_created_at", "status", "created_at"),  # Очередь диспетчера
+        Index("ix_tasks_created_at", "created_at"),  # Список задач
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(255), nullable=False)
-    status = Column(String(20), default="pending")  # pending, running, completed, failed
-    worker_id = Column(Integer, ForeignKey("workers.id"))
+    status = Column(String(20), default="pending")  # pending, queued, running, completed, failed
+    worker_id = Column(Integer, ForeignKey("workers.id"))  # Воркер первой части (для задач из одной части)
     template_id = Column(Integer, ForeignKey("templates.id"))
     targets_file = Column(String(500))
     targets_count = Column(Integer, default=0)
+    cached_count = Column(Integer, default=0)  # Целей пропущено по кэшу результатов
+    archived_count = Column(Integer, default=0)  # Находок перенесено в архив
+    retention_days = Column(Integer)  # Срок хранения находок задачи (дни, None - общие политики, 0 - хранить)
+    batch_size = Column(Integer, default=0)  # Размер пакета целей (0 - части по числу воркеров)
     progress = Column(Float, default=0.0)
-    screen_session = Column(String(100))  # Имя screen сессии
+    results_count = Column(Integer, default=0)  # Количество принятых находок по всем частям
+    requests_done = Column(BigInteger, default=0)  # Выполнено запросов nuclei (по всем частям)
+    requests_total = Column(BigInteger, default=0)  # Всего запросов nuclei
+    rps = Column(Float, default=0.0)  # Текущая скорость, запросов в секунду
+    errors_count = Column(Integer, default=0)  # Ошибки запросов nuclei
+    eta_seconds = Column(Integer)  # Оценка оставшегося времени
     started_at = Column(DateTime)
     completed_at = Column(DateTime)
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -77,26 +262,170 @@ class Task(Base):
     # Связи
     worker = relationship("Worker", back_populates="tasks")
     template = relationship("Template", back_populates="tasks")
-    results = relationship("Result", back_populates="task", cascade="all, delete-orphan")
+    shards = relationship("TaskShard", back_populates="task", cascade="all, delete-orphan", order_by="TaskShard.shard_index")
+    results = relationship("Result", back_populates="task")  # Находки общие для задач - удаляются по result_occurrences
+    stats = relationship("TaskStat", back_populates="task", cascade="all, delete-orphan", order_by="TaskStat.created_at")
+    archives = relationship("ResultArchive", back_populates="task", cascade="all, delete-orphan", order_by="ResultArchive.created_at")
+
+class TaskShard(Base):
+    __tablename__ = "task_shards"
+    __table_args__ = (
+        Index("ix_task_shards_status_task_id", "status", "task_id"),  # Выбор частей диспетчером
+        Index("ix_task_shards_worker_id_status", "worker_id", "status"),  # Загрузка воркеров
+        Index("ix_task_shards_task_id_shard_index", "task_id", "shard_index"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    task_id = Column(Integer, ForeignKey("tasks.id"), nullable=False, index=True)
+    shard_index = Column(Integer, nullable=False)
+    job_id = Column(String(64), unique=True, nullable=False)  # Имя задания на воркере: {task_id}_{shard_index}
+    worker_id = Column(Integer, ForeignKey("workers.id"))
+    status = Column(String(20), default="pending")  # pending, running, completed, failed, superseded
+    targets_file = Column(String(500))
+    targets_count = Column(Integer, default=0)
+    progress = Column(Float, default=0.0)
+    screen_session = Column(String(100))  # Имя screen сессии
+    backup_of_id = Column(Integer, ForeignKey("task_shards.id"))  # Резервная копия отстающей части
+    attempt = Column(Integer, default=0)  # Номер запуска (растет при возобновлении)
+    checkpoint_file = Column(String(500))  # Файл возобновления nuclei на контроллере
+    results_offset = Column(BigInteger, default=0)  # Позиция в файле результатов на воркере (байты)
+    results_count = Column(Integer, default=0)  # Количество принятых находок
+    parse_errors = Column(Integer, default=0)  # Поврежденных строк в файле результатов
+    requests_done = Column(BigInteger, default=0)  # Последняя статистика nuclei -stats
+    requests_total = Column(BigInteger, default=0)
+    rps = Column(Float, default=0.0)
+    errors_count = Column(Integer, default=0)
+    eta_seconds = Column(Integer)
+    started_at = Column(DateTime)
+    completed_at = Column(DateTime)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    error_message = Column(Text)
+    
+    # Связи
+    task = relationship("Task", back_populates="shards")
+    worker = relationship("Worker", back_populates="shards")
+    backup_of = relationship("TaskShard", remote_side=[id])
+    results = relationship("Result", back_populates="shard")
+
+class TaskStat(Base):
+    __tablename__ = "task_stats"
+    __table_args__ = (Index("ix_task_stats_task_id_created_at", "task_id", "created_at"),)
+    
+    id = Column(Integer, primary_key=True, index=True)
+    task_id = Column(Integer, ForeignKey("tasks.id"), nullable=False, index=True)
+    shard_id = Column(Integer, ForeignKey("task_shards.id"))
+    requests_done = Column(BigInteger, default=0)
+    requests_total = Column(BigInteger, default=0)
+    rps = Column(Float, default=0.0)
+    matched = Column(Integer, default=0)
+    errors_count = Column(Integer, default=0)
+    progress = Column(Float, default=0.0)
+    eta_seconds = Column(Integer)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    # Связи
+    task = relationship("Task", back_populates="stats")
+
+class ScanCacheEntry(Base):
+    __tablename__ = "scan_cache"
+    __table_args__ = (
+        UniqueConstraint("template_hash", "target_key"),
+        Index("ix_scan_cache_task_id", "task_id"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    template_hash = Column(String(64), nullable=False)  # SHA-256 архива шаблона
+    target_key = Column(String(32), nullable=False)  # BLAKE2b нормализованной цели
+    task_id = Column(Integer)  # Задача, в которой цель была просканирована
+    scanned_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, index=True)
+
+class ResultArchive(Base):
+    __tablename__ = "result_archives"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    task_id = Column(Integer, ForeignKey("tasks.id"), index=True)  # Задача-владелец находок (последняя, где они встречались); все задачи - в result_archive_tasks
+    file_path = Column(String(500), nullable=False)  # Файл JSONL.gz в archive_dir
+    rows_count = Column(Integer, default=0)
+    size_bytes = Column(BigInteger, default=0)
+    sha256 = Column(String(64))  # Контрольная сумма файла
+    severity_counts = Column(Text)  # JSON: уровень серьезности -> количество находок
+    first_seen_min = Column(DateTime)
+    last_seen_max = Column(DateTime)
+    reason = Column(String(20))  # retention, task
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    # Связи
+    task = relationship("Task", back_populates="archives")
+    covered_tasks = relationship("ResultArchiveTask", back_populates="archive", cascade="all, delete-orphan")
+
+class ResultArchiveTask(Base):
+    """Задача, находки которой есть в файле архива (по result_occurrences)"""
+    __tablename__ = "result_archive_tasks"
+    __table_args__ = (Index("ix_result_archive_tasks_task_id", "task_id"),)
+    
+    archive_id = Column(Integer, ForeignKey("result_archives.id"), primary_key=True)
+    task_id = Column(Integer, primary_key=True)
+    
+    # Связи
+    archive = relationship("ResultArchive", back_populates="covered_tasks")
+
+class ResultOccurrence(Base):
+    """Вклад одной части в счетчики находки (для отката вклада снятой части
+    и выборки находок задачи)"""
+    __tablename__ = "result_occurrences"
+    __table_args__ = (
+        UniqueConstraint("fingerprint", "shard_id"),
+        Index("ix_result_occurrences_shard_id", "shard_id"),
+        Index("ix_result_occurrences_task_id", "task_id"),  # Фильтр находок по задаче
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    fingerprint = Column(String(64), nullable=False)  # Отпечаток находки в results
+    task_id = Column(Integer)  # Задача, в которой находка встречалась
+    shard_id = Column(Integer)  # NULL - счетчики находки до появления учета по частям
+    occurrence_count = Column(Integer, default=1)
+    first_seen = Column(DateTime, default=datetime.utcnow)
+    last_seen = Column(DateTime, default=datetime.utcnow)
 
 class Result(Base):
     __tablename__ = "results"
+    __table_args__ = (
+        Index("ix_results_task_id", "task_id"),  # Каскадное удаление задачи и фильтр по задаче
+        Index("ix_results_last_task_id", "last_task_id"),
+        Index("ix_results_shard_id", "shard_id"),
+        Index("ix_results_last_seen", "last_seen", "id"),  # Сортировка списка находок
+        Index("ix_results_severity_last_seen", "severity", "last_seen"),
+        Index("ix_results_template_name", "template_name"),
+        Index("ix_results_target", "target"),
+        Index("ix_results_host_key", "host_key"),  # Находки целей из кэша результатов
+        Index("ix_results_created_at", "created_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     task_id = Column(Integer, ForeignKey("tasks.id"))
+    shard_id = Column(Integer, ForeignKey("task_shards.id"))
     template_name = Column(String(255))
     protocol = Column(String(20))  # http, https, tcp, etc
     severity = Column(String(20))  # info, low, medium, high, critical
     target = Column(String(500))
+    host_key = Column(String(32))  # Ключ хоста нормализованной цели (scan_cache.host_key)
     matched_at = Column(String(500))
     matcher_name = Column(String(255))
     extracted_results = Column(Text)
     curl_command = Column(Text)
-    raw_output = Column(Text)
+    raw_output = Column(Text)  # Заполняется, только если хранилище blobs отключено
+    raw_ref = Column(String(64))  # SHA-256 сырого вывода в хранилище blobs
+    fingerprint = Column(String(64), unique=True, index=True)  # Отпечаток находки (шаблон, место, matcher, извлеченные значения)
+    first_seen = Column(DateTime, default=datetime.utcnow)
+    last_seen = Column(DateTime, default=datetime.utcnow)
+    occurrence_count = Column(Integer, default=1)  # Сколько раз находка встречалась в сканах
+    last_task_id = Column(Integer)  # Задача, в которой находка встречалась последней
     created_at = Column(DateTime, default=datetime.utcnow)
     
     # Связи
     task = relationship("Task", back_populates="results")
+    shard = relationship("TaskShard", back_populates="results")
 
 # Функция для получения сессии базы данных
 def get_db():
@@ -106,9 +435,18 @@ def get_db():
     finally:
         db.close()
 
+# Асинхронная сессия для обработчиков запросов FastAPI
+async def get_async_db():
+    if AsyncSessionLocal is None:
+        raise Exception("Async database driver is not installed (aiosqlite for SQLite, asyncpg for PostgreSQL)")
+    async with AsyncSessionLocal() as db:
+        yield db
+
 # Инициализация базы данных
 def init_db():
-    Base.metadata.create_all(bind=engine)
+    # Схема создается и обновляется миграциями Alembic
+    from modules.schema import upgrade_schema
+    upgrade_schema()
     
     # Создание администратора по умолчанию
     db = SessionLocal()
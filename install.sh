@@ -49,7 +49,7 @@ source venv/bin/activate
 echo -e "${YELLOW}[5/8] Установка Python пакетов...${NC}"
 pip install --upgrade pip
 pip install fastapi uvicorn sqlalchemy alembic paramiko python-jose[cryptography] \
-    python-multipart jinja2 aiofiles psutil bcrypt python-dotenv pydantic-settings \
+    python-multipart jinja2 aiofiles psutil bcrypt python-dotenv pydantic-settings aiosqlite zstandard \
     sqlalchemy-utils
 
 # Создание структуры директорий
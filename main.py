@@ -1,21 +1,32 @@
 from fastapi import FastAPI, Request, Depends, HTTPException, Form, File, UploadFile
 from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
+from fastapi.encoders import jsonable_encoder
+from fastapi.concurrency import run_in_threadpool, iterate_in_threadpool
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, selectinload
 import uvicorn
 from typing import Optional, List
 from datetime import datetime
 import os
+import asyncio
 import json
 
 from config import settings
-from database import get_db, init_db, User, Worker, Task, Template, Result
+from database import get_db, get_async_db, AsyncSessionLocal, async_engine, init_db, get_pool_stats as get_db_pool_stats, User, Worker, Task, Template, Result
 from modules.auth import get_current_user, create_access_token, verify_user
 from modules.worker_manager import WorkerManager
 from modules.task_manager import TaskManager
+from modules.dispatcher import QueueFullError
+from modules.blob_store import blob_store
+from modules.result_query import ResultQuery, ResultFilter, select_rows
+from modules.schema import upgrade_schema, schema_revision, report_schema, check_indexes
 from modules.template_manager import TemplateManager
 from modules.result_parser import ResultParser
+from modules.provisioner import FleetProvisioner
+from modules.health_monitor import HealthMonitor
 
 # Инициализация приложения
 app = FastAPI(title=settings.app_name, version=settings.version)
@@ -24,15 +35,17 @@ app = FastAPI(title=settings.app_name, version=settings.version)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
-# Инициализация менеджеров
+# Инициализация менеджеров (общий WorkerManager и пул SSH подключений)
 worker_manager = WorkerManager()
-task_manager = TaskManager()
-template_manager = TemplateManager()
+health_monitor = HealthMonitor(worker_manager)
+task_manager = TaskManager(worker_manager, health_monitor)
+template_manager = TemplateManager(worker_manager)
+provisioner = FleetProvisioner(worker_manager)
 result_parser = ResultParser()
 
 # Маршруты
 @app.get("/", response_class=HTMLResponse)
-async def root(request: Request, db: Session = Depends(get_db)):
+async def root(request: Request, db: AsyncSession = Depends(get_async_db)):
     # Проверка аутентификации
     token = request.cookies.get("access_token")
     if not token:
@@ -74,7 +87,7 @@ async def logout():
     return response
 
 @app.get("/dashboard", response_class=HTMLResponse)
-async def dashboard(request: Request, db: Session = Depends(get_db)):
+async def dashboard(request: Request, db: AsyncSession = Depends(get_async_db)):
     token = request.cookies.get("access_token")
     if not token:
         return RedirectResponse(url="/login", status_code=302)
@@ -83,10 +96,10 @@ async def dashboard(request: Request, db: Session = Depends(get_db)):
         user = await get_current_user(token, db)
         
         # Статистика
-        workers_count = db.query(Worker).count()
-        tasks_count = db.query(Task).count()
-        results_count = db.query(Result).count()
-        templates_count = db.query(Template).count()
+        workers_count = await db.scalar(select(func.count(Worker.id)))
+        tasks_count = await db.scalar(select(func.count(Task.id)))
+        results_count = await db.scalar(select(func.count(Result.id)))
+        templates_count = await db.scalar(select(func.count(Template.id)))
         
         return templates.TemplateResponse("dashboard.html", {
             "request": request,
@@ -101,14 +114,14 @@ async def dashboard(request: Request, db: Session = Depends(get_db)):
 
 # API для воркеров
 @app.get("/workers", response_class=HTMLResponse)
-async def workers_page(request: Request, db: Session = Depends(get_db)):
+async def workers_page(request: Request, db: AsyncSession = Depends(get_async_db)):
     token = request.cookies.get("access_token")
     if not token:
         return RedirectResponse(url="/login", status_code=302)
     
     try:
         user = await get_current_user(token, db)
-        workers = db.query(Worker).all()
+        workers = (await db.execute(select(Worker))).scalars().all()
         return templates.TemplateResponse("workers.html", {
             "request": request,
             "user": user,
@@ -151,18 +164,58 @@ async def add_worker(
     db.add(worker)
     db.commit()
     
-    # Установка воркера
-    try:
-        await worker_manager.setup_worker(worker)
-        worker.status = "online"
-        worker.last_ping = datetime.utcnow()
-    except Exception as e:
-        worker.status = "error"
-        db.commit()
-        raise HTTPException(status_code=500, detail=str(e))
+    # Установка воркера в фоне, прогресс доступен через /api/workers/provision/{job_id}
+    job = provisioner.start_job([worker.id])
     
-    db.commit()
-    return {"status": "success", "worker_id": worker.id}
+    return {"status": "success", "worker_id": worker.id, "job_id": job.id}
+
+@app.post("/api/workers/provision")
+async def provision_workers(
+    request: Request,
+    worker_ids: str = Form(""),
+    force: bool = Form(False),
+    db: Session = Depends(get_db)
+):
+    token = request.cookies.get("access_token")
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    user = await get_current_user(token, db)
+    
+    # Пустой список - все воркеры
+    if worker_ids.strip():
+        try:
+            ids = [int(i) for i in worker_ids.split(",") if i.strip()]
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid worker_ids")
+        workers = db.query(Worker).filter(Worker.id.in_(ids)).all()
+    else:
+        workers = db.query(Worker).all()
+    
+    if not workers:
+        raise HTTPException(status_code=404, detail="No workers to provision")
+    
+    job = provisioner.start_job([w.id for w in workers], force=force)
+    
+    return {"status": "success", "job_id": job.id}
+
+@app.get("/api/workers/provision/{job_id}")
+async def get_provision_job(
+    job_id: str,
+    request: Request,
+    db: Session = Depends(get_db)
+):
+    token = request.cookies.get("access_token")
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    user = await get_current_user(token, db)
+    
+    job = provisioner.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Provision job not found")
+    
+    return job.to_dict()
 
 @app.delete("/api/workers/{worker_id}")
 async def delete_worker(
@@ -180,11 +233,98 @@ async def delete_worker(
     if not worker:
         raise HTTPException(status_code=404, detail="Worker not found")
     
+    worker_manager.pool.close_worker(worker)
+    
     db.delete(worker)
     db.commit()
     
     return {"status": "success"}
 
+@app.get("/api/workers/pool")
+async def get_pool_stats(
+    request: Request,
+    db: Session = Depends(get_db)
+):
+    token = request.cookies.get("access_token")
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    user = await get_current_user(token, db)
+    
+    return worker_manager.pool.get_stats()
+
+@app.get("/api/workers/health")
+async def get_workers_health(
+    request: Request,
+    db: Session = Depends(get_db)
+):
+    token = request.cookies.get("access_token")
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    user = await get_current_user(token, db)
+    
+    workers = db.query(Worker).all()
+    return {
+        "workers": [{
+            "id": w.id,
+            "name": w.name,
+            "status": w.status,
+            "last_ping": w.last_ping.isoformat() if w.last_ping else None,
+            "latency_ms": w.latency_ms,
+            "load_avg": w.load_avg,
+            "cpu_count": w.cpu_count,
+            "mem_usage": w.mem_usage,
+            "consecutive_failures": w.consecutive_failures,
+            "circuit": health_monitor.breaker(w.id).to_dict()
+        } for w in workers],
+        "rounds": health_monitor.rounds
+    }
+
+@app.get("/api/workers/load")
+async def get_workers_load(
+    request: Request,
+    db: Session = Depends(get_db)
+):
+    token = request.cookies.get("access_token")
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    user = await get_current_user(token, db)
+    
+    # Оценки планировщика (первым идет наименее загруженный воркер)
+    return task_manager.scheduler.get_stats(db)
+
+# API для агентов воркеров
+@app.post("/api/agent/ingest")
+async def agent_ingest(
+    request: Request,
+    db: Session = Depends(get_db)
+):
+    worker = task_manager.agent_ingest.authenticate(request.headers.get("X-Agent-Token"), db)
+    if not worker:
+        raise HTTPException(status_code=401, detail="Invalid agent token")
+    
+    try:
+        payload = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON")
+    
+    return await task_manager.agent_ingest.handle(worker, payload, db)
+
+@app.get("/api/agent/stats")
+async def agent_stats(
+    request: Request,
+    db: Session = Depends(get_db)
+):
+    token = request.cookies.get("access_token")
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    user = await get_current_user(token, db)
+    
+    return task_manager.agent_ingest.get_stats()
+
 # API для шаблонов
 @app.get("/templates", response_class=HTMLResponse)
 async def templates_page(request: Request, db: Session = Depends(get_db)):
@@ -226,7 +366,7 @@ async def upload_template(
         # Распространение на воркеры
         workers = db.query(Worker).filter(Worker.status == "online").all()
         for worker in workers:
-            await template_manager.deploy_to_worker(template, worker)
+            await template_manager.deploy_to_worker(template, worker, db)
         
         return {"status": "success", "template_id": template.id}
     except Exception as e:
@@ -234,14 +374,21 @@ async def upload_template(
 
 # API для задач
 @app.get("/tasks", response_class=HTMLResponse)
-async def tasks_page(request: Request, db: Session = Depends(get_db)):
+async def tasks_page(request: Request, db: AsyncSession = Depends(get_async_db)):
     token = request.cookies.get("access_token")
     if not token:
         return RedirectResponse(url="/login", status_code=302)
     
     try:
         user = await get_current_user(token, db)
-        tasks = db.query(Task).order_by(Task.created_at.desc()).all()
+        # Связи, нужные шаблону, загружаются сразу (ленивая загрузка в async сессии недоступна)
+        tasks = (await db.execute(
+            select(Task).options(
+                selectinload(Task.shards),
+                selectinload(Task.template),
+                selectinload(Task.worker)
+            ).order_by(Task.created_at.desc())
+        )).scalars().all()
         return templates.TemplateResponse("tasks.html", {
             "request": request,
             "user": user,
@@ -256,6 +403,11 @@ async def create_task(
     name: str = Form(...),
     template_id: int = Form(...),
     targets_file: UploadFile = File(...),
+    workers: int = Form(0),  # Количество воркеров (0 - все доступные)
+    shards_per_worker: int = Form(1),
+    batch_size: int = Form(0),  # Размер пакета целей (0 - части по числу воркеров)
+    use_cache: bool = Form(True),  # Пропускать цели, недавно просканированные этим шаблоном
+    copy_cached_findings: bool = Form(True),
     db: Session = Depends(get_db)
 ):
     token = request.cookies.get("access_token")
@@ -270,16 +422,139 @@ async def create_task(
             name=name,
             template_id=template_id,
             targets_file=targets_file,
-            db=db
+            db=db,
+            workers_count=workers,
+            shards_per_worker=shards_per_worker,
+            batch_size=batch_size or None,
+            use_cache=use_cache,
+            copy_cached_findings=copy_cached_findings
         )
         
-        # Запуск задачи
-        await task_manager.start_task(task.id, db)
-        
-        return {"status": "success", "task_id": task.id}
+        # Цели готовятся в фоне, затем задача ставится в очередь
+        return {
+            "status": "success",
+            "task_id": task.id,
+            "task_status": task.status
+        }
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/tasks/queue")
+async def get_task_queue(
+    request: Request,
+    db: Session = Depends(get_db)
+):
+    token = request.cookies.get("access_token")
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    user = await get_current_user(token, db)
+    
+    return task_manager.dispatcher.get_stats()
+
+@app.get("/api/cache/stats")
+async def get_scan_cache_stats(
+    request: Request,
+    db: Session = Depends(get_db)
+):
+    token = request.cookies.get("access_token")
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    user = await get_current_user(token, db)
+    
+    return task_manager.scan_cache.get_stats(db)
+
+@app.get("/api/results/ingest")
+async def get_result_ingest_stats(
+    request: Request,
+    db: Session = Depends(get_db)
+):
+    token = request.cookies.get("access_token")
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    user = await get_current_user(token, db)
+    
+    # Скорость пакетной записи находок (строк в секунду) и хранилище сырого вывода
+    return {**task_manager.result_writer.get_stats(), "blobs": blob_store.get_stats()}
+
+@app.get("/api/tasks/{task_id}/stats")
+async def get_task_stats(
+    task_id: int,
+    request: Request,
+    db: AsyncSession = Depends(get_async_db)
+):
+    token = request.cookies.get("access_token")
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    user = await get_current_user(token, db)
+    
+    try:
+        return await db.run_sync(lambda session: task_manager.get_task_stats(task_id, session))
+    except Exception:
+        raise HTTPException(status_code=404, detail="Task not found")
+
+@app.post("/api/tasks/{task_id}/stop")
+async def stop_task(
+    task_id: int,
+    request: Request,
+    db: Session = Depends(get_db)
+):
+    token = request.cookies.get("access_token")
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    user = await get_current_user(token, db)
+    
+    # Остановка запущенной задачи или снятие с очереди
+    try:
+        await task_manager.stop_task(task_id, db)
+        return {"status": "success"}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.delete("/api/tasks/{task_id}")
+async def delete_task(
+    task_id: int,
+    request: Request,
+    db: Session = Depends(get_db)
+):
+    token = request.cookies.get("access_token")
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    user = await get_current_user(token, db)
+    
+    # Находки, общие с другими задачами, остаются у них
+    try:
+        await task_manager.delete_task(task_id, db)
+        return {"status": "success"}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/api/tasks/{task_id}/resume")
+async def resume_task(
+    task_id: int,
+    request: Request,
+    db: Session = Depends(get_db)
+):
+    token = request.cookies.get("access_token")
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    user = await get_current_user(token, db)
+    
+    # Возобновление остановленной или прерванной задачи с незавершенных частей
+    try:
+        result = await task_manager.resume_task(task_id, db)
+        return {"status": "success", **result}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.get("/api/tasks/{task_id}/status")
 async def get_task_status(
     task_id: int,
@@ -290,39 +565,138 @@ async def get_task_status(
     if not token:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
-    task = db.query(Task).filter(Task.id == task_id).first()
-    if not task:
+    try:
+        return await task_manager.get_task_progress(task_id, db)
+    except Exception:
         raise HTTPException(status_code=404, detail="Task not found")
-    
-    return {
-        "status": task.status,
-        "progress": task.progress,
-        "error_message": task.error_message
-    }
 
 # API для результатов
 @app.get("/results", response_class=HTMLResponse)
-async def results_page(request: Request, db: Session = Depends(get_db)):
+async def results_page(
+    request: Request,
+    severity: Optional[str] = None,
+    protocol: Optional[str] = None,
+    target: Optional[str] = None,
+    template: Optional[str] = None,
+    task_id: Optional[int] = None,
+    page: int = 1,
+    db: AsyncSession = Depends(get_async_db)
+):
     token = request.cookies.get("access_token")
     if not token:
         return RedirectResponse(url="/login", status_code=302)
     
     try:
         user = await get_current_user(token, db)
-        results = db.query(Result).order_by(Result.created_at.desc()).limit(100).all()
+        
+        # Фильтрация и пагинация в SQL
+        filters = ResultFilter(
+            severity=severity,
+            protocol=protocol,
+            template_name=template,
+            target_contains=target,
+            task_id=task_id
+        )
+        results_page, severity_counts = await db.run_sync(
+            lambda session: (
+                ResultQuery(session).page(filters, page=page, per_page=100),
+                ResultQuery(session).severity_counts(filters)
+            )
+        )
+        
         return templates.TemplateResponse("results.html", {
             "request": request,
             "user": user,
-            "results": results
+            "results": results_page["items"],
+            "page": results_page["page"],
+            "has_more": results_page["has_more"],
+            "filters": filters.to_dict(),
+            "severity_counts": severity_counts
         })
     except:
         return RedirectResponse(url="/login", status_code=302)
 
+@app.get("/api/results")
+async def list_results(
+    request: Request,
+    severity: Optional[str] = None,  # Один или несколько уровней через запятую
+    protocol: Optional[str] = None,
+    template: Optional[str] = None,
+    target: Optional[str] = None,
+    task_id: Optional[int] = None,
+    page: int = 1,
+    per_page: int = 100,
+    total: bool = False,
+    db: AsyncSession = Depends(get_async_db)
+):
+    token = request.cookies.get("access_token")
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    user = await get_current_user(token, db)
+    
+    filters = ResultFilter(
+        severity=severity,
+        protocol=protocol,
+        template_name=template,
+        target_contains=target,
+        task_id=task_id
+    )
+    return jsonable_encoder(await db.run_sync(
+        lambda session: ResultQuery(session).page(filters, page=page, per_page=per_page, with_total=total)
+    ))
+
+@app.get("/api/results/summary")
+async def results_summary(
+    request: Request,
+    group_by: str = "severity",  # Поля через запятую: severity, protocol, template_name, target, task_id
+    severity: Optional[str] = None,
+    protocol: Optional[str] = None,
+    template: Optional[str] = None,
+    target: Optional[str] = None,
+    task_id: Optional[int] = None,
+    limit: int = 100,
+    db: AsyncSession = Depends(get_async_db)
+):
+    token = request.cookies.get("access_token")
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    user = await get_current_user(token, db)
+    
+    filters = ResultFilter(
+        severity=severity,
+        protocol=protocol,
+        template_name=template,
+        target_contains=target,
+        task_id=task_id
+    )
+    try:
+        fields = [field.strip() for field in group_by.split(",") if field.strip()]
+        return await db.run_sync(
+            lambda session: ResultQuery(session).summary(filters, group_by=fields, limit=limit)
+        )
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# Поля находки в экспорте (без сырого вывода)
+EXPORT_KEYS = [
+    "id", "task_id", "last_task_id", "template_name", "protocol", "severity", "target", "matched_at",
+    "matcher_name", "extracted_results", "fingerprint", "first_seen", "last_seen", "occurrence_count", "created_at"
+]
+
 @app.get("/api/results/export")
 async def export_results(
     request: Request,
     format: str = "csv",
-    db: Session = Depends(get_db)
+    full: bool = False,  # Включить сырой вывод и curl команды (распаковка блобов)
+    severity: Optional[str] = None,
+    protocol: Optional[str] = None,
+    template: Optional[str] = None,
+    target: Optional[str] = None,
+    task_id: Optional[int] = None,
+    archived: bool = False,  # Выгрузка из архива вместо горячей таблицы
+    db: AsyncSession = Depends(get_async_db)
 ):
     token = request.cookies.get("access_token")
     if not token:
@@ -330,56 +704,275 @@ async def export_results(
     
     user = await get_current_user(token, db)
     
-    results = db.query(Result).all()
+    if format not in ("csv", "json"):
+        raise HTTPException(status_code=400, detail="Invalid format")
+    
+    filters = ResultFilter(
+        severity=severity,
+        protocol=protocol,
+        template_name=template,
+        target_contains=target,
+        task_id=task_id
+    )
+    stmt = select_rows(filters)
+    if full:
+        stmt = stmt.add_columns(Result.fingerprint, Result.extracted_results, Result.raw_output, Result.raw_ref, Result.curl_command)
+    else:
+        stmt = stmt.add_columns(Result.fingerprint, Result.extracted_results)
+    
+    # Потоковая выгрузка: строки читаются из БД пакетами в отдельной сессии,
+    # которая живет, пока отправляется ответ
+    async def export_rows():
+        if archived:
+            # Файлы архива читаются в пуле потоков, сырой вывод уже в них
+            async for batch in iterate_in_threadpool(task_manager.result_archiver.iter_archived(filters)):
+                for row in batch:
+                    item = {key: row.get(key) for key in EXPORT_KEYS}
+                    item["occurrence_count"] = item["occurrence_count"] or 1
+                    if full:
+                        item["raw_output"] = row.get("raw_output")
+                        item["curl_command"] = row.get("curl_command")
+                    yield item
+            return
+        
+        async with AsyncSessionLocal() as session:
+            rows = await session.stream(stmt.execution_options(yield_per=1000))
+            async for row in rows:
+                item = {
+                    "id": row.id,
+                    "task_id": row.task_id,
+                    "last_task_id": row.last_task_id,
+                    "template_name": row.template_name,
+                    "protocol": row.protocol,
+                    "severity": row.severity,
+                    "target": row.target,
+                    "matched_at": row.matched_at,
+                    "matcher_name": row.matcher_name,
+                    "extracted_results": row.extracted_results,
+                    "fingerprint": row.fingerprint,
+                    "first_seen": row.first_seen.isoformat() if row.first_seen else None,
+                    "last_seen": row.last_seen.isoformat() if row.last_seen else None,
+                    "occurrence_count": row.occurrence_count or 1,
+                    "created_at": row.created_at.isoformat() if row.created_at else None
+                }
+                if full:
+                    item["raw_output"] = blob_store.raw_output(row)
+                    item["curl_command"] = blob_store.curl_command(row, item["raw_output"])
+                yield item
+    
+    from fastapi.responses import StreamingResponse
     
     if format == "csv":
         # Экспорт в CSV
         import csv
         from io import StringIO
-        from fastapi.responses import StreamingResponse
         
-        output = StringIO()
-        writer = csv.writer(output)
-        writer.writerow(["ID", "Task", "Template", "Protocol", "Severity", "Target", "Matched At", "Created At"])
+        columns = [
+            ("ID", "id"), ("Task", "task_id"), ("Template", "template_name"), ("Protocol", "protocol"),
+            ("Severity", "severity"), ("Target", "target"), ("Matched At", "matched_at"),
+            ("First Seen", "first_seen"), ("Last Seen", "last_seen"), ("Occurrences", "occurrence_count")
+        ]
+        if full:
+            columns += [("Curl Command", "curl_command"), ("Raw Output", "raw_output")]
         
-        for result in results:
-            writer.writerow([
-                result.id,
-                result.task_id,
-                result.template_name,
-                result.protocol,
-                result.severity,
-                result.target,
-                result.matched_at,
-                result.created_at
-            ])
+        async def generate_csv():
+            output = StringIO()
+            writer = csv.writer(output)
+            writer.writerow([title for title, _ in columns])
+            async for item in export_rows():
+                writer.writerow([item[key] for _, key in columns])
+                if output.tell() > 64 * 1024:
+                    yield output.getvalue()
+                    output.seek(0)
+                    output.truncate()
+            yield output.getvalue()
         
-        output.seek(0)
         return StreamingResponse(
-            output,
+            generate_csv(),
             media_type="text/csv",
             headers={"Content-Disposition": "attachment; filename=results.csv"}
         )
     
-    elif format == "json":
-        # Экспорт в JSON
-        data = [{
-            "id": r.id,
-            "task_id": r.task_id,
-            "template_name": r.template_name,
-            "protocol": r.protocol,
-            "severity": r.severity,
-            "target": r.target,
-            "matched_at": r.matched_at,
-            "matcher_name": r.matcher_name,
-            "extracted_results": r.extracted_results,
-            "created_at": r.created_at.isoformat() if r.created_at else None
-        } for r in results]
-        
-        return JSONResponse(content=data)
+    # Экспорт в JSON (массив собирается потоком)
+    async def generate_json():
+        yield "["
+        index = 0
+        async for item in export_rows():
+            yield ("," if index else "") + json.dumps(item)
+            index += 1
+        yield "]"
     
-    else:
-        raise HTTPException(status_code=400, detail="Invalid format")
+    return StreamingResponse(generate_json(), media_type="application/json")
+
+@app.get("/api/results/{result_id}")
+async def get_result(
+    result_id: int,
+    request: Request,
+    db: AsyncSession = Depends(get_async_db)
+):
+    token = request.cookies.get("access_token")
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    user = await get_current_user(token, db)
+    
+    result = await db.get(Result, result_id)
+    if not result:
+        raise HTTPException(status_code=404, detail="Result not found")
+    
+    # Сырой вывод распаковывается только здесь и при полном экспорте
+    raw_output = blob_store.raw_output(result)
+    return {
+        "id": result.id,
+        "task_id": result.task_id,
+        "last_task_id": result.last_task_id,
+        "template_name": result.template_name,
+        "protocol": result.protocol,
+        "severity": result.severity,
+        "target": result.target,
+        "matched_at": result.matched_at,
+        "matcher_name": result.matcher_name,
+        "extracted_results": result.extracted_results,
+        "fingerprint": result.fingerprint,
+        "first_seen": result.first_seen.isoformat() if result.first_seen else None,
+        "last_seen": result.last_seen.isoformat() if result.last_seen else None,
+        "occurrence_count": result.occurrence_count or 1,
+        "curl_command": blob_store.curl_command(result, raw_output),
+        "raw_output": raw_output
+    }
+
+@app.get("/api/archives")
+async def list_archives(
+    request: Request,
+    task_id: Optional[int] = None,
+    limit: int = 100,
+    db: Session = Depends(get_db)
+):
+    token = request.cookies.get("access_token")
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    user = await get_current_user(token, db)
+    
+    archiver = task_manager.result_archiver
+    return {
+        "stats": archiver.get_stats(db),
+        "archives": archiver.list_archives(db, task_id=task_id, limit=limit)
+    }
+
+@app.get("/api/archives/results")
+async def list_archived_results(
+    request: Request,
+    severity: Optional[str] = None,
+    protocol: Optional[str] = None,
+    template: Optional[str] = None,
+    target: Optional[str] = None,
+    task_id: Optional[int] = None,
+    page: int = 1,
+    per_page: int = 100,
+    db: Session = Depends(get_db)
+):
+    token = request.cookies.get("access_token")
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    user = await get_current_user(token, db)
+    
+    # Поиск по архиву читает файлы целиком - выполняется вне цикла событий
+    filters = ResultFilter(
+        severity=severity,
+        protocol=protocol,
+        template_name=template,
+        target_contains=target,
+        task_id=task_id
+    )
+    return await run_in_threadpool(task_manager.result_archiver.page, filters, page, per_page)
+
+@app.post("/api/archives/run")
+async def run_retention(request: Request, db: Session = Depends(get_db)):
+    token = request.cookies.get("access_token")
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    user = await get_current_user(token, db)
+    
+    # Внеочередное применение политик хранения
+    try:
+        result = await task_manager.result_archiver.apply_retention()
+        return {"status": "success", **result}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/api/tasks/{task_id}/archive")
+async def archive_task(
+    task_id: int,
+    request: Request,
+    db: Session = Depends(get_db)
+):
+    token = request.cookies.get("access_token")
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    user = await get_current_user(token, db)
+    
+    # Перенос всех находок завершенной задачи в архив
+    try:
+        archived = await task_manager.result_archiver.archive_task(task_id, db)
+        return {"status": "success", "archived": archived}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/db/schema")
+async def db_schema(request: Request, db: Session = Depends(get_db)):
+    token = request.cookies.get("access_token")
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    user = await get_current_user(token, db)
+    
+    return {
+        "dialect": db.get_bind().dialect.name,
+        "revision": schema_revision(),
+        "missing_indexes": check_indexes()
+    }
+
+@app.get("/api/db/pool")
+async def db_pool(request: Request, db: AsyncSession = Depends(get_async_db)):
+    token = request.cookies.get("access_token")
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    user = await get_current_user(token, db)
+    
+    # Заполненность пула подключений и очередь записи находок
+    return {"pool": get_db_pool_stats(), "ingest_queue": task_manager.ingest_queue.get_stats()}
+
+@app.on_event("startup")
+async def startup_event():
+    # Схема БД: миграции и проверка индексов до запуска фоновых циклов
+    loop = asyncio.get_running_loop()
+    if settings.db_auto_migrate:
+        await loop.run_in_executor(None, upgrade_schema)
+    if settings.db_index_check:
+        await loop.run_in_executor(None, report_schema)
+    
+    worker_manager.pool.start()
+    health_monitor.start()
+    task_manager.dispatcher.start()
+    task_manager.scan_cache.start()
+    task_manager.result_archiver.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    task_manager.result_archiver.stop()
+    task_manager.scan_cache.stop()
+    task_manager.dispatcher.stop()
+    health_monitor.stop()
+    worker_manager.pool.close_all()
+    task_manager.ingest_queue.close()
+    if async_engine is not None:
+        # Подключения aiosqlite держат свои потоки до закрытия
+        await async_engine.dispose()
 
 # Запуск при импорте
 if __name__ == "__main__":
@@ -0,0 +1,218 @@
+"""Базовая схема
+
+Схема, которую до миграций создавал Base.metadata.create_all. На
+пустой БД таблицы создаются целиком; на БД, созданной create_all
+одной из прошлых версий, добавляются только недостающие таблицы,
+колонки и индексы (create_all не изменял существующие таблицы).
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 00:00:00
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def _tables(metadata: sa.MetaData):
+    sa.Table(
+        "users", metadata,
+        sa.Column("id", sa.Integer, primary_key=True, index=True),
+        sa.Column("username", sa.String(50), unique=True, index=True, nullable=False),
+        sa.Column("password_hash", sa.String(255), nullable=False),
+        sa.Column("is_active", sa.Boolean, default=True),
+        sa.Column("is_admin", sa.Boolean, default=False),
+        sa.Column("created_at", sa.DateTime, default=datetime.utcnow)
+    )
+    sa.Table(
+        "workers", metadata,
+        sa.Column("id", sa.Integer, primary_key=True, index=True),
+        sa.Column("name", sa.String(100), unique=True, nullable=False),
+        sa.Column("ip_address", sa.String(45), unique=True, nullable=False),
+        sa.Column("ssh_port", sa.Integer, default=22),
+        sa.Column("username", sa.String(50), nullable=False),
+        sa.Column("password", sa.String(255)),
+        sa.Column("status", sa.String(20), default="offline"),
+        sa.Column("last_ping", sa.DateTime),
+        sa.Column("latency_ms", sa.Float),
+        sa.Column("load_avg", sa.Float),
+        sa.Column("cpu_count", sa.Integer),
+        sa.Column("mem_usage", sa.Float),
+        sa.Column("consecutive_failures", sa.Integer, default=0),
+        sa.Column("agent_token", sa.String(64), unique=True),
+        sa.Column("agent_last_seen", sa.DateTime),
+        sa.Column("created_at", sa.DateTime, default=datetime.utcnow)
+    )
+    sa.Table(
+        "templates", metadata,
+        sa.Column("id", sa.Integer, primary_key=True, index=True),
+        sa.Column("name", sa.String(255), unique=True, nullable=False),
+        sa.Column("filename", sa.String(255), nullable=False),
+        sa.Column("file_path", sa.String(500), nullable=False),
+        sa.Column("file_size", sa.Integer),
+        sa.Column("uploaded_at", sa.DateTime, default=datetime.utcnow),
+        sa.Column("is_active", sa.Boolean, default=True),
+        sa.Column("content_hash", sa.String(64))
+    )
+    sa.Table(
+        "worker_templates", metadata,
+        sa.Column("id", sa.Integer, primary_key=True, index=True),
+        sa.Column("worker_id", sa.Integer, sa.ForeignKey("workers.id"), nullable=False),
+        sa.Column("template_id", sa.Integer, sa.ForeignKey("templates.id"), nullable=False),
+        sa.Column("deployed_at", sa.DateTime, default=datetime.utcnow),
+        sa.UniqueConstraint("worker_id", "template_id")
+    )
+    sa.Table(
+        "tasks", metadata,
+        sa.Column("id", sa.Integer, primary_key=True, index=True),
+        sa.Column("name", sa.String(255), nullable=False),
+        sa.Column("status", sa.String(20), default="pending"),
+        sa.Column("worker_id", sa.Integer, sa.ForeignKey("workers.id")),
+        sa.Column("template_id", sa.Integer, sa.ForeignKey("templates.id")),
+        sa.Column("targets_file", sa.String(500)),
+        sa.Column("targets_count", sa.Integer, default=0),
+        sa.Column("cached_count", sa.Integer, default=0),
+        sa.Column("batch_size", sa.Integer, default=0),
+        sa.Column("progress", sa.Float, default=0.0),
+        sa.Column("results_count", sa.Integer, default=0),
+        sa.Column("requests_done", sa.BigInteger, default=0),
+        sa.Column("requests_total", sa.BigInteger, default=0),
+        sa.Column("rps", sa.Float, default=0.0),
+        sa.Column("errors_count", sa.Integer, default=0),
+        sa.Column("eta_seconds", sa.Integer),
+        sa.Column("started_at", sa.DateTime),
+        sa.Column("completed_at", sa.DateTime),
+        sa.Column("created_at", sa.DateTime, default=datetime.utcnow),
+        sa.Column("error_message", sa.Text)
+    )
+    sa.Table(
+        "task_shards", metadata,
+        sa.Column("id", sa.Integer, primary_key=True, index=True),
+        sa.Column("task_id", sa.Integer, sa.ForeignKey("tasks.id"), nullable=False, index=True),
+        sa.Column("shard_index", sa.Integer, nullable=False),
+        sa.Column("job_id", sa.String(64), unique=True, nullable=False),
+        sa.Column("worker_id", sa.Integer, sa.ForeignKey("workers.id")),
+        sa.Column("status", sa.String(20), default="pending"),
+        sa.Column("targets_file", sa.String(500)),
+        sa.Column("targets_count", sa.Integer, default=0),
+        sa.Column("progress", sa.Float, default=0.0),
+        sa.Column("screen_session", sa.String(100)),
+        sa.Column("backup_of_id", sa.Integer, sa.ForeignKey("task_shards.id")),
+        sa.Column("attempt", sa.Integer, default=0),
+        sa.Column("checkpoint_file", sa.String(500)),
+        sa.Column("results_offset", sa.BigInteger, default=0),
+        sa.Column("results_count", sa.Integer, default=0),
+        sa.Column("parse_errors", sa.Integer, default=0),
+        sa.Column("requests_done", sa.BigInteger, default=0),
+        sa.Column("requests_total", sa.BigInteger, default=0),
+        sa.Column("rps", sa.Float, default=0.0),
+        sa.Column("errors_count", sa.Integer, default=0),
+        sa.Column("eta_seconds", sa.Integer),
+        sa.Column("started_at", sa.DateTime),
+        sa.Column("completed_at", sa.DateTime),
+        sa.Column("created_at", sa.DateTime, default=datetime.utcnow),
+        sa.Column("error_message", sa.Text)
+    )
+    sa.Table(
+        "task_stats", metadata,
+        sa.Column("id", sa.Integer, primary_key=True, index=True),
+        sa.Column("task_id", sa.Integer, sa.ForeignKey("tasks.id"), nullable=False, index=True),
+        sa.Column("shard_id", sa.Integer, sa.ForeignKey("task_shards.id")),
+        sa.Column("requests_done", sa.BigInteger, default=0),
+        sa.Column("requests_total", sa.BigInteger, default=0),
+        sa.Column("rps", sa.Float, default=0.0),
+        sa.Column("matched", sa.Integer, default=0),
+        sa.Column("errors_count", sa.Integer, default=0),
+        sa.Column("progress", sa.Float, default=0.0),
+        sa.Column("eta_seconds", sa.Integer),
+        sa.Column("created_at", sa.DateTime, default=datetime.utcnow)
+    )
+    sa.Table(
+        "scan_cache", metadata,
+        sa.Column("id", sa.Integer, primary_key=True, index=True),
+        sa.Column("template_hash", sa.String(64), nullable=False),
+        sa.Column("target_key", sa.String(32), nullable=False),
+        sa.Column("task_id", sa.Integer),
+        sa.Column("scanned_at", sa.DateTime, default=datetime.utcnow),
+        sa.Column("expires_at", sa.DateTime, index=True),
+        sa.UniqueConstraint("template_hash", "target_key")
+    )
+    sa.Table(
+        "results", metadata,
+        sa.Column("id", sa.Integer, primary_key=True, index=True),
+        sa.Column("task_id", sa.Integer, sa.ForeignKey("tasks.id")),
+        sa.Column("shard_id", sa.Integer, sa.ForeignKey("task_shards.id")),
+        sa.Column("template_name", sa.String(255)),
+        sa.Column("protocol", sa.String(20)),
+        sa.Column("severity", sa.String(20)),
+        sa.Column("target", sa.String(500)),
+        sa.Column("matched_at", sa.String(500)),
+        sa.Column("matcher_name", sa.String(255)),
+        sa.Column("extracted_results", sa.Text),
+        sa.Column("curl_command", sa.Text),
+        sa.Column("raw_output", sa.Text),
+        sa.Column("raw_ref", sa.String(64)),
+        sa.Column("fingerprint", sa.String(64), unique=True, index=True),
+        sa.Column("first_seen", sa.DateTime, default=datetime.utcnow),
+        sa.Column("last_seen", sa.DateTime, default=datetime.utcnow),
+        sa.Column("occurrence_count", sa.Integer, default=1),
+        sa.Column("last_task_id", sa.Integer),
+        sa.Column("created_at", sa.DateTime, default=datetime.utcnow)
+    )
+    return metadata.sorted_tables
+
+
+def _add_columns(table: sa.Table, columns: list):
+    """Добавление колонок в существующую таблицу
+
+    На SQLite batch режим пересоздает таблицу (ALTER TABLE не добавляет
+    внешние ключи), на остальных СУБД выполняется обычный ALTER TABLE.
+    Уникальность обеспечивается отдельным индексом, счетчики старых
+    строк заполняются значением по умолчанию.
+    """
+    with op.batch_alter_table(table.name) as batch:
+        for column in columns:
+            default = column.default.arg if column.default is not None and column.default.is_scalar else None
+            batch.add_column(sa.Column(
+                column.name,
+                column.type,
+                *[sa.ForeignKey(fk.target_fullname, name=f"fk_{table.name}_{column.name}") for fk in column.foreign_keys],
+                server_default=sa.text(repr(default)) if isinstance(default, (int, float)) and not isinstance(default, bool) else None
+            ))
+
+    for column in columns:
+        if column.unique and not column.index:
+            op.create_index(f"uq_{table.name}_{column.name}", table.name, [column.name], unique=True)
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    existing_tables = set(inspector.get_table_names())
+
+    for table in _tables(sa.MetaData()):
+        if table.name not in existing_tables:
+            table.create(bind)
+            continue
+
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        missing = [column for column in table.columns if column.name not in columns]
+        if missing:
+            _add_columns(table, missing)
+
+        indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in indexes:
+                op.create_index(index.name, table.name, [column.name for column in index.columns], unique=index.unique)
+
+
+def downgrade():
+    for table in reversed(_tables(sa.MetaData())):
+        op.drop_table(table.name)
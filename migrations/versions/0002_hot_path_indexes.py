@@ -0,0 +1,50 @@
+"""Индексы для частых запросов
+
+Список и фильтры находок, каскадное удаление задачи, очередь
+диспетчера, выбор частей и воркеров по статусу, статистика задачи
+и очистка кэша результатов.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ("ix_results_task_id", "results", ["task_id"]),
+    ("ix_results_last_task_id", "results", ["last_task_id"]),
+    ("ix_results_shard_id", "results", ["shard_id"]),
+    ("ix_results_last_seen", "results", ["last_seen", "id"]),
+    ("ix_results_severity_last_seen", "results", ["severity", "last_seen"]),
+    ("ix_results_template_name", "results", ["template_name"]),
+    ("ix_results_target", "results", ["target"]),
+    ("ix_results_created_at", "results", ["created_at"]),
+    ("ix_tasks_status_created_at", "tasks", ["status", "created_at"]),
+    ("ix_tasks_created_at", "tasks", ["created_at"]),
+    ("ix_task_shards_status_task_id", "task_shards", ["status", "task_id"]),
+    ("ix_task_shards_worker_id_status", "task_shards", ["worker_id", "status"]),
+    ("ix_task_shards_task_id_shard_index", "task_shards", ["task_id", "shard_index"]),
+    ("ix_task_stats_task_id_created_at", "task_stats", ["task_id", "created_at"]),
+    ("ix_workers_status", "workers", ["status"]),
+    ("ix_scan_cache_task_id", "scan_cache", ["task_id"]),
+]
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    for name, table, columns in INDEXES:
+        # Индекс мог быть создан вручную до появления миграции
+        if name not in {index["name"] for index in inspector.get_indexes(table)}:
+            op.create_index(name, table, columns)
+
+
+def downgrade():
+    for name, table, columns in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,45 @@
+"""Архив находок
+
+Манифест файлов архива и счетчик заархивированных находок задачи.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 00:00:00
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "result_archives",
+        sa.Column("id", sa.Integer, primary_key=True, index=True),
+        sa.Column("task_id", sa.Integer, sa.ForeignKey("tasks.id"), index=True),
+        sa.Column("file_path", sa.String(500), nullable=False),
+        sa.Column("rows_count", sa.Integer, default=0),
+        sa.Column("size_bytes", sa.BigInteger, default=0),
+        sa.Column("sha256", sa.String(64)),
+        sa.Column("severity_counts", sa.Text),
+        sa.Column("first_seen_min", sa.DateTime),
+        sa.Column("last_seen_max", sa.DateTime),
+        sa.Column("reason", sa.String(20)),
+        sa.Column("created_at", sa.DateTime, default=datetime.utcnow)
+    )
+    with op.batch_alter_table("tasks") as batch:
+        batch.add_column(sa.Column("archived_count", sa.Integer, server_default=sa.text("0")))
+        batch.add_column(sa.Column("retention_days", sa.Integer))
+
+
+def downgrade():
+    with op.batch_alter_table("tasks") as batch:
+        batch.drop_column("retention_days")
+        batch.drop_column("archived_count")
+    op.drop_table("result_archives")
@@ -0,0 +1,47 @@
+"""Учет находок по частям
+
+Вклад каждой части в occurrence_count, last_seen и last_task_id
+находки хранится отдельно, чтобы снятие части (резервная копия
+опередила исходную) откатывало только ее вклад. Счетчики уже
+сохраненных находок переносятся одной строкой без части.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 00:00:00
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "result_occurrences",
+        sa.Column("id", sa.Integer, primary_key=True, index=True),
+        sa.Column("fingerprint", sa.String(64), nullable=False),
+        sa.Column("task_id", sa.Integer),
+        sa.Column("shard_id", sa.Integer),
+        sa.Column("occurrence_count", sa.Integer, default=1),
+        sa.Column("first_seen", sa.DateTime, default=datetime.utcnow),
+        sa.Column("last_seen", sa.DateTime, default=datetime.utcnow),
+        sa.UniqueConstraint("fingerprint", "shard_id")
+    )
+    op.create_index("ix_result_occurrences_shard_id", "result_occurrences", ["shard_id"])
+
+    op.execute(
+        "INSERT INTO result_occurrences (fingerprint, task_id, shard_id, occurrence_count, first_seen, last_seen) "
+        "SELECT fingerprint, COALESCE(last_task_id, task_id), NULL, COALESCE(occurrence_count, 1), first_seen, last_seen "
+        "FROM results WHERE fingerprint IS NOT NULL"
+    )
+
+
+def downgrade():
+    op.drop_index("ix_result_occurrences_shard_id", table_name="result_occurrences")
+    op.drop_table("result_occurrences")
@@ -0,0 +1,33 @@
+"""Задачи находок по журналу вхождений
+
+Индекс result_occurrences по task_id для фильтра находок по задаче и
+строки с нулевым счетчиком для задач, в которых находка появилась
+впервые: 0004 перенес счетчики только на последнюю задачу находки.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 00:00:00
+"""
+from alembic import op
+
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("ix_result_occurrences_task_id", "result_occurrences", ["task_id"])
+
+    op.execute(
+        "INSERT INTO result_occurrences (fingerprint, task_id, shard_id, occurrence_count, first_seen, last_seen) "
+        "SELECT fingerprint, task_id, NULL, 0, first_seen, first_seen "
+        "FROM results WHERE fingerprint IS NOT NULL AND task_id IS NOT NULL "
+        "AND last_task_id IS NOT NULL AND last_task_id <> task_id"
+    )
+
+
+def downgrade():
+    op.execute("DELETE FROM result_occurrences WHERE shard_id IS NULL AND occurrence_count = 0")
+    op.drop_index("ix_result_occurrences_task_id", table_name="result_occurrences")
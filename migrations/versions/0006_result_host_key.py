@@ -0,0 +1,50 @@
+"""Ключ хоста находки
+
+results.host_key - ключ хоста нормализованной цели, по которому
+находки целей, пропущенных по кэшу результатов, выбираются в SQL.
+Для сохраненных находок ключ считается пакетами.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 5000
+
+
+def upgrade():
+    from modules.scan_cache import host_key
+
+    with op.batch_alter_table("results") as batch:
+        batch.add_column(sa.Column("host_key", sa.String(32)))
+    op.create_index("ix_results_host_key", "results", ["host_key"])
+
+    bind = op.get_bind()
+    results = sa.table("results", sa.column("id"), sa.column("target"), sa.column("host_key"))
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(results.c.id, results.c.target).where(results.c.id > last_id)
+            .order_by(results.c.id).limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        bind.execute(
+            results.update().where(results.c.id == sa.bindparam("row_id")).values(host_key=sa.bindparam("key")),
+            [{"row_id": row_id, "key": host_key(target)} for row_id, target in rows]
+        )
+        last_id = rows[-1][0]
+
+
+def downgrade():
+    op.drop_index("ix_results_host_key", table_name="results")
+    with op.batch_alter_table("results") as batch:
+        batch.drop_column("host_key")
@@ -0,0 +1,57 @@
+"""Задачи файлов архива
+
+Список задач, находки которых есть в каждом файле архива, для выбора
+файлов по задаче. Для уже записанных файлов список берется из колонок
+task_id и last_task_id их строк (файл без строк - задача-владелец).
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18 00:00:00
+"""
+import gzip
+import json
+import os
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def _file_tasks(path: str) -> set:
+    tasks = set()
+    if not path or not os.path.exists(path):
+        return tasks
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                row = json.loads(line)
+                tasks.update(task_id for task_id in (row.get("task_id"), row.get("last_task_id")) if task_id)
+    return tasks
+
+
+def upgrade():
+    op.create_table(
+        "result_archive_tasks",
+        sa.Column("archive_id", sa.Integer, sa.ForeignKey("result_archives.id"), primary_key=True),
+        sa.Column("task_id", sa.Integer, primary_key=True)
+    )
+    op.create_index("ix_result_archive_tasks_task_id", "result_archive_tasks", ["task_id"])
+
+    bind = op.get_bind()
+    links = sa.table("result_archive_tasks", sa.column("archive_id"), sa.column("task_id"))
+    for archive_id, owner_id, path in bind.execute(
+        sa.text("SELECT id, task_id, file_path FROM result_archives")
+    ).all():
+        tasks = _file_tasks(path) | ({owner_id} if owner_id else set())
+        if tasks:
+            bind.execute(links.insert(), [{"archive_id": archive_id, "task_id": task_id} for task_id in sorted(tasks)])
+
+
+def downgrade():
+    op.drop_index("ix_result_archive_tasks_task_id", table_name="result_archive_tasks")
+    op.drop_table("result_archive_tasks")
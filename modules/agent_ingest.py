@@ -0,0 +1,169 @@
+import asyncio
+import hmac
+import time
+from datetime import datetime
+from typing import Dict, Optional
+
+from sqlalchemy.orm import Session
+
+from database import TaskShard, Worker
+from config import settings
+
+
+class AgentIngest:
+    """Прием находок, статусов и метрик от агентов воркеров
+
+    Агент присылает находки кусками с байтовыми смещениями в файле
+    результатов части задачи. Кусок принимается только если его начало
+    совпадает с TaskShard.results_offset (повторно проверяется при
+    записи, в одной транзакции с находками), а в ответ агент получает
+    актуальные смещения, поэтому повторная отправка после обрыва связи
+    не создает дубликатов.
+    """
+
+    def __init__(self, task_manager):
+        self.task_manager = task_manager
+        self.status: Dict[str, dict] = {}  # job_id части -> последний статус
+        self.resources: Dict[int, dict] = {}  # worker_id -> загрузка воркера
+        self.last_seen: Dict[int, float] = {}  # worker_id -> время последнего запроса
+        self._events: Dict[str, asyncio.Event] = {}
+
+        # Счетчики
+        self.stats = {
+            "requests": 0,
+            "findings": 0,
+            "rejected_batches": 0,
+            "exits": 0
+        }
+
+    def authenticate(self, token: str, db: Session) -> Optional[Worker]:
+        """Поиск воркера по токену агента"""
+        if not token:
+            return None
+        worker = db.query(Worker).filter(Worker.agent_token == token).first()
+        if worker is None or not hmac.compare_digest(worker.agent_token, token):
+            return None
+        return worker
+
+    def is_active(self, worker_id: int) -> bool:
+        """Агент воркера присылал данные недавно"""
+        last_seen = self.last_seen.get(worker_id)
+        return last_seen is not None and time.monotonic() - last_seen < settings.agent_timeout
+
+    def _event(self, job_id: str) -> asyncio.Event:
+        event = self._events.get(job_id)
+        if event is None:
+            event = asyncio.Event()
+            self._events[job_id] = event
+        return event
+
+    async def wait_update(self, job_id: str, timeout: float) -> Optional[dict]:
+        """Ожидание следующего статуса части задачи от агента (None - таймаут)"""
+        event = self._event(job_id)
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        event.clear()
+        return self.status.get(job_id)
+
+    def forget(self, job_id: str):
+        self.status.pop(job_id, None)
+        self._events.pop(job_id, None)
+
+    async def handle(self, worker: Worker, payload: dict, db: Session) -> dict:
+        """Обработка одного запроса агента"""
+        self.stats["requests"] += 1
+        self.last_seen[worker.id] = time.monotonic()
+        worker.agent_last_seen = datetime.utcnow()
+
+        if payload.get("resources"):
+            self.resources[worker.id] = payload["resources"]
+
+        job_ids = set(payload.get("jobs", []))
+        job_ids.update(batch.get("job_id") for batch in payload.get("findings", []))
+        job_ids.update(event.get("job_id") for event in payload.get("events", []))
+        job_ids.discard(None)
+
+        shards = {}
+        if job_ids:
+            shards = {
+                s.job_id: s for s in db.query(TaskShard).filter(
+                    TaskShard.job_id.in_(job_ids),
+                    TaskShard.worker_id == worker.id
+                ).all()
+            }
+
+        updated = set()
+
+        # Находки
+        for batch in payload.get("findings", []):
+            shard = shards.get(batch.get("job_id"))
+            if shard is None or shard.status != "running" or shard.backup_of_id:
+                # Находки резервной копии принимаются контроллером после ее завершения
+                continue
+            if batch.get("offset") != (shard.results_offset or 0):
+                # Кусок не с того места - агент перемотает по ответу
+                self.stats["rejected_batches"] += 1
+                continue
+            self.stats["findings"] += await self.task_manager.ingest_queue.run(
+                self.task_manager.store_result_lines,
+                shard, batch.get("lines", []), batch["offset"], batch["end_offset"], db
+            )
+            if (shard.results_offset or 0) != batch["end_offset"]:
+                # Тот же диапазон уже прочитан по SSH - кусок отброшен при записи
+                self.stats["rejected_batches"] += 1
+                continue
+            updated.add(shard.job_id)
+
+        # Статусы и завершения
+        acked_exits = []
+        for event in payload.get("events", []):
+            job_id = event.get("job_id")
+            shard = shards.get(job_id)
+            if shard is None or shard.status not in ("pending", "running"):
+                # Часть неизвестна или уже завершена - агент может ее забыть
+                if event.get("type") == "exit":
+                    acked_exits.append(job_id)
+                continue
+
+            if event.get("type") == "status":
+                status = dict(self.status.get(job_id, {}))
+                status.update({
+                    "is_running": event.get("is_running", True),
+                    "log_tail": event.get("log_tail", ""),
+                    "results_size": event.get("results_size", 0),
+                    "load_avg": self.resources.get(worker.id, {}).get("load_avg")
+                })
+                self.status[job_id] = status
+                updated.add(job_id)
+
+            elif event.get("type") == "exit":
+                status = dict(self.status.get(job_id, {}))
+                status.update({"is_running": False, "exit_code": event.get("exit_code")})
+                self.status[job_id] = status
+                self.stats["exits"] += 1
+                acked_exits.append(job_id)
+                updated.add(job_id)
+
+        # Задания агента, которых контроллер больше не ведет
+        for job_id in payload.get("jobs", []):
+            shard = shards.get(job_id)
+            if (shard is None or shard.status not in ("pending", "running")) and job_id not in acked_exits:
+                acked_exits.append(job_id)
+
+        db.commit()
+
+        for job_id in updated:
+            self._event(job_id).set()
+
+        return {
+            "offsets": {s.job_id: s.results_offset or 0 for s in shards.values()},
+            "acked_exits": acked_exits
+        }
+
+    def get_stats(self) -> dict:
+        stats = dict(self.stats)
+        stats["active_agents"] = len([w for w in self.last_seen if self.is_active(w)])
+        stats["resources"] = self.resources
+        return stats
@@ -1,7 +1,9 @@
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Union
 from jose import JWTError, jwt
 from fastapi import HTTPException, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from database import User
 from config import settings
@@ -30,7 +32,7 @@ def verify_user(db: Session, username: str, password: str) -> Optional[User]:
     return user
 
 # Получение текущего пользователя из токена
-async def get_current_user(token: str, db: Session) -> User:
+async def get_current_user(token: str, db: Union[Session, AsyncSession]) -> User:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -46,8 +48,11 @@ async def get_current_user(token: str, db: Session) -> User:
     except JWTError:
         raise credentials_exception
     
-    # Получение пользователя из БД
-    user = db.query(User).filter(User.username == username).first()
+    # Получение пользователя из БД (синхронная или асинхронная сессия)
+    if isinstance(db, AsyncSession):
+        user = (await db.execute(select(User).filter(User.username == username))).scalars().first()
+    else:
+        user = db.query(User).filter(User.username == username).first()
     if user is None:
         raise credentials_exception
     
@@ -0,0 +1,158 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+import zlib
+from typing import Optional
+
+from config import settings
+
+# zstandard опционален, без него используется zlib
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CODEC_EXTENSIONS = {"zstd": ".zst", "zlib": ".z"}
+
+
+class BlobStore:
+    """Хранилище сырого вывода находок на диске с адресацией по содержимому
+
+    Блоб хранится сжатым (zstd при наличии, иначе zlib) по пути
+    blobs_dir/ab/cd/<sha256>.<ext>, в БД остается только SHA-256.
+    Одинаковый вывод хранится один раз. Чтение и распаковка выполняются
+    только при открытии отдельной находки или полном экспорте.
+    """
+
+    def __init__(self, root: Optional[str] = None):
+        self.root = root or settings.blobs_dir
+        self.codec = self._pick_codec()
+        self._local = threading.local()  # Компрессор zstd на поток (объекты zstd не потокобезопасны)
+        self.stats = {
+            "written": 0,
+            "deduplicated": 0,
+            "bytes_raw": 0,
+            "bytes_stored": 0,
+            "read": 0
+        }
+
+    def _pick_codec(self) -> str:
+        if settings.blob_compression in ("auto", "zstd") and zstandard is not None:
+            return "zstd"
+        return "zlib"
+
+    def _compress(self, data: bytes) -> bytes:
+        if self.codec != "zstd":
+            return zlib.compress(data, 6)
+        compressor = getattr(self._local, "compressor", None)
+        if compressor is None:
+            compressor = self._local.compressor = zstandard.ZstdCompressor(level=3)
+        return compressor.compress(data)
+
+    def _path(self, ref: str, codec: str) -> str:
+        return os.path.join(self.root, ref[:2], ref[2:4], ref + CODEC_EXTENSIONS[codec])
+
+    def put(self, data: bytes) -> str:
+        """Сохранение блоба; возвращает ссылку (SHA-256 несжатых данных)"""
+        ref = hashlib.sha256(data).hexdigest()
+        existing = self._existing_path(ref)
+        if existing is not None:
+            try:
+                # Повторное использование продлевает блоб: сборка мусора не
+                # удаляет блобы моложе blob_gc_grace_seconds, пока ссылка на
+                # него еще не зафиксирована в БД
+                os.utime(existing)
+                self.stats["deduplicated"] += 1
+                return ref
+            except FileNotFoundError:
+                pass  # Удален между проверкой и обновлением - записываем заново
+
+        path = self._path(ref, self.codec)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        payload = self._compress(data)
+
+        # Атомарная запись: параллельная запись того же блоба дает тот же файл
+        tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+
+        self.stats["written"] += 1
+        self.stats["bytes_raw"] += len(data)
+        self.stats["bytes_stored"] += len(payload)
+        return ref
+
+    def _existing_path(self, ref: str) -> Optional[str]:
+        for codec in CODEC_EXTENSIONS:
+            path = self._path(ref, codec)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def exists(self, ref: str) -> bool:
+        return self._existing_path(ref) is not None
+
+    def age(self, ref: str) -> Optional[float]:
+        """Секунды с последней записи или повторного использования блоба (None, если его нет)"""
+        path = self._existing_path(ref)
+        if path is None:
+            return None
+        try:
+            return max(time.time() - os.path.getmtime(path), 0.0)
+        except FileNotFoundError:
+            return None
+
+    def get(self, ref: str) -> Optional[bytes]:
+        """Распакованный блоб (None, если его нет)"""
+        for codec in CODEC_EXTENSIONS:
+            path = self._path(ref, codec)
+            if not os.path.exists(path):
+                continue
+            with open(path, "rb") as f:
+                payload = f.read()
+            self.stats["read"] += 1
+            if codec == "zstd":
+                if zstandard is None:
+                    raise Exception(f"Blob {ref} is zstd-compressed but zstandard is not installed")
+                return zstandard.ZstdDecompressor().decompress(payload)
+            return zlib.decompress(payload)
+        return None
+
+    def delete(self, ref: str):
+        for codec in CODEC_EXTENSIONS:
+            path = self._path(ref, codec)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def raw_output(self, result) -> Optional[str]:
+        """Сырой вывод находки (из блоба или из старой колонки raw_output)"""
+        if result.raw_output is not None or not result.raw_ref:
+            return result.raw_output
+        data = self.get(result.raw_ref)
+        return data.decode("utf-8", errors="replace") if data is not None else None
+
+    def curl_command(self, result, raw_output: Optional[str] = None) -> Optional[str]:
+        """Curl команда находки (хранится внутри сырого JSON вывода)"""
+        if result.curl_command:
+            return result.curl_command
+        raw = raw_output if raw_output is not None else self.raw_output(result)
+        if not raw:
+            return None
+        try:
+            data = json.loads(raw)
+        except ValueError:
+            return None
+        return data.get("curl-command") if isinstance(data, dict) else None
+
+    def get_stats(self) -> dict:
+        return {
+            "codec": self.codec,
+            "root": self.root,
+            **self.stats
+        }
+
+
+blob_store = BlobStore()
@@ -0,0 +1,313 @@
+import asyncio
+import os
+from datetime import datetime
+from typing import Dict, Optional
+
+from sqlalchemy import func
+
+from database import SessionLocal, Task, TaskShard
+from config import settings
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class TaskDispatcher:
+    """Диспетчер очереди частей задач
+
+    Очередь хранится в БД: ожидающие части - TaskShard со статусом
+    pending у задач в статусе queued или running. Каждый раунд части
+    в порядке поступления задач получают воркер от планировщика, пока
+    есть свободные слоты на воркерах (max_scans_per_worker) и в парке
+    (max_running_scans). Пакетные задачи забирают пакеты по мере
+    освобождения слотов, а отстающие пакеты дублируются на свободных
+    воркерах. При старте контроллер заново подключается к screen
+    сессиям, которые продолжали работать без него. Фиксация изменений
+    идет через очередь записи task_manager.ingest_queue.
+    """
+
+    def __init__(self, task_manager):
+        self.task_manager = task_manager
+        self.active: Dict[int, asyncio.Task] = {}  # shard_id -> мониторинг части
+        self.rounds = 0
+        self.dispatched = 0
+        self.recovered = 0
+        self.stolen = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def wakeup(self) -> asyncio.Event:
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        return self._wakeup
+
+    def wake(self):
+        """Внеочередной раунд (новая задача или освободился слот)"""
+        self.wakeup.set()
+
+    def start(self):
+        """Восстановление после перезапуска и запуск фонового раунда"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    def stop(self):
+        # Мониторинг частей не отменяется явно - после перезапуска он будет восстановлен
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def check_capacity(self, db):
+        """Отказ в приеме новой задачи при переполненной очереди"""
+        queued = db.query(func.count(Task.id)).filter(Task.status.in_(("preparing", "queued"))).scalar()
+        if queued >= settings.max_queued_tasks:
+            raise QueueFullError(f"Task queue is full ({queued} tasks waiting)")
+
+    async def _loop(self):
+        try:
+            await self.recover()
+        except Exception as e:
+            print(f"Task recovery failed: {str(e)}")
+
+        while True:
+            try:
+                await self.dispatch()
+            except Exception as e:
+                print(f"Dispatch round failed: {str(e)}")
+
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), settings.dispatch_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+
+    def _spawn(self, shard_id: int):
+        task = asyncio.create_task(self.task_manager._run_shard(shard_id))
+        self.active[shard_id] = task
+
+        def done(_):
+            self.active.pop(shard_id, None)
+            self.wake()
+
+        task.add_done_callback(done)
+
+    async def dispatch(self) -> int:
+        """Один раунд: назначение воркеров ожидающим частям"""
+        self.rounds += 1
+        db = SessionLocal()
+        try:
+            running = db.query(func.count(TaskShard.id)).filter(TaskShard.status == "running").scalar()
+            fleet_slots = settings.max_running_scans - running
+            if fleet_slots <= 0:
+                return 0
+
+            pending = db.query(TaskShard).join(Task).filter(
+                TaskShard.status == "pending",
+                Task.status.in_(("queued", "running"))
+            ).order_by(Task.created_at, Task.id, TaskShard.shard_index).limit(fleet_slots).all()
+            if not pending and not db.query(Task.id).filter(
+                Task.status == "running", Task.batch_size > 0
+            ).first():
+                return 0
+
+            scheduler = self.task_manager.scheduler
+            loads = scheduler.collect(db)
+            deployed = scheduler.deployed_templates(db, [l.worker.id for l in loads])
+
+            now = datetime.utcnow()
+            started = []
+            for shard in pending:
+                task = shard.task
+                # Резервная копия не ставится на воркер исходной части
+                exclude = shard.backup_of.worker_id if shard.backup_of_id else None
+                load = scheduler.pick(loads, task.template_id, deployed, exclude=exclude)
+                if load is None:
+                    if exclude is not None:
+                        continue
+                    break  # Свободных слотов нет - остальные ждут следующего раунда
+
+                shard.worker_id = load.worker.id
+                shard.status = "running"
+                shard.started_at = now
+                if task.status == "queued":
+                    task.status = "running"
+                    task.started_at = now
+                    task.worker_id = load.worker.id
+                started.append(shard.id)
+
+            await self.task_manager.ingest_queue.run(db.commit)
+
+            for shard_id in started:
+                self._spawn(shard_id)
+            self.dispatched += len(started)
+
+            # Свободные слоты остались, а очередь пуста - дублируем отстающие пакеты
+            if len(started) == len(pending) and fleet_slots > len(started):
+                if await self.steal(db, loads, fleet_slots - len(started)):
+                    self.wake()
+
+            return len(started)
+        finally:
+            db.close()
+
+    async def steal(self, db, loads, limit: int) -> int:
+        """Резервные копии отстающих пакетов для свободных воркеров
+
+        Пакет считается отстающим, если у задачи больше нет ожидающих
+        пакетов, а он выполняется дольше straggler_factor медиан
+        завершенных пакетов (и не меньше straggler_min_seconds). Копия
+        сканирует те же цели на другом воркере; остается результат той,
+        что завершится первой.
+        """
+        free = [l for l in loads if l.free_slots > 0]
+        limit = min(limit, sum(l.free_slots for l in free))
+        if limit <= 0:
+            return 0
+
+        running = db.query(TaskShard).join(Task).filter(
+            Task.status == "running",
+            Task.batch_size > 0,
+            TaskShard.status == "running",
+            TaskShard.backup_of_id.is_(None)
+        ).order_by(TaskShard.started_at).all()
+        if not running:
+            return 0
+
+        task_ids = {s.task_id for s in running}
+        with_pending = {
+            task_id for (task_id,) in db.query(TaskShard.task_id).filter(
+                TaskShard.task_id.in_(task_ids),
+                TaskShard.status == "pending"
+            ).distinct().all()
+        }
+        has_backup = {
+            shard_id for (shard_id,) in db.query(TaskShard.backup_of_id).filter(
+                TaskShard.task_id.in_(task_ids),
+                TaskShard.backup_of_id.isnot(None)
+            ).all()
+        }
+
+        thresholds = {}
+        now = datetime.utcnow()
+        created = 0
+        for shard in running:
+            if created >= limit:
+                break
+            if shard.task_id in with_pending or shard.id in has_backup or not shard.started_at:
+                continue
+            if not any(l.worker.id != shard.worker_id for l in free):
+                continue
+
+            if shard.task_id not in thresholds:
+                thresholds[shard.task_id] = self._straggler_threshold(db, shard.task_id)
+            threshold = thresholds[shard.task_id]
+            if threshold is None or (now - shard.started_at).total_seconds() < threshold:
+                continue
+
+            db.add(TaskShard(
+                task_id=shard.task_id,
+                shard_index=shard.shard_index,
+                job_id=f"{shard.job_id}_b",
+                backup_of_id=shard.id,
+                targets_file=shard.targets_file,
+                targets_count=shard.targets_count,
+                status="pending"
+            ))
+            created += 1
+
+        if created:
+            await self.task_manager.ingest_queue.run(db.commit)
+            self.stolen += created
+        return created
+
+    def _straggler_threshold(self, db, task_id: int) -> Optional[float]:
+        """Порог отставания пакета задачи (секунды) по медиане завершенных пакетов"""
+        done = db.query(TaskShard.started_at, TaskShard.completed_at).filter(
+            TaskShard.task_id == task_id,
+            TaskShard.status == "completed",
+            TaskShard.started_at.isnot(None),
+            TaskShard.completed_at.isnot(None)
+        ).all()
+        if len(done) < settings.straggler_min_completed:
+            return None
+
+        durations = sorted((completed - started).total_seconds() for started, completed in done)
+        median = durations[len(durations) // 2]
+        return max(median * settings.straggler_factor, settings.straggler_min_seconds)
+
+    async def recover(self):
+        """Восстановление частей, которые выполнялись до перезапуска контроллера"""
+        db = SessionLocal()
+        try:
+            shards = db.query(TaskShard).filter(TaskShard.status == "running").all()
+
+            for shard in shards:
+                if shard.id in self.active:
+                    continue
+
+                if shard.task.status != "running":
+                    # Задача остановлена - сессия на воркере больше не нужна
+                    if shard.screen_session and shard.worker:
+                        try:
+                            await self.task_manager.worker_manager.stop_scan(shard.worker, shard.screen_session)
+                        except Exception:
+                            pass
+                    shard.status = "failed"
+                    shard.error_message = "Task stopped by user"
+                    shard.completed_at = datetime.utcnow()
+
+                elif shard.screen_session:
+                    # Скан запущен - продолжаем мониторинг с сохраненного смещения
+                    self._spawn(shard.id)
+                    self.recovered += 1
+
+                else:
+                    # Контроллер остановился до запуска скана - часть возвращается в очередь
+                    if shard.worker:
+                        try:
+                            await self.task_manager.worker_manager.stop_scan(
+                                shard.worker, f"nuclei_task_{shard.job_id}"
+                            )
+                        except Exception:
+                            pass
+                    shard.status = "pending"
+                    shard.worker_id = None
+                    shard.started_at = None
+
+            # Подготовка целей прервана перезапуском - исходный файл не дочитан
+            for task in db.query(Task).filter(Task.status == "preparing").all():
+                if task.targets_file and os.path.exists(task.targets_file):
+                    os.remove(task.targets_file)
+                task.targets_file = None
+                task.status = "failed"
+                task.error_message = "Controller restarted while preparing targets"
+                task.completed_at = datetime.utcnow()
+
+            await self.task_manager.ingest_queue.run(db.commit)
+
+            # Задачи, все части которых завершились до перезапуска
+            for task in db.query(Task).filter(Task.status == "running").all():
+                await self.task_manager.ingest_queue.run(self.task_manager.finish_task_if_done, task, db)
+        finally:
+            db.close()
+
+    def get_stats(self) -> dict:
+        db = SessionLocal()
+        try:
+            counts = dict(db.query(TaskShard.status, func.count(TaskShard.id)).group_by(TaskShard.status).all())
+            queued_tasks = db.query(func.count(Task.id)).filter(Task.status == "queued").scalar()
+        finally:
+            db.close()
+
+        return {
+            "queued_tasks": queued_tasks,
+            "shards": counts,
+            "active_monitors": len(self.active),
+            "max_running_scans": settings.max_running_scans,
+            "max_scans_per_worker": settings.max_scans_per_worker,
+            "rounds": self.rounds,
+            "dispatched": self.dispatched,
+            "recovered": self.recovered,
+            "stolen": self.stolen
+        }
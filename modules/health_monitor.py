@@ -0,0 +1,171 @@
+import asyncio
+import time
+from datetime import datetime
+from typing import Dict, Optional
+
+from database import SessionLocal, Worker
+from modules.worker_manager import WorkerManager
+from modules.status_poller import worker_snapshot
+from config import settings
+
+
+class CircuitBreaker:
+    """Автомат воркера: closed - работа разрешена, open - воркер исключен,
+    half_open - воркер отвечает, но еще не набрал нужное число успехов подряд"""
+
+    def __init__(self):
+        self.state = "closed"
+        self.failures = 0
+        self.successes = 0
+        self.opened_at: Optional[float] = None
+        self.trips = 0
+
+    def record_success(self):
+        self.failures = 0
+        if self.state == "open":
+            self.state = "half_open"
+            self.successes = 0
+        if self.state == "half_open":
+            self.successes += 1
+            if self.successes >= settings.circuit_recovery_successes:
+                self.state = "closed"
+                self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        self.successes = 0
+        if self.state == "half_open" or (
+            self.state == "closed" and self.failures >= settings.worker_offline_after
+        ):
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self.trips += 1
+
+    def allow(self) -> bool:
+        return self.state == "closed"
+
+    def to_dict(self) -> dict:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "successes": self.successes,
+            "trips": self.trips,
+            "open_for": round(time.monotonic() - self.opened_at, 1) if self.opened_at else None
+        }
+
+
+class HealthMonitor:
+    """Фоновый heartbeat всех воркеров с размыканием автомата"""
+
+    # Статусы, которые heartbeat не трогает (воркер еще не установлен)
+    SKIP_STATUSES = ("provisioning", "error")
+
+    def __init__(self, worker_manager: Optional[WorkerManager] = None):
+        self.worker_manager = worker_manager or WorkerManager()
+        self.breakers: Dict[int, CircuitBreaker] = {}
+        self.rounds = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def breaker(self, worker_id: int) -> CircuitBreaker:
+        breaker = self.breakers.get(worker_id)
+        if breaker is None:
+            breaker = CircuitBreaker()
+            self.breakers[worker_id] = breaker
+        return breaker
+
+    def is_available(self, worker_id: int) -> bool:
+        """Можно ли отправлять работу на воркер"""
+        return self.breaker(worker_id).allow()
+
+    def start(self):
+        """Запуск фонового heartbeat"""
+        if self._task is None:
+            self._restore()
+            self._task = asyncio.create_task(self._loop())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _restore(self):
+        """Состояние автоматов после перезапуска берется из статусов воркеров"""
+        db = SessionLocal()
+        try:
+            for worker in db.query(Worker).filter(Worker.status == "offline").all():
+                breaker = self.breaker(worker.id)
+                breaker.state = "open"
+                breaker.opened_at = time.monotonic()
+                breaker.failures = worker.consecutive_failures or 0
+        finally:
+            db.close()
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.check_all()
+            except Exception as e:
+                print(f"Heartbeat round failed: {str(e)}")
+            await asyncio.sleep(settings.heartbeat_interval)
+
+    async def probe(self, worker) -> dict:
+        """Один heartbeat воркера"""
+        started = time.monotonic()
+        try:
+            info = await self.worker_manager.heartbeat(worker, timeout=settings.heartbeat_timeout)
+            info["ok"] = True
+        except Exception as e:
+            info = {"ok": False, "error": str(e)}
+        info["latency_ms"] = round((time.monotonic() - started) * 1000, 1)
+        return info
+
+    async def check_all(self):
+        """Параллельная проверка всех воркеров"""
+        db = SessionLocal()
+        try:
+            workers = db.query(Worker).filter(~Worker.status.in_(self.SKIP_STATUSES)).all()
+            semaphore = asyncio.Semaphore(settings.heartbeat_concurrency)
+
+            async def run_one(snapshot):
+                async with semaphore:
+                    return await self.probe(snapshot)
+
+            results = await asyncio.gather(*(run_one(worker_snapshot(w)) for w in workers))
+
+            now = datetime.utcnow()
+            for worker, info in zip(workers, results):
+                self._apply(worker, info, now)
+
+            db.commit()
+            self.rounds += 1
+        finally:
+            db.close()
+
+    def _apply(self, worker: Worker, info: dict, now: datetime):
+        breaker = self.breaker(worker.id)
+
+        if info["ok"]:
+            breaker.record_success()
+            worker.consecutive_failures = 0
+            worker.last_ping = now
+            worker.latency_ms = info["latency_ms"]
+            worker.load_avg = info["load_avg"][0] if info.get("load_avg") else None
+            if info.get("cpu_count"):
+                worker.cpu_count = info["cpu_count"]
+            if info.get("mem_usage") is not None:
+                worker.mem_usage = info["mem_usage"]
+            # В работу воркер возвращается только при замкнутом автомате
+            worker.status = "online" if breaker.allow() else "degraded"
+        else:
+            breaker.record_failure()
+            worker.consecutive_failures = (worker.consecutive_failures or 0) + 1
+            if not breaker.allow():
+                worker.status = "offline"
+            elif worker.consecutive_failures >= settings.worker_degraded_after:
+                worker.status = "degraded"
+
+    def get_stats(self) -> dict:
+        return {
+            "rounds": self.rounds,
+            "breakers": {worker_id: b.to_dict() for worker_id, b in self.breakers.items()}
+        }
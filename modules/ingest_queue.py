@@ -0,0 +1,83 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from database import engine
+from config import settings
+
+
+class IngestQueue:
+    """Очередь записи принятых находок в БД
+
+    На SQLite пишет только один поток: пакеты всех частей и агентов
+    выполняются по очереди в отдельном потоке, поэтому параллельный
+    прием не упирается в "database is locked", а цикл событий не
+    блокируется записью. На PostgreSQL пакеты пишутся параллельно в
+    общем пуле потоков. Режим задается настройкой db_single_writer.
+    """
+
+    def __init__(self):
+        self.single_writer = self._single_writer()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        if self.single_writer:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self.stats = {
+            "jobs": 0,
+            "errors": 0,
+            "pending": 0,
+            "max_pending": 0,
+            "wait_seconds": 0.0,
+            "max_wait_seconds": 0.0,
+            "write_seconds": 0.0
+        }
+
+    def _single_writer(self) -> bool:
+        if settings.db_single_writer == "auto":
+            return engine.dialect.name == "sqlite"
+        return settings.db_single_writer.lower() == "true"
+
+    async def run(self, fn: Callable, *args):
+        """Выполнение записи fn(*args) в очереди; возвращает ее результат"""
+        queued = time.monotonic()
+        self.stats["pending"] += 1
+        self.stats["max_pending"] = max(self.stats["max_pending"], self.stats["pending"])
+
+        def job():
+            started = time.monotonic()
+            waited = started - queued
+            self.stats["wait_seconds"] += waited
+            self.stats["max_wait_seconds"] = max(self.stats["max_wait_seconds"], waited)
+            try:
+                return fn(*args)
+            except Exception:
+                self.stats["errors"] += 1
+                raise
+            finally:
+                self.stats["jobs"] += 1
+                self.stats["write_seconds"] += time.monotonic() - started
+
+        future = asyncio.get_running_loop().run_in_executor(self._executor, job)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # Сессия вызывающего кода используется в потоке - дожидаемся конца транзакции
+            await asyncio.wait([future])
+            raise
+        finally:
+            self.stats["pending"] -= 1
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+    def get_stats(self) -> dict:
+        jobs = self.stats["jobs"]
+        return {
+            "single_writer": self.single_writer,
+            **self.stats,
+            "wait_seconds": round(self.stats["wait_seconds"], 3),
+            "max_wait_seconds": round(self.stats["max_wait_seconds"], 3),
+            "write_seconds": round(self.stats["write_seconds"], 3),
+            "avg_wait_ms": round(self.stats["wait_seconds"] / jobs * 1000, 3) if jobs else None
+        }
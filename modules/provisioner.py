@@ -0,0 +1,216 @@
+import asyncio
+import hashlib
+import io
+import os
+import secrets
+import tarfile
+import urllib.request
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from database import SessionLocal, Worker
+from modules.worker_manager import WorkerManager
+from config import settings
+
+# Файлы из worker_scripts, входящие в бандл воркера
+BUNDLE_FILES = ["run_scan.sh", "cleanup.sh", "nuclei_agent.py"]
+
+NUCLEI_URL = (
+    "https://github.com/projectdiscovery/nuclei/releases/download/"
+    "v{version}/nuclei_{version}_linux_amd64.zip"
+)
+
+
+class ArtifactCache:
+    """Кэш артефактов воркера на контроллере (бинарник nuclei и бандл скриптов)"""
+
+    def __init__(self, cache_dir: str = settings.artifacts_dir, nuclei_version: str = settings.nuclei_version):
+        self.cache_dir = cache_dir
+        self.nuclei_version = nuclei_version
+        self._lock = None
+
+        self.nuclei_path = os.path.join(cache_dir, f"nuclei_{nuclei_version}_linux_amd64.zip")
+        self.bundle_path = None
+        self.bundle_version = None
+
+    @property
+    def lock(self) -> asyncio.Lock:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    @property
+    def version(self) -> str:
+        """Версия установки воркера: версия nuclei + хэш бандла"""
+        return f"{self.nuclei_version}-{self.bundle_version}"
+
+    def _download_nuclei(self):
+        """Загрузка релиза nuclei (один раз на контроллер)"""
+        url = NUCLEI_URL.format(version=self.nuclei_version)
+        tmp_path = self.nuclei_path + ".part"
+
+        with urllib.request.urlopen(url, timeout=settings.worker_timeout) as response, open(tmp_path, "wb") as f:
+            while True:
+                chunk = response.read(1024 * 1024)
+                if not chunk:
+                    break
+                f.write(chunk)
+
+        os.replace(tmp_path, self.nuclei_path)
+
+    def _build_bundle(self):
+        """Сборка tar.gz бандла со скриптами воркера"""
+        digest = hashlib.sha256()
+        contents = {}
+        for name in BUNDLE_FILES:
+            with open(os.path.join(settings.worker_scripts_dir, name), "rb") as f:
+                data = f.read()
+            contents[name] = data
+            digest.update(name.encode())
+            digest.update(data)
+
+        self.bundle_version = digest.hexdigest()[:12]
+        self.bundle_path = os.path.join(self.cache_dir, f"worker_bundle_{self.bundle_version}.tar.gz")
+
+        if os.path.exists(self.bundle_path):
+            return
+
+        tmp_path = self.bundle_path + ".part"
+        with tarfile.open(tmp_path, "w:gz") as tar:
+            for name, data in contents.items():
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mode = 0o755
+                tar.addfile(info, io.BytesIO(data))
+
+        os.replace(tmp_path, self.bundle_path)
+
+    async def ensure(self):
+        """Подготовка артефактов (загрузка и сборка выполняются один раз)"""
+        loop = asyncio.get_running_loop()
+
+        async with self.lock:
+            if not os.path.exists(self.nuclei_path):
+                await loop.run_in_executor(None, self._download_nuclei)
+            await loop.run_in_executor(None, self._build_bundle)
+
+        return self
+
+
+class ProvisionJob:
+    """Задание на установку группы воркеров"""
+
+    def __init__(self, worker_ids: List[int], force: bool = False):
+        self.id = uuid.uuid4().hex[:12]
+        self.worker_ids = worker_ids
+        self.force = force
+        self.status = "pending"  # pending, running, completed, failed
+        self.error = None
+        self.created_at = datetime.utcnow()
+        self.completed_at = None
+        self.workers: Dict[int, dict] = {
+            worker_id: {"status": "pending", "stage": None, "error": None}
+            for worker_id in worker_ids
+        }
+
+    def to_dict(self) -> dict:
+        counts = {}
+        for state in self.workers.values():
+            counts[state["status"]] = counts.get(state["status"], 0) + 1
+
+        return {
+            "id": self.id,
+            "status": self.status,
+            "error": self.error,
+            "force": self.force,
+            "created_at": self.created_at.isoformat(),
+            "completed_at": self.completed_at.isoformat() if self.completed_at else None,
+            "summary": counts,
+            "workers": self.workers
+        }
+
+
+class FleetProvisioner:
+    """Параллельная установка воркеров с ограничением одновременных установок"""
+
+    def __init__(
+        self,
+        worker_manager: Optional[WorkerManager] = None,
+        concurrency: int = settings.provision_concurrency
+    ):
+        self.worker_manager = worker_manager or WorkerManager()
+        self.cache = ArtifactCache()
+        self.concurrency = concurrency
+        self.jobs: Dict[str, ProvisionJob] = {}
+
+    def start_job(self, worker_ids: List[int], force: bool = False) -> ProvisionJob:
+        """Запуск установки в фоне"""
+        job = ProvisionJob(worker_ids, force)
+        self.jobs[job.id] = job
+        asyncio.create_task(self._run_job(job))
+        return job
+
+    def get_job(self, job_id: str) -> Optional[ProvisionJob]:
+        return self.jobs.get(job_id)
+
+    async def _run_job(self, job: ProvisionJob):
+        job.status = "running"
+
+        try:
+            await self.cache.ensure()
+        except Exception as e:
+            job.status = "failed"
+            job.error = f"Failed to prepare artifacts: {str(e)}"
+            job.completed_at = datetime.utcnow()
+            return
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run_one(worker_id: int):
+            async with semaphore:
+                await self._provision_worker(job, worker_id)
+
+        await asyncio.gather(*(run_one(worker_id) for worker_id in job.worker_ids))
+
+        job.status = "completed"
+        job.completed_at = datetime.utcnow()
+
+    async def _provision_worker(self, job: ProvisionJob, worker_id: int):
+        state = job.workers[worker_id]
+        state["status"] = "running"
+
+        def progress(stage: str):
+            state["stage"] = stage
+
+        db = SessionLocal()
+        try:
+            worker = db.query(Worker).filter(Worker.id == worker_id).first()
+            if not worker:
+                raise Exception("Worker not found")
+
+            worker.status = "provisioning"
+            if settings.agent_enabled and not worker.agent_token:
+                worker.agent_token = secrets.token_hex(32)
+            db.commit()
+
+            try:
+                result = await self.worker_manager.setup_worker(
+                    worker, self.cache, force=job.force, progress=progress
+                )
+                worker.status = "online"
+                worker.last_ping = datetime.utcnow()
+                state["status"] = result
+            except Exception as e:
+                worker.status = "error"
+                state["status"] = "failed"
+                state["error"] = str(e)
+
+            db.commit()
+
+        except Exception as e:
+            state["status"] = "failed"
+            state["error"] = str(e)
+
+        finally:
+            db.close()
@@ -0,0 +1,466 @@
+import asyncio
+import gzip
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Iterator, List, Optional
+
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.orm import Session, selectinload
+
+from database import SessionLocal, Task, Result, ResultArchive, ResultArchiveTask, ResultOccurrence, ScanCacheEntry
+from modules.blob_store import blob_store
+from modules.result_query import ResultFilter
+from modules.target_ingest import gzip_writer
+from modules.transfer import file_sha256
+from config import settings
+
+# Колонки находки в файле архива (сырой вывод и curl команда хранятся в самом файле)
+ARCHIVE_COLUMNS = [
+    "id", "task_id", "last_task_id", "shard_id", "template_name", "protocol", "severity", "target",
+    "matched_at", "matcher_name", "extracted_results", "fingerprint", "first_seen", "last_seen",
+    "occurrence_count", "created_at"
+]
+
+# Находки архивируются только у задач, которые больше не пишут в results
+FINISHED_STATUSES = ("completed", "failed")
+
+# Задача-владелец находки: последняя, в которой она встречалась
+OWNER_TASK = func.coalesce(Result.last_task_id, Result.task_id)
+
+# Время последнего появления (у строк до отпечатков - время создания)
+LAST_SEEN = func.coalesce(Result.last_seen, Result.created_at)
+
+MANIFEST_FILE = "manifest.jsonl"
+
+
+class ResultArchiver:
+    """Перенос устаревших находок из таблицы results в архив на диске
+
+    Политики хранения: общий срок retention_days, свои сроки для уровней
+    серьезности и срок отдельной задачи (Task.retention_days). Находки
+    завершенных задач пишутся в archive_dir/task_{id}/*.jsonl.gz пакетами
+    по retention_batch_size вместе с сырым выводом, затем удаляются из
+    results в той же транзакции, где записывается манифест
+    (result_archives со списком задач файла и строка в manifest.jsonl). Запись идет через
+    очередь записи находок. Архив читается по требованию - для выборки
+    и экспорта с теми же фильтрами, что и горячая таблица.
+    """
+
+    def __init__(self, ingest_queue):
+        self.ingest_queue = ingest_queue
+        self.stats = {
+            "runs": 0,
+            "archived": 0,
+            "files": 0,
+            "bytes": 0,
+            "blobs_deleted": 0,
+            "target_files_deleted": 0,
+            "last_run": None
+        }
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self._pending_blobs = set()  # Блобы без ссылок, отложенные до конца периода ожидания
+
+    def start(self):
+        if self._task is None and settings.retention_enabled:
+            self._task = asyncio.create_task(self._loop())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            try:
+                result = await self.apply_retention()
+                if result["archived"] or result["target_files_deleted"]:
+                    print(f"Retention: archived {result['archived']} results, removed {result['target_files_deleted']} target files")
+            except Exception as e:
+                print(f"Retention run failed: {str(e)}")
+            await asyncio.sleep(settings.retention_interval)
+
+    def _retention_condition(self, now: datetime):
+        """Условие устаревания находки по общему сроку и срокам уровней серьезности"""
+        overrides = settings.retention_severity_days
+        conditions = [
+            and_(Result.severity == severity, LAST_SEEN < now - timedelta(days=days))
+            for severity, days in overrides.items() if days > 0
+        ]
+        if settings.retention_days > 0:
+            conditions.append(and_(
+                or_(Result.severity.is_(None), Result.severity.notin_(list(overrides))),
+                LAST_SEEN < now - timedelta(days=settings.retention_days)
+            ))
+        return or_(*conditions) if conditions else None
+
+    def _plan(self, now: datetime) -> list:
+        """Задачи с устаревшими находками и условие отбора для каждой"""
+        db = SessionLocal()
+        try:
+            plan = []
+
+            # Свой срок задачи важнее общих политик
+            custom = db.query(Task.id, Task.retention_days).filter(
+                Task.status.in_(FINISHED_STATUSES),
+                Task.retention_days.isnot(None)
+            ).all()
+            for task_id, days in custom:
+                if days > 0:
+                    plan.append((task_id, LAST_SEEN < now - timedelta(days=days)))
+
+            condition = self._retention_condition(now)
+            if condition is not None:
+                task_ids = db.query(OWNER_TASK).join(Task, Task.id == OWNER_TASK).filter(
+                    Task.status.in_(FINISHED_STATUSES),
+                    Task.retention_days.is_(None),
+                    condition
+                ).distinct().all()
+                plan += [(task_id, condition) for (task_id,) in task_ids]
+
+            return plan
+        finally:
+            db.close()
+
+    async def apply_retention(self) -> dict:
+        """Применение политик: архивирование устаревших находок и удаление старых файлов целей"""
+        async with self._lock:
+            now = datetime.utcnow()
+            plan = await asyncio.get_running_loop().run_in_executor(None, self._plan, now)
+
+            archived = 0
+            for task_id, condition in plan:
+                archived += await self._archive(task_id, condition, "retention")
+            if self._pending_blobs:
+                await self.ingest_queue.run(self._delete_orphan_blobs, set())
+            removed = await self.ingest_queue.run(self.cleanup_target_files, now)
+
+            self.stats["runs"] += 1
+            self.stats["last_run"] = now.isoformat()
+            return {"archived": archived, "tasks": len(plan), "target_files_deleted": removed}
+
+    async def archive_task(self, task_id: int, db: Session) -> int:
+        """Архивирование всех находок задачи независимо от срока"""
+        task = db.query(Task).filter(Task.id == task_id).first()
+        if not task:
+            raise Exception("Task not found")
+        if task.status not in FINISHED_STATUSES:
+            raise Exception("Only finished tasks can be archived")
+
+        async with self._lock:
+            return await self._archive(task_id, None, "task")
+
+    async def _archive(self, task_id: int, condition, reason: str) -> int:
+        total = 0
+        while True:
+            archived = await self.ingest_queue.run(self._archive_batch, task_id, condition, reason)
+            total += archived
+            if archived < settings.retention_batch_size:
+                return total
+
+    def _archive_batch(self, task_id: int, condition, reason: str) -> int:
+        """Один файл архива: запись, удаление строк и манифест одной транзакцией"""
+        db = SessionLocal()
+        path = None
+        try:
+            query = db.query(Result).filter(or_(
+                Result.last_task_id == task_id,
+                and_(Result.last_task_id.is_(None), Result.task_id == task_id)
+            ))
+            if condition is not None:
+                query = query.filter(condition)
+            # Строки блокируются до удаления (на PostgreSQL), чтобы повтор находки не потерялся
+            results = query.order_by(Result.id).limit(settings.retention_batch_size).with_for_update().all()
+            if not results:
+                return 0
+
+            ids = [result.id for result in results]
+            refs = {result.raw_ref for result in results if result.raw_ref}
+            fingerprints = [result.fingerprint for result in results if result.fingerprint]
+
+            # Все задачи, в которых встречались находки файла
+            tasks_by_fingerprint = {}
+            for start in range(0, len(fingerprints), 500):
+                for fingerprint, occurrence_task_id in db.query(
+                    ResultOccurrence.fingerprint, ResultOccurrence.task_id
+                ).filter(ResultOccurrence.fingerprint.in_(fingerprints[start:start + 500])):
+                    tasks_by_fingerprint.setdefault(fingerprint, set()).add(occurrence_task_id)
+
+            rows = []
+            covered = set()
+            for result in results:
+                task_ids = tasks_by_fingerprint.get(result.fingerprint, set()) | {result.task_id, result.last_task_id}
+                task_ids.discard(None)
+                covered |= task_ids
+                rows.append(self._archive_row(result, sorted(task_ids)))
+
+            path, entry = self._write_file(task_id, rows)
+            archive = ResultArchive(task_id=task_id, reason=reason, **entry)
+            archive.covered_tasks = [ResultArchiveTask(task_id=covered_id) for covered_id in sorted(covered)]
+            db.add(archive)
+            for start in range(0, len(ids), 500):
+                db.query(Result).filter(Result.id.in_(ids[start:start + 500])).delete(synchronize_session=False)
+            for start in range(0, len(fingerprints), 500):
+                db.query(ResultOccurrence).filter(
+                    ResultOccurrence.fingerprint.in_(fingerprints[start:start + 500])
+                ).delete(synchronize_session=False)
+            db.query(Task).filter(Task.id == task_id).update(
+                {Task.archived_count: func.coalesce(Task.archived_count, 0) + len(ids)},
+                synchronize_session=False
+            )
+            # Находки целей задачи ушли из results - кэш не должен отсеивать эти цели
+            db.query(ScanCacheEntry).filter(ScanCacheEntry.task_id == task_id).delete(synchronize_session=False)
+
+            db.flush()
+            manifest = {
+                "id": archive.id,
+                "task_id": task_id,
+                "task_ids": sorted(covered),
+                "reason": reason,
+                **entry,
+                "first_seen_min": entry["first_seen_min"].isoformat() if entry["first_seen_min"] else None,
+                "last_seen_max": entry["last_seen_max"].isoformat() if entry["last_seen_max"] else None,
+                "created_at": datetime.utcnow().isoformat()
+            }
+            db.commit()
+        except BaseException:
+            db.rollback()
+            if path and os.path.exists(path):
+                os.remove(path)
+            raise
+        finally:
+            db.close()
+
+        with open(os.path.join(settings.archive_dir, MANIFEST_FILE), "a", encoding="utf-8") as f:
+            f.write(json.dumps(manifest) + "\n")
+        self._delete_orphan_blobs(refs)
+
+        self.stats["archived"] += len(ids)
+        self.stats["files"] += 1
+        self.stats["bytes"] += entry["size_bytes"]
+        return len(ids)
+
+    def _archive_row(self, result: Result, task_ids: List[int]) -> dict:
+        row = {column: getattr(result, column) for column in ARCHIVE_COLUMNS}
+        row["task_ids"] = task_ids
+        for column in ("first_seen", "last_seen", "created_at"):
+            row[column] = row[column].isoformat() if row[column] else None
+        row["raw_output"] = blob_store.raw_output(result)
+        row["curl_command"] = blob_store.curl_command(result, row["raw_output"])
+        return row
+
+    def _write_file(self, task_id: int, rows: List[dict]):
+        """Файл JSONL.gz пакета находок и поля записи манифеста"""
+        directory = os.path.join(settings.archive_dir, f"task_{task_id}")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}.jsonl.gz")
+        tmp_path = f"{path}.tmp"
+
+        severity_counts = {}
+        try:
+            with gzip_writer(tmp_path) as f:
+                for row in rows:
+                    f.write((json.dumps(row) + "\n").encode("utf-8"))
+                    severity = row["severity"] or "unknown"
+                    severity_counts[severity] = severity_counts.get(severity, 0) + 1
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        first_seen = [row["first_seen"] or row["created_at"] for row in rows if row["first_seen"] or row["created_at"]]
+        last_seen = [row["last_seen"] or row["created_at"] for row in rows if row["last_seen"] or row["created_at"]]
+        return path, {
+            "file_path": path,
+            "rows_count": len(rows),
+            "size_bytes": os.path.getsize(path),
+            "sha256": file_sha256(path),
+            "severity_counts": json.dumps(severity_counts),
+            "first_seen_min": datetime.fromisoformat(min(first_seen)) if first_seen else None,
+            "last_seen_max": datetime.fromisoformat(max(last_seen)) if last_seen else None
+        }
+
+    def _delete_orphan_blobs(self, refs: set):
+        """Удаление блобов сырого вывода, на которые больше не ссылаются находки
+
+        Прием находок может повторно использовать блоб и зафиксировать
+        ссылку на него позже этой проверки (на PostgreSQL запись идет
+        параллельно), поэтому удаляются только блобы, не записанные и не
+        использованные повторно дольше blob_gc_grace_seconds. Более
+        молодые откладываются до следующих запусков.
+        """
+        refs = list(set(refs) | self._pending_blobs)
+        if not refs:
+            return
+        db = SessionLocal()
+        try:
+            used = set()
+            for start in range(0, len(refs), 500):
+                used.update(ref for (ref,) in db.query(Result.raw_ref).filter(
+                    Result.raw_ref.in_(refs[start:start + 500])
+                ).distinct().all())
+        finally:
+            db.close()
+
+        # Возраст проверяется после запроса ссылок: повторное использование
+        # блоба до фиксации ссылки обновляет его время изменения
+        self._pending_blobs = set()
+        for ref in refs:
+            if ref in used:
+                continue
+            age = blob_store.age(ref)
+            if age is None:
+                continue
+            if age < settings.blob_gc_grace_seconds:
+                self._pending_blobs.add(ref)
+                continue
+            blob_store.delete(ref)
+            self.stats["blobs_deleted"] += 1
+
+    def cleanup_target_files(self, now: Optional[datetime] = None) -> int:
+        """Удаление файлов целей и контрольных точек давно завершенных задач"""
+        if settings.targets_retention_days <= 0:
+            return 0
+
+        cutoff = (now or datetime.utcnow()) - timedelta(days=settings.targets_retention_days)
+        db = SessionLocal()
+        removed = 0
+        try:
+            tasks = db.query(Task).filter(
+                Task.status == "completed",
+                Task.completed_at < cutoff,
+                Task.targets_file.isnot(None)
+            ).all()
+            for task in tasks:
+                for shard in task.shards:
+                    for path in (shard.targets_file, shard.checkpoint_file):
+                        if path and os.path.exists(path):
+                            os.remove(path)
+                            removed += 1
+                    shard.targets_file = None
+                    shard.checkpoint_file = None
+                if os.path.exists(task.targets_file):
+                    os.remove(task.targets_file)
+                    removed += 1
+                task.targets_file = None
+            db.commit()
+        finally:
+            db.close()
+
+        self.stats["target_files_deleted"] += removed
+        return removed
+
+    def _select_archives(self, db: Session, filters: ResultFilter) -> List[ResultArchive]:
+        """Файлы архива, в которых могут быть находки под фильтр (по манифесту)"""
+        query = db.query(ResultArchive)
+        if filters.task_id is not None:
+            query = query.filter(ResultArchive.id.in_(
+                select(ResultArchiveTask.archive_id).where(ResultArchiveTask.task_id == filters.task_id)
+            ))
+        if filters.seen_after is not None:
+            query = query.filter(ResultArchive.last_seen_max >= filters.seen_after)
+        if filters.seen_before is not None:
+            query = query.filter(ResultArchive.first_seen_min < filters.seen_before)
+
+        archives = []
+        for archive in query.order_by(ResultArchive.created_at.desc(), ResultArchive.id.desc()).all():
+            severities = json.loads(archive.severity_counts or "{}")
+            if filters.severity and not set(filters.severity) & set(severities):
+                continue
+            archives.append(archive)
+        return archives
+
+    def read_archive(self, path: str) -> Iterator[dict]:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def iter_archived(self, filters: ResultFilter, batch_size: int = 1000) -> Iterator[List[dict]]:
+        """Находки из архива под фильтр, пакетами (файлы читаются по требованию)"""
+        db = SessionLocal()
+        try:
+            paths = [archive.file_path for archive in self._select_archives(db, filters)]
+        finally:
+            db.close()
+
+        batch = []
+        for path in paths:
+            if not os.path.exists(path):
+                print(f"Archive file is missing: {path}")
+                continue
+            for row in self.read_archive(path):
+                if filters.matches(row):
+                    batch.append(row)
+                    if len(batch) >= batch_size:
+                        yield batch
+                        batch = []
+        if batch:
+            yield batch
+
+    def page(self, filters: ResultFilter, page: int = 1, per_page: int = 100) -> dict:
+        """Страница находок из архива (без сырого вывода, как в горячей таблице)"""
+        page = max(page, 1)
+        per_page = min(max(per_page, 1), 1000)
+        skip = (page - 1) * per_page
+
+        items = []
+        for batch in self.iter_archived(filters):
+            for row in batch:
+                if skip:
+                    skip -= 1
+                    continue
+                items.append({key: value for key, value in row.items() if key not in ("raw_output", "curl_command")})
+                if len(items) > per_page:
+                    break
+            if len(items) > per_page:
+                break
+
+        return {
+            "page": page,
+            "per_page": per_page,
+            "has_more": len(items) > per_page,
+            "items": items[:per_page]
+        }
+
+    def list_archives(self, db: Session, task_id: Optional[int] = None, limit: int = 100) -> List[dict]:
+        query = db.query(ResultArchive).options(selectinload(ResultArchive.covered_tasks))
+        if task_id is not None:
+            query = query.filter(ResultArchive.id.in_(
+                select(ResultArchiveTask.archive_id).where(ResultArchiveTask.task_id == task_id)
+            ))
+        return [{
+            "id": archive.id,
+            "task_id": archive.task_id,
+            "task_ids": [link.task_id for link in archive.covered_tasks],
+            "file_path": archive.file_path,
+            "rows_count": archive.rows_count,
+            "size_bytes": archive.size_bytes,
+            "sha256": archive.sha256,
+            "severity_counts": json.loads(archive.severity_counts or "{}"),
+            "first_seen_min": archive.first_seen_min.isoformat() if archive.first_seen_min else None,
+            "last_seen_max": archive.last_seen_max.isoformat() if archive.last_seen_max else None,
+            "reason": archive.reason,
+            "created_at": archive.created_at.isoformat() if archive.created_at else None
+        } for archive in query.order_by(ResultArchive.created_at.desc()).limit(limit).all()]
+
+    def get_stats(self, db: Session) -> dict:
+        files, rows, size = db.query(
+            func.count(ResultArchive.id),
+            func.coalesce(func.sum(ResultArchive.rows_count), 0),
+            func.coalesce(func.sum(ResultArchive.size_bytes), 0)
+        ).one()
+        return {
+            "enabled": settings.retention_enabled,
+            "retention_days": settings.retention_days,
+            "retention_severity_days": settings.retention_severity_days,
+            "targets_retention_days": settings.targets_retention_days,
+            "archive_files": files,
+            "archived_rows": rows,
+            "archive_bytes": size,
+            "hot_rows": db.query(func.count(Result.id)).scalar(),
+            "pending_blobs": len(self._pending_blobs),
+            **self.stats
+        }
@@ -1,78 +1,243 @@
+import hashlib
 import json
 import re
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Iterable, Iterator, NamedTuple, Union
 from datetime import datetime
 
 from database import Result
+from config import settings
+
+# orjson опционален (в разы быстрее на потоке находок), без него используется json
+try:
+    import orjson
+    json_loads = orjson.loads
+    JSON_BACKEND = "orjson"
+except ImportError:
+    orjson = None
+    json_loads = json.loads
+    JSON_BACKEND = "json"
+
+SEVERITY_MAPPING = {
+    "info": "info",
+    "low": "low",
+    "medium": "medium",
+    "high": "high",
+    "critical": "critical",
+    "unknown": "info"
+}
+
+
+class Finding(NamedTuple):
+    """Находка nuclei без привязки к сессии БД"""
+    template_name: str
+    protocol: str
+    severity: str
+    target: str
+    matched_at: str
+    matcher_name: str
+    extracted_results: Optional[str]
+    curl_command: str
+    raw_output: str
+    fingerprint: str
+
+    @property
+    def key(self) -> str:
+        """Ключ находки для отсева повторов"""
+        return self.fingerprint
+
+    def to_result(self, task_id: int, shard_id: Optional[int] = None) -> Result:
+        return Result(task_id=task_id, last_task_id=task_id, shard_id=shard_id, **self._asdict())
+
+
+def finding_fingerprint(
+    template_id: str,
+    matched_at: str,
+    matcher_name: str,
+    extracted_results: Optional[list] = None
+) -> str:
+    """Стабильный отпечаток находки
+
+    Зависит только от шаблона, места совпадения, matcher'а и набора
+    извлеченных значений (порядок и повторы значений не важны), поэтому
+    одна и та же находка из повторного скана или перекрывающихся частей
+    дает тот же отпечаток.
+    """
+    extracted = sorted({str(value).strip() for value in extracted_results or [] if str(value).strip()})
+    payload = "\x1f".join([
+        str(template_id or "").strip(),
+        str(matched_at or "").strip(),
+        str(matcher_name or "").strip(),
+        json.dumps(extracted, ensure_ascii=False)
+    ])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def parse_finding(result_data: Dict[str, Any], raw: Optional[str] = None) -> Optional[Finding]:
+    """Находка из разобранной JSON строки nuclei (raw - исходная строка)"""
+    if not isinstance(result_data, dict):
+        return None
+
+    # Извлечение основных полей
+    template_id = result_data.get("template-id", "")
+    template_name = result_data.get("template", template_id)
+
+    # Информация о хосте
+    host = result_data.get("host", "")
+    matched_at = result_data.get("matched-at", host)
+
+    # Протокол
+    if matched_at.startswith("https://"):
+        protocol = "https"
+    elif matched_at.startswith("http://"):
+        protocol = "http"
+    else:
+        protocol = result_data.get("type", "unknown")
+
+    # Уровень серьезности
+    info = result_data.get("info") or {}
+    severity = SEVERITY_MAPPING.get(str(info.get("severity", "info")).lower(), "info")
+
+    matcher_name = result_data.get("matcher-name", "")
+
+    # Извлеченные результаты
+    extracted = result_data.get("extracted-results")
+    if extracted is not None and not isinstance(extracted, list):
+        extracted = [extracted]
+    extracted_results = json.dumps(extracted) if extracted else None
+
+    return Finding(
+        template_name=template_name,
+        protocol=protocol,
+        severity=severity,
+        target=host,
+        matched_at=matched_at,
+        matcher_name=matcher_name,
+        extracted_results=extracted_results,
+        curl_command=result_data.get("curl-command", ""),
+        raw_output=raw if raw is not None else json.dumps(result_data),
+        fingerprint=finding_fingerprint(template_id or template_name, matched_at, matcher_name, extracted)
+    )
+
+
+class JsonlStreamParser:
+    """Потоковый разбор JSONL вывода nuclei (-json / -jsonl)
+
+    Данные подаются кусками произвольного размера или готовыми строками;
+    в памяти держится только незавершенная последняя строка (не длиннее
+    results_max_line_size). Обрезанные и поврежденные строки пропускаются
+    и учитываются в errors.
+    """
+
+    def __init__(self, max_line_size: Optional[int] = None):
+        self.max_line_size = max_line_size or settings.results_max_line_size
+        self.lines = 0
+        self.findings = 0
+        self.errors = 0
+        self._tail = b""
+        self._skip_tail = False
+
+    def parse_line(self, line: Union[bytes, str]) -> Optional[Finding]:
+        """Разбор одной строки (None для пустых и поврежденных строк)"""
+        line = line.strip()
+        if not line:
+            return None
+        self.lines += 1
+
+        try:
+            data = json_loads(line)
+        except ValueError:
+            self.errors += 1
+            return None
+
+        try:
+            raw = line.decode("utf-8", errors="replace") if isinstance(line, bytes) else line
+            finding = parse_finding(data, raw)
+        except (AttributeError, TypeError):
+            finding = None
+        if finding is None:
+            self.errors += 1
+            return None
+
+        self.findings += 1
+        return finding
+
+    def parse_lines(self, lines: Iterable[Union[bytes, str]]) -> Iterator[Finding]:
+        for line in lines:
+            finding = self.parse_line(line)
+            if finding is not None:
+                yield finding
+
+    def feed(self, chunk: bytes) -> Iterator[Finding]:
+        """Разбор очередного куска; неполная последняя строка ждет следующего"""
+        data = self._tail + chunk
+        end = data.rfind(b"\n")
+        if end == -1:
+            self._keep_tail(data)
+            return
+
+        lines = data[:end].split(b"\n")
+        self._tail = b""
+        if self._skip_tail:
+            # Начало этой строки было отброшено как слишком длинное
+            lines.pop(0)
+            self._skip_tail = False
+        self._keep_tail(data[end + 1:])
+        yield from self.parse_lines(lines)
+
+    def _keep_tail(self, tail: bytes):
+        if self._skip_tail:
+            return
+        if len(tail) > self.max_line_size:
+            self.errors += 1
+            self._tail = b""
+            self._skip_tail = True
+        else:
+            self._tail = tail
+
+    def close(self) -> Iterator[Finding]:
+        """Последняя строка без перевода строки (может быть обрезанной)"""
+        tail, self._tail = self._tail, b""
+        if tail and not self._skip_tail:
+            yield from self.parse_lines([tail])
+        self._skip_tail = False
+
+    def parse_file(self, path: str, chunk_size: Optional[int] = None) -> Iterator[Finding]:
+        """Потоковый разбор локального файла результатов"""
+        chunk_size = chunk_size or settings.results_chunk_size
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield from self.feed(chunk)
+        yield from self.close()
+
+    def get_stats(self) -> dict:
+        return {
+            "lines": self.lines,
+            "findings": self.findings,
+            "errors": self.errors,
+            "backend": JSON_BACKEND
+        }
+
 
 class ResultParser:
     def __init__(self):
         # Маппинг уровней серьезности
-        self.severity_mapping = {
-            "info": "info",
-            "low": "low",
-            "medium": "medium",
-            "high": "high",
-            "critical": "critical",
-            "unknown": "info"
-        }
+        self.severity_mapping = SEVERITY_MAPPING
     
     def parse_result(self, result_data: Dict[str, Any], task_id: int) -> Optional[Result]:
         """Парсинг результата Nuclei в формате JSON"""
         try:
-            # Извлечение основных полей
-            template_id = result_data.get("template-id", "")
-            template_name = result_data.get("template", template_id)
-            
-            # Информация о хосте
-            host = result_data.get("host", "")
-            matched_at = result_data.get("matched-at", host)
-            
-            # Протокол
-            if matched_at.startswith("https://"):
-                protocol = "https"
-            elif matched_at.startswith("http://"):
-                protocol = "http"
-            else:
-                protocol = result_data.get("type", "unknown")
-            
-            # Уровень серьезности
-            info = result_data.get("info", {})
-            severity = info.get("severity", "info").lower()
-            severity = self.severity_mapping.get(severity, "info")
-            
-            # Название matcher'а
-            matcher_name = result_data.get("matcher-name", "")
-            
-            # Извлеченные результаты
-            extracted_results = result_data.get("extracted-results", [])
-            if extracted_results:
-                extracted_results = json.dumps(extracted_results)
-            else:
-                extracted_results = None
-            
-            # Curl команда
-            curl_command = result_data.get("curl-command", "")
-            
-            # Создание результата
-            result = Result(
-                task_id=task_id,
-                template_name=template_name,
-                protocol=protocol,
-                severity=severity,
-                target=host,
-                matched_at=matched_at,
-                matcher_name=matcher_name,
-                extracted_results=extracted_results,
-                curl_command=curl_command,
-                raw_output=json.dumps(result_data)
-            )
-            
-            return result
-            
+            finding = parse_finding(result_data)
         except Exception as e:
             print(f"Error parsing result: {str(e)}")
             return None
+        return finding.to_result(task_id) if finding else None
+    
+    def stream_parser(self) -> JsonlStreamParser:
+        """Потоковый разбор JSONL находок"""
+        return JsonlStreamParser()
     
     def parse_text_result(self, line: str, task_id: int) -> Optional[Result]:
         """Парсинг результата Nuclei в текстовом формате"""
@@ -102,6 +267,36 @@ class ResultParser:
     
     def parse_nuclei_stats(self, stats_line: str) -> Dict[str, Any]:
         """Парсинг статистики Nuclei"""
+        # JSON статистика (-stats -sj): значения приходят строками
+        # {"duration":"0:01:05","errors":"0","hosts":"10","matched":"2","percent":"40",
+        #  "requests":"400","rps":"6","templates":"1","total":"1000", ...}
+        line = stats_line.strip()
+        if line.startswith("{"):
+            try:
+                data = json.loads(line)
+            except ValueError:
+                return {}
+            if not isinstance(data, dict) or "requests" not in data or "total" not in data:
+                return {}
+            
+            stats = {}
+            for key in ("templates", "hosts", "requests", "total", "matched", "errors", "percent"):
+                try:
+                    stats[key] = int(float(data.get(key, 0) or 0))
+                except (TypeError, ValueError):
+                    stats[key] = 0
+            try:
+                stats["rps"] = float(data.get("rps", 0) or 0)
+            except (TypeError, ValueError):
+                stats["rps"] = 0.0
+            
+            duration = str(data.get("duration", ""))
+            if re.fullmatch(r"\d+:\d{2}:\d{2}", duration):
+                hours, minutes, seconds = (int(v) for v in duration.split(":"))
+                stats["duration"] = hours * 3600 + minutes * 60 + seconds
+            
+            return stats
+        
         # Пример: [INF] Templates: 150 | Hosts: 100 | RPS: 145 | Matched: 25
         stats = {}
         
@@ -125,11 +320,38 @@ class ResultParser:
         if matched_match:
             stats["matched"] = int(matched_match.group(1))
         
+        # Извлечение количества запросов
+        requests_match = re.search(r"Requests:\s*(\d+)/(\d+)", stats_line)
+        if requests_match:
+            stats["requests"] = int(requests_match.group(1))
+            stats["total"] = int(requests_match.group(2))
+        
+        # Извлечение количества ошибок
+        errors_match = re.search(r"Errors:\s*(\d+)", stats_line)
+        if errors_match:
+            stats["errors"] = int(errors_match.group(1))
+        
         return stats
     
+    def parse_stats_tail(self, log_tail: str) -> Dict[str, Any]:
+        """Последняя строка статистики в хвосте лога"""
+        for line in reversed((log_tail or "").splitlines()):
+            if "requests" in line.lower() or "RPS:" in line:
+                stats = self.parse_nuclei_stats(line)
+                if stats:
+                    return stats
+        return {}
+    
     def calculate_progress(self, stats: Dict[str, Any], total_targets: int) -> float:
         """Расчет прогресса сканирования"""
-        if not stats or total_targets == 0:
+        if not stats:
+            return 0.0
+        
+        # Точнее всего - доля выполненных запросов
+        if stats.get("total"):
+            return min(stats.get("requests", 0) / stats["total"] * 100, 100.0)
+        
+        if total_targets == 0:
             return 0.0
         
         processed_hosts = stats.get("hosts", 0)
@@ -137,6 +359,19 @@ class ResultParser:
         
         return min(progress, 100.0)
     
+    def calculate_eta(self, stats: Dict[str, Any]) -> Optional[int]:
+        """Оценка оставшегося времени сканирования (секунды)"""
+        total = stats.get("total", 0)
+        done = stats.get("requests", 0)
+        if not total or done >= total:
+            return 0 if total else None
+        
+        # Средняя скорость за весь скан устойчивее мгновенного RPS
+        rate = done / stats["duration"] if stats.get("duration") else stats.get("rps", 0)
+        if not rate:
+            return None
+        return int((total - done) / rate)
+    
     def group_results_by_severity(self, results: list) -> Dict[str, list]:
         """Группировка результатов по уровню серьезности"""
         grouped = {
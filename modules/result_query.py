@@ -0,0 +1,217 @@
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence
+
+from sqlalchemy import Select, func, or_, select
+from sqlalchemy.orm import Query, Session
+
+from database import Result, ResultOccurrence
+
+# Колонки краткой строки находки (без сырого вывода и curl команды)
+SUMMARY_COLUMNS = [
+    Result.id, Result.task_id, Result.last_task_id, Result.template_name, Result.protocol,
+    Result.severity, Result.target, Result.matched_at, Result.matcher_name,
+    Result.first_seen, Result.last_seen, Result.occurrence_count, Result.created_at
+]
+
+# Поля, по которым разрешена группировка
+GROUP_FIELDS = {
+    "severity": Result.severity,
+    "protocol": Result.protocol,
+    "template_name": Result.template_name,
+    "target": Result.target,
+    "task_id": Result.task_id
+}
+
+SEVERITY_ORDER = ["critical", "high", "medium", "low", "info"]
+
+
+def select_rows(filters: Optional["ResultFilter"] = None) -> Select:
+    """Запрос кратких строк находок с фильтрами (для потоковой выборки асинхронной сессией)"""
+    stmt = select(*SUMMARY_COLUMNS)
+    if filters is not None:
+        stmt = filters.apply(stmt)
+    return stmt.order_by(Result.last_seen.desc().nullslast(), Result.id.desc())
+
+
+def _split(value) -> List[str]:
+    """Значение фильтра: список или строка через запятую"""
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = value.split(",")
+    return [v.strip() for v in value if v and v.strip()]
+
+
+class ResultFilter:
+    """Набор условий выборки находок, переводимый в WHERE
+
+    Пустые условия не применяются. task_id выбирает находки, которые
+    встречались в задаче, по журналу result_occurrences (находка общая
+    для всех задач, где она найдена).
+    """
+
+    def __init__(
+        self,
+        severity=None,
+        protocol=None,
+        template_name: Optional[str] = None,
+        target_contains: Optional[str] = None,
+        task_id: Optional[int] = None,
+        seen_after: Optional[datetime] = None,
+        seen_before: Optional[datetime] = None
+    ):
+        self.severity = [s.lower() for s in _split(severity)]
+        self.protocol = [p.lower() for p in _split(protocol)]
+        self.template_name = (template_name or "").strip() or None
+        self.target_contains = (target_contains or "").strip() or None
+        self.task_id = task_id
+        self.seen_after = seen_after
+        self.seen_before = seen_before
+
+    def apply(self, query):
+        """Условия для Query или select()"""
+        if self.severity:
+            query = query.filter(Result.severity.in_(self.severity))
+        if self.protocol:
+            query = query.filter(Result.protocol.in_(self.protocol))
+        if self.template_name:
+            query = query.filter(Result.template_name.contains(self.template_name, autoescape=True))
+        if self.target_contains:
+            query = query.filter(Result.target.contains(self.target_contains, autoescape=True))
+        if self.task_id is not None:
+            query = query.filter(or_(
+                Result.fingerprint.in_(
+                    select(ResultOccurrence.fingerprint).where(ResultOccurrence.task_id == self.task_id)
+                ),
+                # Строки без отпечатка (до дедупликации) не попадают в журнал
+                (Result.fingerprint.is_(None)) & (Result.task_id == self.task_id)
+            ))
+        if self.seen_after is not None:
+            query = query.filter(Result.last_seen >= self.seen_after)
+        if self.seen_before is not None:
+            query = query.filter(Result.last_seen < self.seen_before)
+        return query
+
+    def matches(self, row: dict) -> bool:
+        """Те же условия для строки находки вне БД (архив)"""
+        if self.severity and (row.get("severity") or "") not in self.severity:
+            return False
+        if self.protocol and (row.get("protocol") or "") not in self.protocol:
+            return False
+        if self.template_name and self.template_name.lower() not in (row.get("template_name") or "").lower():
+            return False
+        if self.target_contains and self.target_contains.lower() not in (row.get("target") or "").lower():
+            return False
+        if self.task_id is not None and self.task_id not in (
+            row.get("task_ids") or (row.get("task_id"), row.get("last_task_id"))
+        ):
+            return False
+        if self.seen_after is not None or self.seen_before is not None:
+            last_seen = row.get("last_seen")
+            if not last_seen:
+                return False
+            last_seen = datetime.fromisoformat(last_seen)
+            if self.seen_after is not None and last_seen < self.seen_after:
+                return False
+            if self.seen_before is not None and last_seen >= self.seen_before:
+                return False
+        return True
+
+    def to_dict(self) -> dict:
+        return {
+            "severity": ",".join(self.severity) or None,
+            "protocol": ",".join(self.protocol) or None,
+            "template_name": self.template_name,
+            "target_contains": self.target_contains,
+            "task_id": self.task_id
+        }
+
+
+class ResultQuery:
+    """Выборки и агрегаты по находкам на стороне SQL
+
+    Фильтры, сортировка, пагинация и GROUP BY выполняются в БД;
+    наружу возвращаются краткие строки без сырого вывода, поэтому
+    сводка по миллионам находок не загружает ORM объекты.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def rows(self, filters: Optional[ResultFilter] = None) -> Query:
+        """Краткие строки находок с фильтрами, от последних к старым"""
+        query = self.db.query(*SUMMARY_COLUMNS)
+        if filters is not None:
+            query = filters.apply(query)
+        return query.order_by(Result.last_seen.desc().nullslast(), Result.id.desc())
+
+    def page(
+        self,
+        filters: Optional[ResultFilter] = None,
+        page: int = 1,
+        per_page: int = 100,
+        with_total: bool = False
+    ) -> dict:
+        """Страница кратких строк (общее количество - только по запросу, это отдельный COUNT)"""
+        page = max(page, 1)
+        per_page = min(max(per_page, 1), 1000)
+
+        # Лишняя строка показывает, есть ли следующая страница
+        rows = self.rows(filters).offset((page - 1) * per_page).limit(per_page + 1).all()
+        has_more = len(rows) > per_page
+
+        result = {
+            "page": page,
+            "per_page": per_page,
+            "has_more": has_more,
+            "items": [row._asdict() for row in rows[:per_page]]
+        }
+        if with_total:
+            result["total"] = self.count(filters)
+        return result
+
+    def count(self, filters: Optional[ResultFilter] = None) -> int:
+        query = self.db.query(func.count(Result.id))
+        if filters is not None:
+            query = filters.apply(query)
+        return query.scalar() or 0
+
+    def summary(
+        self,
+        filters: Optional[ResultFilter] = None,
+        group_by: Sequence[str] = ("severity",),
+        limit: Optional[int] = None
+    ) -> List[dict]:
+        """Количество находок, повторов и последнее появление по группам"""
+        unknown = [field for field in group_by if field not in GROUP_FIELDS]
+        if unknown or not group_by:
+            raise Exception(f"Unsupported group_by fields: {', '.join(unknown) or '-'}")
+
+        columns = [GROUP_FIELDS[field] for field in group_by]
+        count = func.count(Result.id).label("count")
+        query = self.db.query(
+            *columns,
+            count,
+            func.coalesce(func.sum(Result.occurrence_count), 0).label("occurrences"),
+            func.max(Result.last_seen).label("last_seen")
+        )
+        if filters is not None:
+            query = filters.apply(query)
+        query = query.group_by(*columns).order_by(count.desc())
+        if limit:
+            query = query.limit(limit)
+
+        return [{
+            **{field: getattr(row, GROUP_FIELDS[field].key) for field in group_by},
+            "count": row.count,
+            "occurrences": int(row.occurrences or 0),
+            "last_seen": row.last_seen.isoformat() if row.last_seen else None
+        } for row in query.all()]
+
+    def severity_counts(self, filters: Optional[ResultFilter] = None) -> Dict[str, int]:
+        """Количество находок по уровням серьезности (все уровни, включая нулевые)"""
+        query = self.db.query(Result.severity, func.count(Result.id))
+        if filters is not None:
+            query = filters.apply(query)
+        counts = dict(query.group_by(Result.severity).all())
+        return {severity: counts.get(severity, 0) for severity in SEVERITY_ORDER}
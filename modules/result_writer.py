@@ -0,0 +1,266 @@
+import csv
+import io
+import time
+from datetime import datetime
+from typing import Iterable, List, Optional
+
+from sqlalchemy import bindparam, insert, text, update
+from sqlalchemy.orm import Session
+
+from database import Result, ResultOccurrence
+from modules.result_parser import Finding
+from modules.blob_store import blob_store
+from modules.scan_cache import host_key
+from config import settings
+
+RESULT_COLUMNS = [
+    "task_id", "last_task_id", "shard_id", "template_name", "protocol", "severity", "target",
+    "host_key", "matched_at", "matcher_name", "extracted_results", "curl_command", "raw_output", "raw_ref",
+    "fingerprint", "first_seen", "last_seen", "occurrence_count", "created_at"
+]
+
+# Обновление уже известной находки: первое появление и исходная задача сохраняются
+UPSERT_SET = "last_seen = EXCLUDED.last_seen, last_task_id = EXCLUDED.last_task_id, " \
+             "occurrence_count = {table}.occurrence_count + EXCLUDED.occurrence_count"
+
+
+class ResultWriter:
+    """Пакетная запись находок в таблицу results с дедупликацией
+
+    Находки превращаются в простые строки и записываются пакетами по
+    results_insert_batch_size. Повтор находки (тот же отпечаток) не
+    добавляет строку, а обновляет last_seen, last_task_id и счетчик
+    occurrence_count: на SQLite и PostgreSQL одним INSERT ... ON CONFLICT
+    (на PostgreSQL с psycopg2 - через COPY во временную таблицу), на
+    остальных СУБД - отдельными пакетами update и insert. Вклад части
+    в счетчики находки записывается в result_occurrences той же
+    транзакцией. Фиксацию транзакции выполняет вызывающий код вместе со
+    смещением файла.
+    """
+
+    def __init__(self):
+        self.stats = {
+            "rows": 0,
+            "batches": 0,
+            "seconds": 0.0,
+            "copy_batches": 0
+        }
+
+    def to_rows(self, findings: Iterable[Finding], task_id: int, shard_id: Optional[int] = None) -> List[dict]:
+        """Строки для записи; повторы внутри пакета сворачиваются в одну строку"""
+        now = datetime.utcnow()
+        rows = {}
+        for finding in findings:
+            row = rows.get(finding.fingerprint)
+            if row is not None:
+                row["occurrence_count"] += 1
+                continue
+            row = {
+                "task_id": task_id,
+                "last_task_id": task_id,
+                "shard_id": shard_id,
+                "first_seen": now,
+                "last_seen": now,
+                "occurrence_count": 1,
+                "created_at": now,
+                "raw_ref": None,
+                "host_key": host_key(finding.target),
+                **finding._asdict()
+            }
+            rows[finding.fingerprint] = row
+        return list(rows.values())
+
+    def write(self, db: Session, rows: List[dict]) -> int:
+        """Запись строк пакетами в текущей транзакции сессии (возвращает число находок)"""
+        if not rows:
+            return 0
+
+        started = time.monotonic()
+        batch_size = max(settings.results_insert_batch_size, 1)
+        dialect = db.get_bind().dialect
+
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            if settings.results_blob_store:
+                self._store_blobs(db, batch)
+            if self._can_copy(dialect):
+                self._copy_upsert(db, batch)
+                self.stats["copy_batches"] += 1
+            elif dialect.name in ("postgresql", "sqlite"):
+                self._insert_upsert(db, batch, dialect.name)
+            else:
+                self._generic_upsert(db, batch)
+            self._record_occurrences(db, batch, dialect.name)
+            self.stats["batches"] += 1
+
+        self.stats["rows"] += len(rows)
+        self.stats["seconds"] += time.monotonic() - started
+        return len(rows)
+
+    def _store_blobs(self, db: Session, rows: List[dict]):
+        """Вынос сырого вывода новых находок в хранилище blobs
+
+        Сырой вывод (вместе с curl командой внутри него) уходит в blobs, в
+        строке остается только ссылка. Для уже известных отпечатков upsert
+        сохраняет прежний raw_ref, поэтому их вывод не сохраняется вовсе и
+        не оставляет файлов без ссылок.
+        """
+        pending = [row for row in rows if row["raw_output"]]
+        if not pending:
+            return
+
+        existing = {fingerprint for (fingerprint,) in db.query(Result.fingerprint).filter(
+            Result.fingerprint.in_([row["fingerprint"] for row in pending])
+        ).all()}
+        for row in pending:
+            if row["fingerprint"] not in existing:
+                row["raw_ref"] = blob_store.put(row["raw_output"].encode("utf-8"))
+            row["raw_output"] = None
+            row["curl_command"] = None
+
+    def _can_copy(self, dialect) -> bool:
+        return settings.results_use_copy and dialect.name == "postgresql" and dialect.driver == "psycopg2"
+
+    def _insert_upsert(self, db: Session, rows: List[dict], dialect_name: str):
+        if dialect_name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+
+        table = Result.__table__
+        stmt = dialect_insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.fingerprint],
+            set_={
+                "last_seen": stmt.excluded.last_seen,
+                "last_task_id": stmt.excluded.last_task_id,
+                "occurrence_count": table.c.occurrence_count + stmt.excluded.occurrence_count
+            }
+        )
+        db.execute(stmt, rows)
+
+    def _generic_upsert(self, db: Session, rows: List[dict]):
+        table = Result.__table__
+        existing = {fingerprint for (fingerprint,) in db.query(Result.fingerprint).filter(
+            Result.fingerprint.in_([row["fingerprint"] for row in rows])
+        ).all()}
+
+        merged = [row for row in rows if row["fingerprint"] in existing]
+        if merged:
+            db.execute(
+                update(table).where(table.c.fingerprint == bindparam("fp")).values(
+                    last_seen=bindparam("seen"),
+                    last_task_id=bindparam("task"),
+                    occurrence_count=table.c.occurrence_count + bindparam("count")
+                ),
+                [{
+                    "fp": row["fingerprint"],
+                    "seen": row["last_seen"],
+                    "task": row["last_task_id"],
+                    "count": row["occurrence_count"]
+                } for row in merged]
+            )
+
+        new = [row for row in rows if row["fingerprint"] not in existing]
+        if new:
+            db.execute(insert(table), new)
+
+    def _record_occurrences(self, db: Session, rows: List[dict], dialect_name: str):
+        """Вклад части в счетчики находок пакета"""
+        table = ResultOccurrence.__table__
+        occurrences = [{
+            "fingerprint": row["fingerprint"],
+            "task_id": row["last_task_id"],
+            "shard_id": row["shard_id"],
+            "occurrence_count": row["occurrence_count"],
+            "first_seen": row["first_seen"],
+            "last_seen": row["last_seen"]
+        } for row in rows if row.get("fingerprint")]
+        if not occurrences:
+            return
+
+        if dialect_name in ("postgresql", "sqlite"):
+            if dialect_name == "postgresql":
+                from sqlalchemy.dialects.postgresql import insert as dialect_insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert as dialect_insert
+            stmt = dialect_insert(table)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[table.c.fingerprint, table.c.shard_id],
+                set_={
+                    "last_seen": stmt.excluded.last_seen,
+                    "occurrence_count": table.c.occurrence_count + stmt.excluded.occurrence_count
+                }
+            )
+            db.execute(stmt, occurrences)
+            return
+
+        shard_ids = {row["shard_id"] for row in occurrences}
+        existing = {(fingerprint, shard_id) for fingerprint, shard_id in db.query(
+            ResultOccurrence.fingerprint, ResultOccurrence.shard_id
+        ).filter(
+            ResultOccurrence.fingerprint.in_([row["fingerprint"] for row in occurrences]),
+            ResultOccurrence.shard_id.in_([shard_id for shard_id in shard_ids if shard_id is not None])
+        ).all()}
+
+        merged = [row for row in occurrences if (row["fingerprint"], row["shard_id"]) in existing]
+        if merged:
+            db.execute(
+                update(table).where(
+                    table.c.fingerprint == bindparam("fp"), table.c.shard_id == bindparam("shard")
+                ).values(
+                    last_seen=bindparam("seen"),
+                    occurrence_count=table.c.occurrence_count + bindparam("count")
+                ),
+                [{
+                    "fp": row["fingerprint"],
+                    "shard": row["shard_id"],
+                    "seen": row["last_seen"],
+                    "count": row["occurrence_count"]
+                } for row in merged]
+            )
+
+        new = [row for row in occurrences if (row["fingerprint"], row["shard_id"]) not in existing]
+        if new:
+            db.execute(insert(table), new)
+
+    def _copy_upsert(self, db: Session, rows: List[dict]):
+        """COPY во временную таблицу и перенос в results с ON CONFLICT"""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow([
+                "\\N" if row.get(column) is None else row[column]
+                for column in RESULT_COLUMNS
+            ])
+        buffer.seek(0)
+
+        table = Result.__tablename__
+        columns = ", ".join(RESULT_COLUMNS)
+        db.execute(text(
+            f"CREATE TEMP TABLE IF NOT EXISTS {table}_stage "
+            f"(LIKE {table} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+        ))
+
+        # Та же транзакция, что у сессии (смещение фиксируется вместе с находками)
+        raw = db.connection().connection
+        with raw.cursor() as cursor:
+            cursor.copy_expert(
+                f"COPY {table}_stage ({columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+                buffer
+            )
+
+        db.execute(text(
+            f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {table}_stage "
+            f"ON CONFLICT (fingerprint) DO UPDATE SET {UPSERT_SET.format(table=table)}"
+        ))
+        db.execute(text(f"DELETE FROM {table}_stage"))
+
+    def get_stats(self) -> dict:
+        seconds = self.stats["seconds"]
+        return {
+            **self.stats,
+            "seconds": round(seconds, 3),
+            "rows_per_second": round(self.stats["rows"] / seconds) if seconds else None,
+            "batch_size": settings.results_insert_batch_size
+        }
@@ -0,0 +1,304 @@
+import asyncio
+import hashlib
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, ScanCacheEntry, Template, Task, TaskShard, Result, ResultOccurrence
+from modules.target_ingest import normalize_target, iter_targets, gzip_writer
+from modules.transfer import file_sha256
+from config import settings
+
+
+def target_key(target: str) -> str:
+    """Ключ нормализованной цели (фиксированной длины для индекса)"""
+    return hashlib.blake2b(target.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def target_host(normalized: str) -> str:
+    """Хост нормализованной цели (без схемы, userinfo, порта и пути)"""
+    netloc = normalized.split("://", 1)[1] if "://" in normalized else normalized
+    netloc = netloc.split("/", 1)[0].split("?", 1)[0].rsplit("@", 1)[-1]
+    if netloc.startswith("["):
+        return netloc.split("]", 1)[0].strip("[")
+    if netloc.count(":") == 1:
+        return netloc.rsplit(":", 1)[0]
+    return netloc
+
+
+def host_key(target: Optional[str]) -> Optional[str]:
+    """Ключ хоста цели находки (results.host_key) для поиска находок по кэшу"""
+    normalized = normalize_target(target or "")
+    if not normalized:
+        return None
+    return target_key(target_host(normalized))
+
+
+def _chunks(items: Iterable[str], size: int) -> Iterable[List[str]]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class ScanCache:
+    """Кэш результатов сканирования между задачами
+
+    Запись - пара (нормализованная цель, SHA-256 шаблона) со сроком
+    жизни scan_cache_ttl. Цели, просканированные тем же шаблоном
+    недавно, отсеиваются при создании задачи; их находки могут быть
+    засчитаны новой задаче по results.host_key. Поиск идет пакетами по уникальному
+    индексу (template_hash, target_key), просроченные записи удаляются
+    фоновым циклом.
+    """
+
+    def __init__(self):
+        self.stats = {
+            "lookups": 0,
+            "hits": 0,
+            "recorded": 0,
+            "copied_findings": 0,
+            "evicted": 0
+        }
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None and settings.scan_cache_enabled:
+            self._task = asyncio.create_task(self._loop())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await loop.run_in_executor(None, self.evict_expired)
+            except Exception as e:
+                print(f"Scan cache eviction failed: {str(e)}")
+            await asyncio.sleep(settings.scan_cache_evict_interval)
+
+    def template_hash(self, template: Template, db: Session) -> str:
+        """SHA-256 содержимого шаблона (для старых шаблонов считается при первом обращении)"""
+        if not template.content_hash:
+            template.content_hash = file_sha256(template.file_path)
+            db.commit()
+        return template.content_hash
+
+    def _lookup(self, db: Session, template_hash: str, keys: List[str], now: datetime) -> Dict[str, int]:
+        """Действующие записи кэша: target_key -> задача, в которой цель сканировалась"""
+        return dict(db.query(ScanCacheEntry.target_key, ScanCacheEntry.task_id).filter(
+            ScanCacheEntry.template_hash == template_hash,
+            ScanCacheEntry.target_key.in_(keys),
+            ScanCacheEntry.expires_at > now
+        ).all())
+
+    def filter_targets(self, targets_path: str, template_hash: str, collect_hits: bool = False) -> dict:
+        """Отсев недавно просканированных целей из канонического файла (на месте)
+
+        Возвращает количество оставшихся и пропущенных целей, а при
+        collect_hits - пары (ключ цели, ключ хоста) пропущенных целей по
+        исходным задачам.
+        """
+        tmp_path = f"{targets_path}.filter.tmp"
+        hits: Dict[int, Set[Tuple[str, str]]] = {}
+        kept = 0
+        cached = 0
+        now = datetime.utcnow()
+
+        db = SessionLocal()
+        try:
+            with gzip_writer(tmp_path) as dst:
+                for batch in _chunks(iter_targets(targets_path), settings.scan_cache_batch_size):
+                    keys = [target_key(target) for target in batch]
+                    found = self._lookup(db, template_hash, keys, now)
+                    self.stats["lookups"] += len(keys)
+
+                    out = []
+                    for target, key in zip(batch, keys):
+                        if key in found:
+                            cached += 1
+                            if collect_hits:
+                                hits.setdefault(found[key], set()).add((key, target_key(target_host(target))))
+                        else:
+                            out.append(target)
+                    if out:
+                        dst.write(("\n".join(out) + "\n").encode("utf-8"))
+                        kept += len(out)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        finally:
+            db.close()
+
+        os.replace(tmp_path, targets_path)
+        self.stats["hits"] += cached
+        return {"targets": kept, "cached": cached, "hits": hits}
+
+    def _result_keys(self, result_target: Optional[str]) -> Set[str]:
+        """Ключи целей, к которым может относиться находка (URL, host:port и хост)"""
+        keys = set()
+        normalized = normalize_target(result_target or "")
+        if not normalized:
+            return keys
+        keys.add(target_key(normalized))
+        if "://" in normalized:
+            keys.add(target_key(normalized.split("://", 1)[1].split("/", 1)[0]))
+        keys.add(target_key(target_host(normalized)))
+        return keys
+
+    def copy_findings(self, task_id: int, hits: Dict[int, Set[Tuple[str, str]]]) -> int:
+        """Засчитывание находок пропущенных целей новой задаче
+
+        Кандидаты выбираются в SQL: находки исходной задачи (по
+        result_occurrences) с тем же ключом хоста; точное совпадение с
+        целью проверяется только для них. Находки не дублируются и не
+        меняются: новой задаче добавляется вхождение без части с нулевым
+        счетчиком, а results_count растет только на находки, которых в
+        задаче еще не было.
+        """
+        db = SessionLocal()
+        copied = 0
+        try:
+            for source_task_id, pairs in hits.items():
+                if source_task_id is None or source_task_id == task_id:
+                    continue
+                keys = {key for key, _ in pairs}
+
+                for hosts in _chunks({host for _, host in pairs}, settings.scan_cache_batch_size):
+                    candidates = db.query(Result.fingerprint, Result.target, Result.first_seen, Result.last_seen).join(
+                        ResultOccurrence, ResultOccurrence.fingerprint == Result.fingerprint
+                    ).filter(
+                        Result.host_key.in_(hosts),
+                        ResultOccurrence.task_id == source_task_id
+                    ).distinct().all()
+                    matched = {row.fingerprint: row for row in candidates if self._result_keys(row.target) & keys}
+                    if not matched:
+                        continue
+
+                    known = {fingerprint for (fingerprint,) in db.query(ResultOccurrence.fingerprint).filter(
+                        ResultOccurrence.task_id == task_id,
+                        ResultOccurrence.fingerprint.in_(list(matched))
+                    ).all()}
+                    new = [row for fingerprint, row in matched.items() if fingerprint not in known]
+                    if new:
+                        db.bulk_insert_mappings(ResultOccurrence, [{
+                            "fingerprint": row.fingerprint,
+                            "task_id": task_id,
+                            "shard_id": None,
+                            "occurrence_count": 0,
+                            "first_seen": row.first_seen,
+                            "last_seen": row.last_seen
+                        } for row in new])
+                        db.flush()
+                        copied += len(new)
+
+            if copied:
+                db.query(Task).filter(Task.id == task_id).update(
+                    {Task.results_count: Task.results_count + copied}, synchronize_session=False
+                )
+            db.commit()
+        finally:
+            db.close()
+
+        self.stats["copied_findings"] += copied
+        return copied
+
+    def record_shard(self, shard_id: int) -> int:
+        """Запись целей завершенной части в кэш (продление срока для уже известных)"""
+        db = SessionLocal()
+        recorded = 0
+        try:
+            shard = db.query(TaskShard).filter(TaskShard.id == shard_id).first()
+            if not shard or not shard.targets_file or not os.path.exists(shard.targets_file):
+                return 0
+            template_hash = self.template_hash(shard.task.template, db)
+            now = datetime.utcnow()
+            expires_at = now + timedelta(seconds=settings.scan_cache_ttl)
+
+            for batch in _chunks(iter_targets(shard.targets_file), settings.scan_cache_batch_size):
+                keys = list({target_key(target) for target in batch})
+                for attempt in range(2):
+                    try:
+                        self._upsert(db, template_hash, keys, shard.task_id, now, expires_at)
+                        db.commit()
+                        break
+                    except IntegrityError:
+                        # Те же цели одновременно записала другая задача
+                        db.rollback()
+                        if attempt:
+                            raise
+                recorded += len(keys)
+        finally:
+            db.close()
+
+        self.stats["recorded"] += recorded
+        return recorded
+
+    def _upsert(self, db: Session, template_hash: str, keys: List[str], task_id: int, now: datetime, expires_at: datetime):
+        existing = {key for (key,) in db.query(ScanCacheEntry.target_key).filter(
+            ScanCacheEntry.template_hash == template_hash,
+            ScanCacheEntry.target_key.in_(keys)
+        ).all()}
+
+        if existing:
+            db.query(ScanCacheEntry).filter(
+                ScanCacheEntry.template_hash == template_hash,
+                ScanCacheEntry.target_key.in_(existing)
+            ).update({
+                ScanCacheEntry.task_id: task_id,
+                ScanCacheEntry.scanned_at: now,
+                ScanCacheEntry.expires_at: expires_at
+            }, synchronize_session=False)
+
+        new = [key for key in keys if key not in existing]
+        if new:
+            db.bulk_insert_mappings(ScanCacheEntry, [{
+                "template_hash": template_hash,
+                "target_key": key,
+                "task_id": task_id,
+                "scanned_at": now,
+                "expires_at": expires_at
+            } for key in new])
+
+    def evict_expired(self) -> int:
+        """Удаление просроченных записей пакетами (без долгой блокировки таблицы)"""
+        db = SessionLocal()
+        evicted = 0
+        try:
+            now = datetime.utcnow()
+            while True:
+                ids = [entry_id for (entry_id,) in db.query(ScanCacheEntry.id).filter(
+                    ScanCacheEntry.expires_at <= now
+                ).limit(settings.scan_cache_batch_size).all()]
+                if not ids:
+                    break
+                db.query(ScanCacheEntry).filter(ScanCacheEntry.id.in_(ids)).delete(synchronize_session=False)
+                db.commit()
+                evicted += len(ids)
+        finally:
+            db.close()
+
+        self.stats["evicted"] += evicted
+        return evicted
+
+    def get_stats(self, db: Session) -> dict:
+        now = datetime.utcnow()
+        return {
+            "enabled": settings.scan_cache_enabled,
+            "ttl": settings.scan_cache_ttl,
+            "entries": db.query(func.count(ScanCacheEntry.id)).scalar(),
+            "expired": db.query(func.count(ScanCacheEntry.id)).filter(ScanCacheEntry.expires_at <= now).scalar(),
+            **self.stats
+        }
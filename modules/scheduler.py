@@ -0,0 +1,184 @@
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from database import Worker, TaskShard, WorkerTemplate
+from modules.health_monitor import HealthMonitor
+from config import settings
+
+
+class WorkerLoad:
+    """Текущая нагрузка воркера для планировщика"""
+
+    def __init__(self, worker: Worker):
+        self.worker = worker
+        self.running = 0  # Запущенные screen сессии
+        self.queued = 0  # Части, назначенные, но еще не запущенные
+        self.cpu = 0.0  # Load average на ядро
+        self.mem = 0.0  # Доля занятой памяти
+        self.throughput: Optional[float] = None  # Целей в секунду по последним частям
+        self.speed = 1.0  # Скорость относительно медианы парка
+
+    @property
+    def scans(self) -> int:
+        return self.running + self.queued
+
+    @property
+    def free_slots(self) -> int:
+        return settings.max_scans_per_worker - self.scans
+
+    @property
+    def score(self) -> float:
+        """Оценка загрузки (меньше - лучше)"""
+        slots = self.scans / max(settings.max_scans_per_worker, 1)
+        return (slots + self.cpu + self.mem * 0.5) / self.speed
+
+    def to_dict(self) -> dict:
+        return {
+            "worker_id": self.worker.id,
+            "name": self.worker.name,
+            "running": self.running,
+            "queued": self.queued,
+            "cpu": round(self.cpu, 2),
+            "mem": round(self.mem, 2),
+            "throughput": round(self.throughput, 2) if self.throughput is not None else None,
+            "free_slots": self.free_slots,
+            "score": round(self.score, 3)
+        }
+
+
+class WorkerScheduler:
+    """Выбор воркеров для частей задачи по нагрузке
+
+    Учитываются запущенные и ожидающие части на воркере, load average на
+    ядро и память (из heartbeat или от агента), скорость последних частей
+    и наличие нужного шаблона. На воркер ставится не больше
+    max_scans_per_worker одновременных сканов.
+    """
+
+    def __init__(self, health_monitor: HealthMonitor, agent_ingest=None):
+        self.health_monitor = health_monitor
+        self.agent_ingest = agent_ingest
+
+    def _resources(self, worker_id: int) -> dict:
+        """Свежие данные агента воркера (если агент активен)"""
+        if self.agent_ingest is None or not self.agent_ingest.is_active(worker_id):
+            return {}
+        return self.agent_ingest.resources.get(worker_id, {})
+
+    def collect(self, db: Session) -> List[WorkerLoad]:
+        """Нагрузка всех доступных воркеров"""
+        workers = db.query(Worker).filter(Worker.status == "online").order_by(Worker.id).all()
+        loads = {w.id: WorkerLoad(w) for w in workers if self.health_monitor.is_available(w.id)}
+        if not loads:
+            return []
+
+        # Запущенные части на воркерах (ожидающие назначаются диспетчером)
+        counts = db.query(TaskShard.worker_id, TaskShard.status, func.count(TaskShard.id)).filter(
+            TaskShard.worker_id.in_(loads.keys()),
+            TaskShard.status.in_(("pending", "running"))
+        ).group_by(TaskShard.worker_id, TaskShard.status).all()
+        for worker_id, status, count in counts:
+            if status == "running":
+                loads[worker_id].running = count
+            else:
+                loads[worker_id].queued = count
+
+        # CPU и память
+        for load in loads.values():
+            worker = load.worker
+            resources = self._resources(worker.id)
+            load_avg = resources["load_avg"][0] if resources.get("load_avg") else worker.load_avg
+            if load_avg is not None:
+                load.cpu = load_avg / max(worker.cpu_count or 1, 1)
+            if resources.get("mem_total_kb"):
+                load.mem = 1 - resources.get("mem_available_kb", 0) / resources["mem_total_kb"]
+            elif worker.mem_usage is not None:
+                load.mem = worker.mem_usage / 100.0
+            # Агент видит и сканы, запущенные не этим контроллером
+            load.running = max(load.running, resources.get("nuclei_processes", 0))
+
+        self._throughput(db, loads)
+        return list(loads.values())
+
+    def _throughput(self, db: Session, loads: Dict[int, WorkerLoad]):
+        """Скорость воркеров по последним завершенным частям
+
+        Последние scheduler_throughput_window частей каждого воркера
+        выбираются одним запросом с ROW_NUMBER() по воркеру.
+        """
+        ranked = db.query(
+            TaskShard.worker_id,
+            TaskShard.targets_count,
+            TaskShard.started_at,
+            TaskShard.completed_at,
+            func.row_number().over(
+                partition_by=TaskShard.worker_id,
+                order_by=TaskShard.completed_at.desc()
+            ).label("position")
+        ).filter(
+            TaskShard.worker_id.in_(loads.keys()),
+            TaskShard.status == "completed",
+            TaskShard.started_at.isnot(None),
+            TaskShard.completed_at.isnot(None)
+        ).subquery()
+
+        totals = {}  # worker_id -> [цели, секунды]
+        for worker_id, targets_count, started_at, completed_at in db.query(
+            ranked.c.worker_id, ranked.c.targets_count, ranked.c.started_at, ranked.c.completed_at
+        ).filter(ranked.c.position <= settings.scheduler_throughput_window):
+            total = totals.setdefault(worker_id, [0, 0.0])
+            total[0] += targets_count or 0
+            total[1] += (completed_at - started_at).total_seconds()
+
+        for worker_id, (targets, seconds) in totals.items():
+            if targets and seconds > 0:
+                loads[worker_id].throughput = targets / seconds
+
+        known = sorted(l.throughput for l in loads.values() if l.throughput)
+        if known:
+            median = known[len(known) // 2]
+            for load in loads.values():
+                if load.throughput:
+                    # Ограничение, чтобы одна быстрая часть не перевешивала загрузку
+                    load.speed = min(max(load.throughput / median, 0.5), 2.0)
+
+    def deployed_templates(self, db: Session, worker_ids: List[int]) -> set:
+        """Пары (worker_id, template_id) развернутых шаблонов"""
+        if not worker_ids:
+            return set()
+        return set(db.query(WorkerTemplate.worker_id, WorkerTemplate.template_id).filter(
+            WorkerTemplate.worker_id.in_(worker_ids)
+        ).all())
+
+    def pick(
+        self,
+        loads: List[WorkerLoad],
+        template_id: int,
+        deployed: set,
+        exclude: Optional[int] = None
+    ) -> Optional[WorkerLoad]:
+        """Наименее загруженный воркер со свободным слотом для части задачи
+
+        Воркеры с развернутым шаблоном имеют приоритет; если среди свободных
+        его нет ни на одном, подходят все (шаблон развернется при запуске).
+        Выбранному воркеру сразу засчитывается новая часть. exclude -
+        воркер, который не подходит (например, воркер исходной части).
+        """
+        candidates = [l for l in loads if l.free_slots > 0 and l.worker.id != exclude]
+        if not candidates:
+            return None
+
+        with_template = [l for l in candidates if (l.worker.id, template_id) in deployed]
+        best = min(with_template or candidates, key=lambda l: (l.score, l.worker.id))
+        best.queued += 1
+        return best
+
+    def get_stats(self, db: Session) -> dict:
+        return {
+            "max_scans_per_worker": settings.max_scans_per_worker,
+            "generated_at": datetime.utcnow().isoformat(),
+            "workers": [l.to_dict() for l in sorted(self.collect(db), key=lambda l: l.score)]
+        }
@@ -0,0 +1,119 @@
+import os
+from typing import List
+
+from sqlalchemy import inspect
+
+from database import engine
+from config import settings
+
+# alembic входит в зависимости, но без него схема создается напрямую
+try:
+    from alembic import command
+    from alembic.config import Config
+    from alembic.runtime.migration import MigrationContext
+    from alembic.script import ScriptDirectory
+except ImportError:
+    command = None
+
+ALEMBIC_INI = os.path.join(settings.base_dir, "alembic.ini")
+
+# Частые запросы и колонки, с которых должен начинаться подходящий индекс
+HOT_QUERIES = [
+    ("results: list ordered by last_seen", "results", ["last_seen"]),
+    ("results: filter by severity", "results", ["severity"]),
+    ("results: filter and cascade by task", "results", ["task_id"]),
+    ("results: filter by last task", "results", ["last_task_id"]),
+    ("results: filter by template", "results", ["template_name"]),
+    ("results: cached findings by host", "results", ["host_key"]),
+    ("results: upsert by fingerprint", "results", ["fingerprint"]),
+    ("tasks: dispatcher queue by status", "tasks", ["status", "created_at"]),
+    ("tasks: list ordered by created_at", "tasks", ["created_at"]),
+    ("task_shards: pending and running shards", "task_shards", ["status"]),
+    ("task_shards: shards of a task", "task_shards", ["task_id"]),
+    ("task_shards: worker load", "task_shards", ["worker_id"]),
+    ("task_stats: history of a task", "task_stats", ["task_id"]),
+    ("workers: online workers", "workers", ["status"]),
+    ("scan_cache: lookup by template and target", "scan_cache", ["template_hash", "target_key"]),
+    ("scan_cache: eviction by expires_at", "scan_cache", ["expires_at"]),
+    ("result_archives: archive files owned by a task", "result_archives", ["task_id"]),
+    ("result_archive_tasks: archive files with findings of a task", "result_archive_tasks", ["task_id"]),
+    ("result_occurrences: contributions of a shard", "result_occurrences", ["shard_id"]),
+    ("result_occurrences: contributions to a finding", "result_occurrences", ["fingerprint"]),
+    ("result_occurrences: findings of a task", "result_occurrences", ["task_id"]),
+]
+
+
+def _config(connection=None) -> "Config":
+    config = Config(ALEMBIC_INI)
+    config.set_main_option("script_location", os.path.join(settings.base_dir, "migrations"))
+    config.attributes["configure_logger"] = False
+    if connection is not None:
+        config.attributes["connection"] = connection
+    return config
+
+
+def upgrade_schema():
+    """Обновление схемы БД до последней миграции"""
+    if command is None:
+        from database import Base
+        print("alembic is not installed, creating schema without migrations")
+        Base.metadata.create_all(bind=engine)
+        return
+
+    with engine.begin() as connection:
+        if connection.dialect.name == "postgresql":
+            # Построение индексов на больших таблицах дольше обычного лимита запроса
+            connection.exec_driver_sql("SET LOCAL statement_timeout = 0")
+        command.upgrade(_config(connection), "head")
+
+
+def schema_revision() -> dict:
+    """Текущая и последняя ревизии схемы"""
+    if command is None:
+        return {"current": None, "head": None, "up_to_date": None}
+
+    with engine.connect() as connection:
+        current = MigrationContext.configure(connection).get_current_revision()
+    head = ScriptDirectory.from_config(_config()).get_current_head()
+    return {"current": current, "head": head, "up_to_date": current == head}
+
+
+def _leading_columns(inspector, table: str) -> List[List[str]]:
+    """Колонки всех индексов таблицы (включая первичный ключ и уникальные ограничения)"""
+    leading = [index["column_names"] for index in inspector.get_indexes(table)]
+    leading += [constraint["column_names"] for constraint in inspector.get_unique_constraints(table)]
+    primary = inspector.get_pk_constraint(table).get("constrained_columns")
+    if primary:
+        leading.append(primary)
+    return leading
+
+
+def check_indexes() -> List[dict]:
+    """Частые запросы, для которых в БД нет подходящего индекса"""
+    inspector = inspect(engine)
+    tables = set(inspector.get_table_names())
+    cache = {}
+    missing = []
+
+    for query, table, columns in HOT_QUERIES:
+        if table not in tables:
+            missing.append({"query": query, "table": table, "columns": columns, "reason": "table is missing"})
+            continue
+        if table not in cache:
+            cache[table] = _leading_columns(inspector, table)
+        if not any(index[:len(columns)] == columns for index in cache[table]):
+            missing.append({"query": query, "table": table, "columns": columns, "reason": "no index"})
+
+    return missing
+
+
+def report_schema() -> List[dict]:
+    """Проверка схемы на старте: отставание миграций и запросы без индексов"""
+    revision = schema_revision()
+    if revision["up_to_date"] is False:
+        print(f"Database schema is at revision {revision['current']}, latest is {revision['head']}: run 'alembic upgrade head'")
+
+    missing = check_indexes()
+    for item in missing:
+        print(f"Query without index: {item['query']} ({item['table']}: {', '.join(item['columns'])}, {item['reason']})")
+    return missing
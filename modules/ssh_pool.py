@@ -0,0 +1,282 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Tuple
+
+import asyncssh
+
+from database import Worker
+from config import settings
+
+# Ошибки транспорта, после которых операцию можно повторить на новом подключении.
+# TimeoutError тоже подкласс OSError, но таймаут операции не означает обрыв
+# подключения и обрабатывается отдельно
+RETRYABLE_ERRORS = (asyncssh.DisconnectError, asyncssh.ConnectionLost, asyncssh.ChannelOpenError, OSError)
+
+
+class PooledConnection:
+    """SSH подключение, принадлежащее пулу"""
+
+    def __init__(self, key: Tuple[str, int, str], conn: asyncssh.SSHClientConnection):
+        self.key = key
+        self.conn = conn
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.last_checked = self.created_at
+        self.active = 0  # Количество открытых каналов
+        self.broken = False
+
+    async def is_alive(self, timeout: float) -> bool:
+        """Проверка живости подключения"""
+        try:
+            result = await asyncio.wait_for(self.conn.run("true", check=False), timeout)
+            return result.exit_status == 0
+        except Exception:
+            return False
+
+    def close(self):
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+
+
+class SSHConnectionPool:
+    """Пул постоянных SSH подключений к воркерам (asyncssh)
+
+    Одно подключение мультиплексирует до max_channels каналов, поэтому
+    параллельные операции с одним воркером не требуют новых рукопожатий.
+    """
+
+    def __init__(
+        self,
+        max_per_worker: int = settings.ssh_pool_max_per_worker,
+        max_channels: int = settings.ssh_max_channels_per_connection,
+        idle_timeout: int = settings.ssh_pool_idle_timeout,
+        keepalive_interval: int = settings.ssh_keepalive_interval,
+        health_check_interval: int = settings.ssh_health_check_interval
+    ):
+        self.max_per_worker = max_per_worker
+        self.max_channels = max_channels
+        self.idle_timeout = idle_timeout
+        self.keepalive_interval = keepalive_interval
+        self.health_check_interval = health_check_interval
+
+        self._connections: Dict[Tuple[str, int, str], List[PooledConnection]] = {}
+        self._connecting: Dict[Tuple[str, int, str], int] = {}
+        self._condition = None
+        self._maintenance_task = None
+
+        # Счетчики
+        self.stats = {
+            "created": 0,
+            "reused": 0,
+            "reconnects": 0,
+            "evicted_idle": 0,
+            "health_check_failures": 0,
+            "discarded": 0,
+            "waits": 0
+        }
+
+    @property
+    def condition(self) -> asyncio.Condition:
+        # Создается лениво внутри работающего event loop
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    @staticmethod
+    def _key(worker: Worker) -> Tuple[str, int, str]:
+        return (worker.ip_address, worker.ssh_port or 22, worker.username)
+
+    async def _connect(self, worker: Worker) -> asyncssh.SSHClientConnection:
+        """Создание SSH подключения"""
+        try:
+            return await asyncssh.connect(
+                worker.ip_address,
+                port=worker.ssh_port or 22,
+                username=worker.username,
+                password=worker.password,
+                known_hosts=None,
+                keepalive_interval=self.keepalive_interval,
+                keepalive_count_max=3,
+                connect_timeout=settings.worker_timeout
+            )
+        except Exception as e:
+            raise Exception(f"SSH connection failed: {str(e)}")
+
+    def _pick(self, key) -> PooledConnection:
+        """Выбор наименее загруженного подключения с свободным каналом"""
+        candidates = [
+            c for c in self._connections.get(key, [])
+            if not c.broken and c.active < self.max_channels
+        ]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda c: c.active)
+
+    async def acquire(self, worker: Worker) -> PooledConnection:
+        """Получение подключения из пула (или создание нового)"""
+        key = self._key(worker)
+        self.evict_idle()
+
+        async with self.condition:
+            while True:
+                conn = self._pick(key)
+                if conn is not None:
+                    conn.active += 1
+                    break
+
+                total = len(self._connections.get(key, [])) + self._connecting.get(key, 0)
+                if total < self.max_per_worker:
+                    conn = None
+                    self._connecting[key] = self._connecting.get(key, 0) + 1
+                    break
+
+                # Все подключения заняты - ждем освобождения канала
+                self.stats["waits"] += 1
+                await self.condition.wait()
+
+        if conn is not None:
+            # Периодическая проверка подключения, простаивавшего долгое время
+            now = time.monotonic()
+            if now - conn.last_checked > self.health_check_interval and conn.active == 1:
+                conn.last_checked = now
+                if not await conn.is_alive(timeout=self.keepalive_interval):
+                    self.stats["health_check_failures"] += 1
+                    conn.broken = True
+                    await self.release(conn)
+                    return await self._reconnect(worker)
+
+            self.stats["reused"] += 1
+            conn.last_used = now
+            return conn
+
+        return await self._open(worker, key)
+
+    async def _open(self, worker: Worker, key) -> PooledConnection:
+        try:
+            client = await self._connect(worker)
+        finally:
+            async with self.condition:
+                self._connecting[key] -= 1
+                self.condition.notify_all()
+
+        conn = PooledConnection(key, client)
+        conn.active = 1
+        async with self.condition:
+            self._connections.setdefault(key, []).append(conn)
+        self.stats["created"] += 1
+        return conn
+
+    async def _reconnect(self, worker: Worker) -> PooledConnection:
+        key = self._key(worker)
+        async with self.condition:
+            self._connecting[key] = self._connecting.get(key, 0) + 1
+        self.stats["reconnects"] += 1
+        return await self._open(worker, key)
+
+    async def _discard(self, conn: PooledConnection):
+        """Удаление подключения из пула
+
+        Новые каналы на подключении больше не открываются, а закрывается
+        оно после освобождения последнего канала - остальные операции
+        на нем доходят до конца.
+        """
+        conn.broken = True
+        async with self.condition:
+            conns = self._connections.get(conn.key, [])
+            if conn in conns:
+                conns.remove(conn)
+                self.stats["discarded"] += 1
+            self.condition.notify_all()
+            idle = conn.active == 0
+        if idle:
+            conn.close()
+
+    async def release(self, conn: PooledConnection):
+        """Возврат канала подключения в пул"""
+        conn.last_used = time.monotonic()
+
+        async with self.condition:
+            conn.active = max(conn.active - 1, 0)
+            self.condition.notify_all()
+
+        if conn.broken:
+            await self._discard(conn)
+
+    @asynccontextmanager
+    async def connection(self, worker: Worker):
+        """Контекстный менеджер для работы с подключением из пула"""
+        conn = await self.acquire(worker)
+        try:
+            yield conn.conn
+        except asyncio.TimeoutError:
+            # Таймаут одной операции - подключение остается в пуле
+            raise
+        except RETRYABLE_ERRORS:
+            # Транспорт поврежден - не возвращаем в пул, следующий захват переподключится
+            conn.broken = True
+            self.stats["reconnects"] += 1
+            raise
+        finally:
+            await self.release(conn)
+
+    def evict_idle(self):
+        """Закрытие подключений, простаивающих дольше idle_timeout"""
+        now = time.monotonic()
+        expired = []
+
+        for key, conns in self._connections.items():
+            alive = []
+            for conn in conns:
+                if conn.active == 0 and now - conn.last_used > self.idle_timeout:
+                    expired.append(conn)
+                else:
+                    alive.append(conn)
+            self._connections[key] = alive
+
+        self.stats["evicted_idle"] += len(expired)
+        for conn in expired:
+            conn.close()
+
+    async def _maintenance_loop(self):
+        while True:
+            await asyncio.sleep(max(self.idle_timeout // 4, 5))
+            self.evict_idle()
+
+    def start(self):
+        """Запуск фоновой очистки простаивающих подключений"""
+        if self._maintenance_task is None:
+            self._maintenance_task = asyncio.create_task(self._maintenance_loop())
+
+    def close_worker(self, worker: Worker):
+        """Закрытие всех подключений воркера"""
+        for conn in self._connections.pop(self._key(worker), []):
+            conn.broken = True
+            conn.close()
+
+    def close_all(self):
+        """Закрытие всех подключений пула"""
+        if self._maintenance_task is not None:
+            self._maintenance_task.cancel()
+            self._maintenance_task = None
+
+        for conns in self._connections.values():
+            for conn in conns:
+                conn.close()
+        self._connections.clear()
+
+    def get_stats(self) -> dict:
+        """Статистика пула"""
+        conns = [c for cs in self._connections.values() for c in cs]
+        stats = dict(self.stats)
+        stats["connections"] = len(conns)
+        stats["active_channels"] = sum(c.active for c in conns)
+        stats["idle_connections"] = len([c for c in conns if c.active == 0])
+        stats["workers"] = len([k for k, cs in self._connections.items() if cs])
+        return stats
+
+
+# Общий пул для всех менеджеров
+ssh_pool = SSHConnectionPool()
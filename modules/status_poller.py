@@ -0,0 +1,177 @@
+import asyncio
+import time
+from types import SimpleNamespace
+from typing import Dict, Optional
+
+from database import Worker
+from modules.worker_manager import WorkerManager
+from config import settings
+
+
+def worker_snapshot(worker: Worker) -> SimpleNamespace:
+    """Копия параметров подключения, не зависящая от сессии БД"""
+    return SimpleNamespace(
+        id=worker.id,
+        name=worker.name,
+        ip_address=worker.ip_address,
+        ssh_port=worker.ssh_port,
+        username=worker.username,
+        password=worker.password
+    )
+
+
+class Subscription:
+    """Ожидание статуса одной screen сессии"""
+
+    def __init__(self, screen_name: str, task_id: int):
+        self.screen_name = screen_name
+        self.task_id = task_id
+        self.started_at = time.monotonic()
+        self.interval = settings.status_poll_min_interval
+        self.progress = 0.0
+        self.future: Optional[asyncio.Future] = None
+
+    def next_interval(self) -> float:
+        """Интервал опроса: растет для долгих сканов, сжимается у завершения"""
+        if self.progress >= 90.0:
+            self.interval = settings.status_poll_min_interval
+        else:
+            self.interval = min(
+                self.interval * settings.status_poll_backoff,
+                settings.status_poll_max_interval
+            )
+        return self.interval
+
+
+class WorkerPoller:
+    """Цикл опроса одного воркера, обслуживающий все его сессии"""
+
+    def __init__(self, worker: Worker):
+        self.worker = worker_snapshot(worker)
+        self.subscriptions: Dict[str, Subscription] = {}
+        self.last_snapshot: Optional[dict] = None
+        self.last_polled: Optional[float] = None
+        self.failures = 0
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+
+class StatusPoller:
+    """Центральный опрос статуса сканирований: один цикл на воркер
+
+    Все задачи воркера получают статус из одного выполнения команды
+    (screen -ls, хвосты логов, размеры файлов результатов, load average).
+    """
+
+    def __init__(self, worker_manager: Optional[WorkerManager] = None):
+        self.worker_manager = worker_manager or WorkerManager()
+        self.pollers: Dict[int, WorkerPoller] = {}
+        self.rounds = 0
+
+    async def wait_status(self, worker: Worker, screen_name: str, task_id: int, progress: float = 0.0) -> dict:
+        """Ожидание статуса сессии из следующего раунда опроса"""
+        poller = self.pollers.get(worker.id)
+        if poller is None:
+            poller = WorkerPoller(worker)
+            self.pollers[worker.id] = poller
+
+        sub = poller.subscriptions.get(screen_name)
+        if sub is None:
+            sub = Subscription(screen_name, task_id)
+            poller.subscriptions[screen_name] = sub
+            poller.wakeup.set()
+
+        sub.progress = progress or 0.0
+        if sub.future is None or sub.future.done():
+            sub.future = asyncio.get_running_loop().create_future()
+
+        if poller.task is None or poller.task.done():
+            poller.task = asyncio.create_task(self._loop(poller))
+
+        return await sub.future
+
+    def unsubscribe(self, worker_id: int, screen_name: str):
+        """Прекращение опроса сессии"""
+        poller = self.pollers.get(worker_id)
+        if poller is None:
+            return
+
+        sub = poller.subscriptions.pop(screen_name, None)
+        if sub is not None and sub.future is not None and not sub.future.done():
+            sub.future.cancel()
+
+        if not poller.subscriptions:
+            poller.wakeup.set()
+
+    def last_status(self, worker_id: int, screen_name: str) -> Optional[dict]:
+        """Последний полученный статус сессии (без обращения к воркеру)"""
+        poller = self.pollers.get(worker_id)
+        if poller is None or poller.last_snapshot is None:
+            return None
+        return poller.last_snapshot["sessions"].get(screen_name)
+
+    async def _loop(self, poller: WorkerPoller):
+        while poller.subscriptions:
+            poller.wakeup.clear()
+            subscriptions = dict(poller.subscriptions)
+
+            try:
+                snapshot = await self.worker_manager.probe_sessions(
+                    poller.worker,
+                    {name: sub.task_id for name, sub in subscriptions.items()}
+                )
+                poller.failures = 0
+                poller.last_snapshot = snapshot
+                poller.last_polled = time.monotonic()
+                self.rounds += 1
+            except Exception as e:
+                poller.failures += 1
+                # Кратковременный сбой SSH не должен завершать сканирования
+                if poller.failures < settings.status_poll_max_failures:
+                    await self._sleep(poller, settings.status_poll_min_interval)
+                    continue
+                snapshot = {
+                    "load_avg": None,
+                    "sessions": {
+                        name: {"is_running": False, "log_tail": f"Error: {str(e)}", "results_size": 0, "error": str(e)}
+                        for name in subscriptions
+                    }
+                }
+
+            # Рассылка результатов ожидающим задачам
+            for name, sub in subscriptions.items():
+                status = dict(snapshot["sessions"].get(name, {"is_running": False, "log_tail": "", "results_size": 0}))
+                status["load_avg"] = snapshot["load_avg"]
+                if sub.future is not None and not sub.future.done():
+                    sub.future.set_result(status)
+
+            if not poller.subscriptions:
+                break
+
+            interval = min(sub.next_interval() for sub in poller.subscriptions.values())
+            await self._sleep(poller, interval)
+
+        if self.pollers.get(poller.worker.id) is poller:
+            del self.pollers[poller.worker.id]
+
+    async def _sleep(self, poller: WorkerPoller, interval: float):
+        """Пауза до следующего раунда (прерывается новой подпиской)"""
+        try:
+            await asyncio.wait_for(poller.wakeup.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+
+    def get_stats(self) -> dict:
+        """Состояние опроса по воркерам"""
+        return {
+            "rounds": self.rounds,
+            "workers": {
+                worker_id: {
+                    "sessions": len(poller.subscriptions),
+                    "next_interval": min((s.interval for s in poller.subscriptions.values()), default=None),
+                    "failures": poller.failures,
+                    "load_avg": poller.last_snapshot["load_avg"] if poller.last_snapshot else None
+                }
+                for worker_id, poller in self.pollers.items()
+            }
+        }
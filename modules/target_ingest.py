@@ -0,0 +1,410 @@
+import gzip
+import hashlib
+import ipaddress
+import math
+import os
+import re
+import sys
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit
+
+from fastapi import UploadFile
+
+from config import settings
+
+HOSTNAME_RE = re.compile(r"^(?!-)[a-z0-9_-]{1,63}(?<!-)(\.(?!-)[a-z0-9_-]{1,63}(?<!-))*$")
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def _normalize_host(host: str) -> Optional[str]:
+    """Хост в нижнем регистре (IDN в punycode) или None, если хост некорректен"""
+    host = host.strip().rstrip(".").lower()
+    if not host:
+        return None
+
+    # Разбор IP только для похожих на адрес хостов (исключение ValueError дорогое)
+    if host[0].isdigit() or ":" in host or host[0] == "[":
+        try:
+            return str(ipaddress.ip_address(host.strip("[]")))
+        except ValueError:
+            pass
+
+    if not host.isascii():
+        try:
+            host = host.encode("idna").decode("ascii")
+        except UnicodeError:
+            return None
+
+    if len(host) > 253 or not HOSTNAME_RE.match(host):
+        return None
+    return host
+
+
+def _split_userinfo(netloc: str) -> Tuple[str, str]:
+    """Пара (userinfo@, host[:port]) исходного netloc"""
+    userinfo, at, hostport = netloc.rpartition("@")
+    return (userinfo + at, hostport)
+
+
+def normalize_target(line: str) -> Optional[str]:
+    """Каноническая форма цели (URL, host[:port], IP или CIDR)
+
+    К нижнему регистру приводятся только схема и хост, порт по
+    умолчанию и фрагмент (не передаются на сервер) отбрасываются.
+    Учетные данные, путь и параметры запроса сохраняются как есть.
+    Пустые строки, комментарии и некорректные цели (включая
+    некорректные подсети вида ip/prefix) дают None.
+    """
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+
+    if "://" in line:
+        try:
+            parts = urlsplit(line)
+            port = parts.port
+        except ValueError:
+            return None
+        scheme = parts.scheme.lower()
+        host = _normalize_host(parts.hostname or "")
+        if not scheme or host is None:
+            return None
+
+        userinfo, _ = _split_userinfo(parts.netloc)
+        netloc = f"{userinfo}[{host}]" if ":" in host else userinfo + host
+        if port is not None and DEFAULT_PORTS.get(scheme) != port:
+            netloc = f"{netloc}:{port}"
+        return urlunsplit((scheme, netloc, parts.path, parts.query, ""))
+
+    # Подсеть (nuclei разворачивает CIDR сам): IP с префиксом принимается только целиком
+    head, slash, prefix = line.partition("/")
+    if slash and prefix[:1].isdigit():
+        try:
+            ipaddress.ip_address(head)
+        except ValueError:
+            pass
+        else:
+            try:
+                return str(ipaddress.ip_network(line, strict=False))
+            except ValueError:
+                return None
+
+    # Голый IPv6 без порта
+    if line.count(":") > 1:
+        try:
+            return str(ipaddress.ip_address(line))
+        except ValueError:
+            pass
+
+    try:
+        parts = urlsplit(f"//{line}")
+        port = parts.port
+    except ValueError:
+        return None
+    host = _normalize_host(parts.hostname or "")
+    if host is None:
+        return None
+
+    userinfo, _ = _split_userinfo(parts.netloc)
+    target = f"{userinfo}[{host}]" if ":" in host else userinfo + host
+    if port is not None:
+        target = f"{target}:{port}"
+    target += parts.path
+    if parts.query:
+        target = f"{target}?{parts.query}"
+    return target
+
+
+class BloomFilter:
+    """Битовый фильтр Блума фиксированной емкости
+
+    Позиции битов - двойное хэширование: h1 + i * h2 для i < hashes.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.size = max(64, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def contains(self, h1: int, h2: int) -> bool:
+        bits = self.bits
+        size = self.size
+        pos = h1 % size
+        step = h2 % size
+        for _ in range(self.hashes):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False  # Для новой цели обычно уже на первых позициях
+            pos += step
+            if pos >= size:
+                pos -= size
+        return True
+
+    def add(self, h1: int, h2: int) -> bool:
+        """Добавление элемента; True, если его еще не было"""
+        bits = self.bits
+        size = self.size
+        pos = h1 % size
+        step = h2 % size
+        added = False
+        for _ in range(self.hashes):
+            byte = pos >> 3
+            mask = 1 << (pos & 7)
+            if not bits[byte] & mask:
+                bits[byte] |= mask
+                added = True
+            pos += step
+            if pos >= size:
+                pos -= size
+        if added:
+            self.count += 1
+        return added
+
+
+class ScalableBloomFilter:
+    """Масштабируемый фильтр Блума для дедупликации целей
+
+    Первые exact_limit целей отсеиваются точно по множеству 128-битных
+    хэшей (дешевле проверки k позиций фильтра), затем хэши переносятся
+    в фильтр. Память фильтра растет с числом уникальных целей (около
+    30 бит на цель при вероятности ложного совпадения 1e-6) вместо
+    десятков байт на строку в множестве Python. При заполнении
+    добавляется слой вдвое большей емкости с вдвое меньшей вероятностью
+    ошибки, поэтому общая вероятность ложного совпадения не превышает
+    2 * error_rate.
+    """
+
+    def __init__(self, capacity: int, error_rate: float, exact_limit: int = 0):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.exact_limit = exact_limit
+        self.exact = set() if exact_limit > 0 else None
+        self.filters = [] if self.exact is not None else [BloomFilter(capacity, error_rate / 2)]
+
+    @staticmethod
+    def _hash(item: bytes) -> int:
+        return int.from_bytes(hashlib.blake2b(item, digest_size=16).digest(), "little")
+
+    def add(self, item: bytes) -> bool:
+        """Добавление цели; False, если цель (вероятно) уже встречалась"""
+        digest = self._hash(item)
+
+        exact = self.exact
+        if exact is not None:
+            if digest in exact:
+                return False
+            exact.add(digest)
+            if len(exact) > self.exact_limit:
+                self._to_bloom()
+            return True
+
+        return self._add_bloom(digest & 0xFFFFFFFFFFFFFFFF, (digest >> 64) | 1)
+
+    def _add_bloom(self, h1: int, h2: int) -> bool:
+        for bloom in self.filters[:-1]:
+            if bloom.contains(h1, h2):
+                return False
+
+        current = self.filters[-1]
+        if not current.add(h1, h2):
+            return False
+
+        if current.count >= current.capacity:
+            self.filters.append(BloomFilter(
+                current.capacity * 2, self.error_rate / 2 ** (len(self.filters) + 1)
+            ))
+        return True
+
+    def _to_bloom(self):
+        """Переход от точного множества к фильтру Блума"""
+        exact, self.exact = self.exact, None
+        self.filters = [BloomFilter(max(self.capacity, len(exact) * 2), self.error_rate / 2)]
+        for digest in exact:
+            self._add_bloom(digest & 0xFFFFFFFFFFFFFFFF, (digest >> 64) | 1)
+
+    @property
+    def memory_bytes(self) -> int:
+        if self.exact is not None:
+            return sys.getsizeof(self.exact) + len(self.exact) * 44  # Слоты множества и объекты int
+        return sum(len(f.bits) for f in self.filters)
+
+
+def open_targets(path: str, mode: str = "rt"):
+    """Файл целей (сжатый .gz или обычный текстовый)"""
+    if path.endswith(".gz"):
+        return gzip.open(path, mode, encoding="utf-8") if "t" in mode else gzip.open(path, mode)
+    return open(path, mode, encoding="utf-8") if "t" in mode else open(path, mode)
+
+
+def iter_targets(path: str) -> Iterator[str]:
+    """Потоковое чтение целей из файла"""
+    with open_targets(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield line
+
+
+def _gzip_stream(raw) -> gzip.GzipFile:
+    """Детерминированный gzip (одинаковые цели дают одинаковые байты)"""
+    return gzip.GzipFile(filename="", fileobj=raw, mode="wb", compresslevel=6, mtime=0)
+
+
+@contextmanager
+def gzip_writer(path: str):
+    with open(path, "wb") as raw:
+        with _gzip_stream(raw) as gz:
+            yield gz
+
+
+class TargetIngestor:
+    """Потоковый прием файла целей
+
+    Загрузка обрабатывается кусками: строки нормализуются, дубликаты
+    отсекаются фильтром Блума, уникальные цели сразу пишутся в сжатый
+    канонический файл. Весь файл в памяти не хранится.
+    """
+
+    def __init__(self, output_path: str):
+        self.output_path = output_path
+        self.tmp_path = f"{output_path}.tmp"
+        self.dedup = ScalableBloomFilter(
+            settings.targets_dedup_capacity, settings.targets_dedup_error_rate, settings.targets_dedup_exact_limit
+        )
+        self.lines = 0
+        self.targets = 0
+        self.duplicates = 0
+        self.invalid = 0
+        self._tail = b""
+        self._raw = open(self.tmp_path, "wb")
+        self._gz = _gzip_stream(self._raw)
+
+    def feed(self, chunk: bytes):
+        """Обработка куска загрузки (неполная последняя строка переносится)"""
+        data = self._tail + chunk
+        lines = data.split(b"\n")
+        self._tail = lines.pop()
+        self._process(lines)
+
+    def _process(self, lines: List[bytes]):
+        out = []
+        for raw in lines:
+            self.lines += 1
+            line = raw.decode("utf-8", errors="replace").strip()
+            if not line or line.startswith("#"):
+                continue
+
+            target = normalize_target(line)
+            if target is None:
+                self.invalid += 1
+                continue
+
+            encoded = target.encode("utf-8")
+            if not self.dedup.add(encoded):
+                self.duplicates += 1
+                continue
+
+            out.append(encoded)
+            self.targets += 1
+
+        if out:
+            self._gz.write(b"\n".join(out) + b"\n")
+
+    def close(self) -> dict:
+        """Завершение приема и сохранение канонического файла"""
+        if self._tail:
+            self._process([self._tail])
+            self._tail = b""
+        self._close_file()
+        os.replace(self.tmp_path, self.output_path)
+        return self.get_stats()
+
+    def abort(self):
+        self._close_file()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def _close_file(self):
+        self._gz.close()
+        self._raw.close()
+
+    def get_stats(self) -> dict:
+        return {
+            "lines": self.lines,
+            "targets": self.targets,
+            "duplicates": self.duplicates,
+            "invalid": self.invalid,
+            "dedup_memory_bytes": self.dedup.memory_bytes
+        }
+
+
+async def save_upload(upload: UploadFile, path: str) -> int:
+    """Сохранение загруженного файла целей на диск без разбора (возвращает размер)"""
+    size = 0
+    try:
+        with open(path, "wb") as f:
+            while True:
+                chunk = await upload.read(settings.targets_read_chunk_size)
+                if not chunk:
+                    break
+                f.write(chunk)
+                size += len(chunk)
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    return size
+
+
+def ingest_file(source_path: str, output_path: str) -> dict:
+    """Прием сохраненного файла целей в канонический файл output_path (.gz)
+
+    Выполняется в пуле потоков: нормализация и дедупликация длинного
+    списка занимают минуты.
+    """
+    ingestor = TargetIngestor(output_path)
+    try:
+        with open(source_path, "rb") as f:
+            while True:
+                chunk = f.read(settings.targets_read_chunk_size)
+                if not chunk:
+                    break
+                ingestor.feed(chunk)
+        return ingestor.close()
+    except BaseException:
+        ingestor.abort()
+        raise
+
+
+def split_targets(
+    source_path: str,
+    total: int,
+    parts: int,
+    path_for: Callable[[int], str]
+) -> List[Tuple[str, int]]:
+    """Равномерная нарезка канонического файла на parts сжатых файлов частей
+
+    Файлы частей пишутся по одному, цели читаются потоком.
+    Возвращает пары (путь, количество целей).
+    """
+    if parts <= 0:
+        return []
+
+    chunk_size, remainder = divmod(total, parts)
+    sizes = [chunk_size + (1 if i < remainder else 0) for i in range(parts)]
+    shards = []
+
+    with open_targets(source_path, "rb") as src:
+        for index, size in enumerate(sizes):
+            path = path_for(index)
+            with gzip_writer(path) as dst:
+                for _ in range(size):
+                    line = src.readline()
+                    if not line:
+                        break
+                    dst.write(line)
+            shards.append((path, size))
+
+    return shards
@@ -1,74 +1,229 @@
 import asyncio
-from typing import List, Optional
+import time
+from typing import List, Optional, Tuple
 from datetime import datetime
 from fastapi import UploadFile
 from sqlalchemy.orm import Session
 import os
-import json
 
-from database import Task, Worker, Template, Result
+from sqlalchemy import bindparam, update
+
+from database import SessionLocal, Task, TaskShard, TaskStat, Worker, Template, WorkerTemplate, Result, ResultOccurrence, ResultArchive, ResultArchiveTask, ScanCacheEntry
 from modules.worker_manager import WorkerManager
 from modules.result_parser import ResultParser
+from modules.result_writer import ResultWriter
+from modules.ingest_queue import IngestQueue
+from modules.status_poller import StatusPoller
+from modules.agent_ingest import AgentIngest
+from modules.health_monitor import HealthMonitor
+from modules.scheduler import WorkerScheduler
+from modules.dispatcher import TaskDispatcher
+from modules.target_ingest import save_upload, ingest_file, split_targets
+from modules.scan_cache import ScanCache
+from modules.result_archiver import ResultArchiver
 from config import settings
 
 class TaskManager:
-    def __init__(self):
-        self.worker_manager = WorkerManager()
+    def __init__(
+        self,
+        worker_manager: Optional[WorkerManager] = None,
+        health_monitor: Optional[HealthMonitor] = None
+    ):
+        self.worker_manager = worker_manager or WorkerManager()
+        self.health_monitor = health_monitor or HealthMonitor(self.worker_manager)
         self.result_parser = ResultParser()
-        self.running_tasks = {}
+        self.result_writer = ResultWriter()
+        self.ingest_queue = IngestQueue()
+        self.status_poller = StatusPoller(self.worker_manager)
+        self.agent_ingest = AgentIngest(self)
+        self.scheduler = WorkerScheduler(self.health_monitor, self.agent_ingest)
+        self.dispatcher = TaskDispatcher(self)
+        self.scan_cache = ScanCache()
+        self.result_archiver = ResultArchiver(self.ingest_queue)
+        self.stopped_tasks = set()
+        self.superseded_shards = set()
+        self._backup_lock = asyncio.Lock()
+        self._template_locks = {}
+        self._last_sample = {}  # shard_id -> время последней записи в task_stats
+        self._resume_keys = {}  # shard_id -> находки прошлых запусков возобновленной части
+        self._preparing = {}  # task_id -> фоновая подготовка целей задачи
     
     async def create_task(
         self,
         name: str,
         template_id: int,
         targets_file: UploadFile,
-        db: Session
+        db: Session,
+        workers_count: int = 0,
+        shards_per_worker: int = 1,
+        batch_size: Optional[int] = None,
+        use_cache: bool = True,
+        copy_cached_findings: Optional[bool] = None
     ) -> Task:
-        """Создание новой задачи"""
+        """Создание новой задачи
+        
+        Цели делятся на части (workers_count воркеров по shards_per_worker
+        частей на каждый, 0 - все доступные воркеры). Каждая часть
+        сканируется в своей screen сессии, находки собираются в задачу.
+        В пакетном режиме (batch_size > 0) цели режутся на пакеты по
+        batch_size: воркеры забирают следующий пакет по мере освобождения,
+        а отстающие пакеты дублируются на свободных воркерах.
+        Загруженный файл только сохраняется, и задача возвращается в
+        статусе "preparing": нормализация и дедупликация целей, отсев по
+        кэшу и нарезка на части идут в фоне (_prepare_task), после чего
+        задача ставится в очередь или получает статус "failed".
+        Цели, недавно просканированные тем же шаблоном, пропускаются
+        (use_cache), а их находки копируются из прежних задач.
+        Если очередь переполнена, выбрасывается QueueFullError.
+        """
         # Проверка шаблона
         template = db.query(Template).filter(Template.id == template_id).first()
         if not template:
             raise Exception("Template not found")
         
-        # Сохранение файла с целями
-        targets_filename = f"targets_{datetime.now().timestamp()}.txt"
-        targets_path = os.path.join(settings.targets_dir, targets_filename)
+        # Ограничение очереди
+        self.dispatcher.check_capacity(db)
         
-        content = await targets_file.read()
-        with open(targets_path, "wb") as f:
-            f.write(content)
+        # Исходный файл целей до подготовки
+        upload_path = os.path.join(settings.targets_dir, f"upload_{datetime.now().timestamp()}.txt")
+        if await save_upload(targets_file, upload_path) == 0:
+            os.remove(upload_path)
+            raise Exception("Targets file contains no valid targets")
         
-        # Подсчет целей
-        with open(targets_path, "r") as f:
-            targets = [line.strip() for line in f if line.strip()]
-        targets_count = len(targets)
+        if batch_size is None:
+            batch_size = settings.default_batch_size
         
-        # Выбор свободного воркера
-        worker = db.query(Worker).filter(
-            Worker.status == "online"
-        ).first()
-        
-        if not worker:
-            raise Exception("No available workers")
-        
-        # Создание задачи
         task = Task(
             name=name,
             template_id=template_id,
-            worker_id=worker.id,
-            targets_file=targets_path,
-            targets_count=targets_count,
-            status="pending"
+            targets_file=upload_path,
+            targets_count=0,
+            batch_size=max(batch_size, 0),
+            status="preparing"
         )
-        
         db.add(task)
         db.commit()
         db.refresh(task)
         
+        self._preparing[task.id] = asyncio.create_task(self._prepare_task(
+            task.id, workers_count, shards_per_worker, use_cache, copy_cached_findings
+        ))
+        
         return task
     
+    async def _prepare_task(
+        self,
+        task_id: int,
+        workers_count: int,
+        shards_per_worker: int,
+        use_cache: bool,
+        copy_cached_findings: Optional[bool]
+    ):
+        """Подготовка целей задачи в фоне и постановка ее в очередь
+        
+        Записи в БД идут через очередь записи, чтобы фиксация не
+        блокировала цикл событий.
+        """
+        db = SessionLocal()
+        loop = asyncio.get_running_loop()
+        upload_path = targets_path = None
+        shard_files = []
+        
+        try:
+            task = db.query(Task).filter(Task.id == task_id).first()
+            upload_path = task.targets_file
+            
+            # Потоковый прием целей: нормализация, дедупликация и сжатый канонический файл
+            targets_path = os.path.join(settings.targets_dir, f"targets_{datetime.now().timestamp()}.txt.gz")
+            ingest_stats = await loop.run_in_executor(None, ingest_file, upload_path, targets_path)
+            os.remove(upload_path)
+            targets_count = ingest_stats["targets"]
+            if targets_count == 0:
+                raise Exception("Targets file contains no valid targets")
+            
+            # Отсев пар (цель, шаблон), просканированных недавно
+            if copy_cached_findings is None:
+                copy_cached_findings = settings.scan_cache_copy_findings
+            cached = {"cached": 0, "hits": {}}
+            if use_cache and settings.scan_cache_enabled:
+                template_hash = self.scan_cache.template_hash(task.template, db)
+                cached = await loop.run_in_executor(
+                    None, self.scan_cache.filter_targets, targets_path, template_hash, copy_cached_findings
+                )
+                targets_count = cached["targets"]
+            
+            # Количество частей по доступным сейчас воркерам; воркер каждой
+            # части выбирает диспетчер в момент запуска
+            available = len(self.scheduler.collect(db))
+            if workers_count > 0:
+                available = min(available, workers_count)
+            shards_count = max(1, min(max(available, 1) * max(shards_per_worker, 1), targets_count))
+            
+            # Пакетный режим: много мелких частей в общей очереди
+            if task.batch_size > 0:
+                shards_count = max(1, -(-targets_count // task.batch_size))
+            
+            # Все цели уже есть в кэше - сканировать нечего
+            if targets_count == 0:
+                shards_count = 0
+            
+            shard_files = await loop.run_in_executor(
+                None, self.distribute_targets, task_id, targets_path, targets_count, shards_count
+            )
+            
+            # Задачу могли отменить, пока готовились цели
+            db.refresh(task)
+            if task.status != "preparing":
+                raise Exception("Task was cancelled while preparing targets")
+            
+            task.targets_file = targets_path
+            task.targets_count = targets_count
+            task.cached_count = cached["cached"]
+            task.status = "pending"
+            for index, (shard_path, shard_count) in enumerate(shard_files):
+                db.add(TaskShard(
+                    task_id=task.id,
+                    shard_index=index,
+                    job_id=f"{task.id}_{index}",
+                    targets_file=shard_path,
+                    targets_count=shard_count,
+                    status="pending"
+                ))
+            await self.ingest_queue.run(db.commit)
+            upload_path = targets_path = None
+            shard_files = []
+            
+            # Находки пропущенных целей из задач, в которых они сканировались
+            if cached["hits"]:
+                try:
+                    await loop.run_in_executor(None, self.scan_cache.copy_findings, task.id, cached["hits"])
+                except Exception as e:
+                    print(f"Failed to copy cached findings to task {task_id}: {str(e)}")
+            
+            await self.start_task(task.id, db)
+            
+        except Exception as e:
+            db.rollback()
+            for path in [upload_path, targets_path] + [path for path, _ in shard_files]:
+                if path and os.path.exists(path):
+                    os.remove(path)
+            
+            task = db.query(Task).filter(Task.id == task_id).first()
+            if task is not None and task.status in ("preparing", "failed"):
+                if task.status == "preparing":
+                    print(f"Failed to prepare targets of task {task_id}: {str(e)}")
+                    task.status = "failed"
+                    task.error_message = str(e)
+                    task.completed_at = datetime.utcnow()
+                task.targets_file = None
+                await self.ingest_queue.run(db.commit)
+        
+        finally:
+            self._preparing.pop(task_id, None)
+            db.close()
+    
     async def start_task(self, task_id: int, db: Session):
-        """Запуск задачи"""
+        """Постановка задачи в очередь (запуск частей выполняет диспетчер)"""
         task = db.query(Task).filter(Task.id == task_id).first()
         if not task:
             raise Exception("Task not found")
@@ -76,151 +231,750 @@ class TaskManager:
         if task.status != "pending":
             raise Exception("Task already started")
         
-        # Запуск в фоне
-        asyncio.create_task(self._run_task(task_id))
+        if not task.shards:
+            # Все цели взяты из кэша результатов
+            task.status = "completed"
+            task.progress = 100.0
+            task.started_at = task.completed_at = datetime.utcnow()
+            await self.ingest_queue.run(db.commit)
+            return
+        
+        task.status = "queued"
+        await self.ingest_queue.run(db.commit)
+        
+        self.dispatcher.wake()
     
-    async def _run_task(self, task_id: int):
-        """Выполнение задачи"""
-        db = Session(bind=db.engine)
+    async def _run_shard(self, shard_id: int):
+        """Выполнение одной части задачи на ее воркере"""
+        db = SessionLocal()
+        shard = None
         
         try:
-            task = db.query(Task).filter(Task.id == task_id).first()
-            worker = task.worker
+            shard = db.query(TaskShard).filter(TaskShard.id == shard_id).first()
+            task = shard.task
+            worker = shard.worker
             template = task.template
             
-            # Обновление статуса
-            task.status = "running"
-            task.started_at = datetime.utcnow()
-            db.commit()
-            
-            # Чтение целей
-            with open(task.targets_file, "r") as f:
-                targets = [line.strip() for line in f if line.strip()]
-            
-            # Развертывание целей на воркере
-            targets_remote_path = await self.worker_manager.deploy_targets(
-                worker, targets, task_id
-            )
+            if shard.attempt:
+                # Возобновленная часть: находки прошлых запусков не принимаются повторно
+                # (по журналу вхождений: Result.shard_id хранит только первую часть)
+                self._resume_keys[shard.id] = {fingerprint for (fingerprint,) in db.query(
+                    ResultOccurrence.fingerprint
+                ).join(
+                    Result, Result.fingerprint == ResultOccurrence.fingerprint
+                ).filter(ResultOccurrence.shard_id == shard.id).all()}
             
-            # Путь к шаблону на воркере
-            template_remote_path = f"~/nuclei-worker/templates/{os.path.basename(template.file_path)}"
-            
-            # Запуск сканирования
-            screen_name = await self.worker_manager.start_scan(
-                worker, task_id, template_remote_path, targets_remote_path
-            )
-            
-            task.screen_session = screen_name
-            db.commit()
+            if shard.screen_session:
+                # Скан уже запущен (восстановление после перезапуска контроллера)
+                screen_name = shard.screen_session
+            else:
+                # Развертывание файла целей части на воркере
+                targets_remote_path = await self.worker_manager.deploy_targets(
+                    worker, shard.targets_file, shard.job_id
+                )
+                
+                # Путь к шаблону на воркере (развертывание, если его там еще нет)
+                await self.ensure_template(worker, template, db)
+                template_remote_path = f"~/nuclei-worker/templates/{os.path.basename(template.file_path)}"
+                
+                # Файл возобновления прерванного запуска (воркер может быть другим)
+                resume_remote_path = None
+                if shard.checkpoint_file and os.path.exists(shard.checkpoint_file):
+                    resume_remote_path = await self.worker_manager.upload_resume_file(
+                        worker, shard.checkpoint_file, shard.job_id
+                    )
+                
+                # Запуск сканирования
+                screen_name = await self.worker_manager.start_scan(
+                    worker, shard.job_id, template_remote_path, targets_remote_path, resume_remote_path
+                )
+                
+                shard.screen_session = screen_name
+                db.commit()
+                
+                # Задачу остановили, пока часть запускалась
+                if task.id in self.stopped_tasks:
+                    await self.worker_manager.stop_scan(worker, screen_name)
             
             # Мониторинг прогресса
-            self.running_tasks[task_id] = True
-            
-            while self.running_tasks.get(task_id, False):
-                # Проверка статуса
-                status = await self.worker_manager.get_scan_status(worker, screen_name)
+            status = {}
+            while task.id not in self.stopped_tasks and shard.id not in self.superseded_shards:
+                # Агент воркера присылает находки и статус сам
+                if self.agent_ingest.is_active(worker.id):
+                    status = await self.agent_ingest.wait_update(shard.job_id, timeout=settings.agent_timeout)
+                    if status is not None:
+                        await self.ingest_queue.run(self.record_stats, shard, status.get("log_tail"), db)
+                        if "exit_code" in status:
+                            break
+                        if shard.backup_of_id and not status.get("is_running", True):
+                            break  # Находки копии агент не досылает - дочитываются ниже
+                        continue
+                
+                # Резервный путь: статус из общего раунда опроса воркера (интервал задает StatusPoller)
+                status = await self.status_poller.wait_status(
+                    worker, screen_name, shard.job_id, progress=shard.progress
+                )
+                await self.ingest_queue.run(self.record_stats, shard, status.get("log_tail"), db)
+                
+                # Прием новых находок только если файл результатов вырос
+                # (находки резервной копии принимаются только если она завершится первой)
+                if not shard.backup_of_id and status.get("results_size", 0) > (shard.results_offset or 0):
+                    await self.ingest_new_results(shard, worker, db)
                 
                 if not status["is_running"]:
                     break
-                
-                # Обновление прогресса (примерная оценка)
-                # В реальном проекте нужно парсить вывод nuclei для точного прогресса
-                await asyncio.sleep(10)
             
-            # Получение результатов
-            results_json = await self.worker_manager.get_scan_results(worker, task_id)
+            # Остановка: nuclei получил SIGINT - ждем, пока он сохранит состояние и выйдет
+            stopped = task.id in self.stopped_tasks
+            if stopped:
+                await self.worker_manager.wait_scan_exit(worker, screen_name, settings.graceful_stop_timeout)
             
-            # Парсинг и сохранение результатов
-            results = json.loads(results_json) if results_json else []
-            for result_data in results:
-                result = self.result_parser.parse_result(result_data, task_id)
-                if result:
-                    db.add(result)
+            # Скан без кода выхода был прерван на воркере (например, перезагрузкой)
+            exit_code = None
+            if not stopped and shard.id not in self.superseded_shards:
+                exit_code = status.get("exit_code")
+                if exit_code is None:
+                    exit_code = await self.worker_manager.get_exit_code(worker, shard.job_id)
+            interrupted = not stopped and (exit_code is None or exit_code < 0) and shard.id not in self.superseded_shards
             
-            # Обновление статуса задачи
-            task.status = "completed"
-            task.completed_at = datetime.utcnow()
-            task.progress = 100.0
+            # Из исходной части и ее резервной копии остается та, что завершилась первой
+            async with self._backup_lock:
+                superseded = shard.id in self.superseded_shards
+                if not stopped and not interrupted and not superseded:
+                    await self._resolve_backup(shard, db)
+            
+            if superseded:
+                db.refresh(shard)
+            else:
+                # Дочитываем хвост файла, включая последнюю строку без перевода строки
+                await self.ingest_new_results(
+                    shard, worker, db, final=True, remote_size=status.get("results_size")
+                )
+                
+                if stopped or interrupted:
+                    # Контрольная точка: находки уже сохранены, состояние nuclei - в файле возобновления
+                    shard.status = "failed"
+                    shard.error_message = "Task stopped by user" if stopped else "Scan was interrupted on the worker"
+                    await self._save_checkpoint(shard, worker)
+                else:
+                    shard.status = "completed"
+                    shard.progress = 100.0
+                    shard.eta_seconds = 0
+                    if shard.checkpoint_file:
+                        if os.path.exists(shard.checkpoint_file):
+                            os.remove(shard.checkpoint_file)
+                        shard.checkpoint_file = None
+            
+            shard.rps = 0.0
+            shard.completed_at = datetime.utcnow()
             db.commit()
             
-            # Очистка
-            await self.worker_manager.cleanup_worker(worker, task_id)
+            # Цели завершенной части попадают в кэш результатов
+            if shard.status == "completed" and settings.scan_cache_enabled:
+                try:
+                    await asyncio.get_running_loop().run_in_executor(
+                        None, self.scan_cache.record_shard, shard.id
+                    )
+                except Exception as e:
+                    print(f"Failed to record shard {shard.job_id} in scan cache: {str(e)}")
             
+            # Очистка
+            await self.worker_manager.cleanup_worker(worker, shard.job_id)
+        
         except Exception as e:
-            # Обработка ошибок
-            task = db.query(Task).filter(Task.id == task_id).first()
-            if task:
-                task.status = "failed"
-                task.error_message = str(e)
-                task.completed_at = datetime.utcnow()
+            # Обработка ошибок части (остальные части продолжают работу)
+            db.rollback()
+            shard = db.query(TaskShard).filter(TaskShard.id == shard_id).first()
+            if shard and shard.id not in self.superseded_shards:
+                shard.status = "failed"
+                shard.error_message = str(e)
+                shard.completed_at = datetime.utcnow()
                 db.commit()
         
         finally:
-            # Удаление из активных задач
-            self.running_tasks.pop(task_id, None)
+            if shard is not None:
+                self.agent_ingest.forget(shard.job_id)
+                self._last_sample.pop(shard.id, None)
+                self.superseded_shards.discard(shard.id)
+                self._resume_keys.pop(shard.id, None)
+                if shard.worker_id and shard.screen_session:
+                    self.status_poller.unsubscribe(shard.worker_id, shard.screen_session)
+                
+                # Общий прогресс и итог задачи после завершения части
+                task = db.query(Task).filter(Task.id == shard.task_id).first()
+                if task:
+                    self.finish_task_if_done(task, db)
             db.close()
     
+    async def _save_checkpoint(self, shard: TaskShard, worker: Worker):
+        """Сохранение файла возобновления nuclei прерванной части на контроллере"""
+        local_path = os.path.join(settings.checkpoints_dir, f"{shard.job_id}.cfg")
+        try:
+            if await self.worker_manager.get_resume_file(worker, shard.job_id, local_path):
+                shard.checkpoint_file = local_path
+        except Exception as e:
+            print(f"Failed to save checkpoint for shard {shard.job_id}: {str(e)}")
+    
+    async def resume_task(self, task_id: int, db: Session) -> dict:
+        """Возобновление прерванной задачи
+        
+        Завершенные части не повторяются. Незавершенные части возвращаются
+        в очередь с новым номером запуска и могут попасть на другой воркер;
+        nuclei продолжает с файла возобновления, если он был сохранен, иначе
+        часть сканируется заново без повторного приема уже сохраненных находок.
+        """
+        task = db.query(Task).filter(Task.id == task_id).first()
+        if not task:
+            raise Exception("Task not found")
+        
+        if task.status != "failed" or task.id in self.stopped_tasks:
+            raise Exception("Only stopped or failed tasks can be resumed")
+        
+        resumed = []
+        for shard in self._effective_shards(task):
+            if shard.status == "completed":
+                continue
+            
+            shard.attempt = (shard.attempt or 0) + 1
+            shard.job_id = f"{task.id}_{shard.shard_index}_r{shard.attempt}"
+            shard.status = "pending"
+            shard.worker_id = None
+            shard.screen_session = None
+            shard.results_offset = 0
+            shard.started_at = None
+            shard.completed_at = None
+            shard.error_message = None
+            shard.rps = 0.0
+            shard.eta_seconds = None
+            resumed.append(shard)
+        
+        if not resumed:
+            raise Exception("Task has no unfinished shards")
+        
+        task.status = "queued"
+        task.error_message = None
+        task.completed_at = None
+        db.commit()
+        
+        self.dispatcher.wake()
+        
+        return {
+            "shards": len(resumed),
+            "targets": sum(s.targets_count or 0 for s in resumed),
+            "from_checkpoint": len([s for s in resumed if s.checkpoint_file])
+        }
+    
+    async def _resolve_backup(self, shard: TaskShard, db: Session):
+        """Часть завершилась первой - ее пара (исходная часть или резервная копия) снимается"""
+        if shard.backup_of_id:
+            # Резервная копия опередила исходную часть: находки исходной удаляются,
+            # копия принимает свой файл результатов целиком
+            original = db.query(TaskShard).filter(TaskShard.id == shard.backup_of_id).first()
+            if original and original.status in ("running", "failed"):
+                await self._supersede(original, db, drop_results=True)
+        else:
+            backups = db.query(TaskShard).filter(
+                TaskShard.backup_of_id == shard.id,
+                TaskShard.status.in_(("pending", "running"))
+            ).all()
+            for backup in backups:
+                await self._supersede(backup, db, drop_results=False)
+    
+    async def _supersede(self, shard: TaskShard, db: Session, drop_results: bool):
+        """Снятие части, которую опередила пара"""
+        self.superseded_shards.add(shard.id)
+        was_running = shard.status == "running"
+        
+        shard.status = "superseded"
+        shard.completed_at = datetime.utcnow()
+        if drop_results and shard.results_count:
+            # Через очередь записи: откат не пересекается с приемом тех же находок
+            await self.ingest_queue.run(self._drop_shard_results, shard, db)
+        db.commit()
+        
+        if was_running and shard.screen_session and shard.worker:
+            try:
+                await self.worker_manager.stop_scan(shard.worker, shard.screen_session)
+            except Exception as e:
+                print(f"Failed to stop superseded shard {shard.job_id}: {str(e)}")
+    
+    def _drop_shard_results(self, shard: TaskShard, db: Session):
+        """Откат вклада снятой части в находки"""
+        self._release_occurrences(db, ResultOccurrence.shard_id == shard.id, Result.shard_id == shard.id)
+        
+        db.query(Task).filter(Task.id == shard.task_id).update(
+            {Task.results_count: Task.results_count - shard.results_count},
+            synchronize_session=False
+        )
+        shard.results_count = 0
+    
+    def _release_occurrences(self, db: Session, occurrences, owned):
+        """Удаление вкладов (условие occurrences на result_occurrences) в находки
+        
+        Находки общие для всех задач (уникальны по отпечатку), поэтому
+        строки results не удаляются по задаче или части: счетчик, last_seen,
+        last_task_id и первое появление пересчитываются по оставшимся
+        вкладам, а удаляются только находки, на которые больше ничего не
+        ссылается. Находки, принятые впервые удаляемым владельцем (условие
+        owned на results), переходят к первому из оставшихся.
+        """
+        fingerprints = [fingerprint for (fingerprint,) in db.query(
+            ResultOccurrence.fingerprint
+        ).filter(occurrences).distinct().all()]
+        db.query(ResultOccurrence).filter(occurrences).delete(synchronize_session=False)
+        # Строки без отпечатка (до дедупликации) принадлежат только своему владельцу
+        db.query(Result).filter(owned, Result.fingerprint.is_(None)).delete(synchronize_session=False)
+        
+        table = Result.__table__
+        for start in range(0, len(fingerprints), 500):
+            chunk = fingerprints[start:start + 500]
+            remaining = {}
+            for occurrence in db.query(ResultOccurrence).filter(ResultOccurrence.fingerprint.in_(chunk)).all():
+                remaining.setdefault(occurrence.fingerprint, []).append(occurrence)
+            
+            gone = [fingerprint for fingerprint in chunk if fingerprint not in remaining]
+            if gone:
+                db.query(Result).filter(Result.fingerprint.in_(gone)).delete(synchronize_session=False)
+            
+            counters = []
+            for fingerprint, occurrences_left in remaining.items():
+                first = min(occurrences_left, key=lambda o: o.first_seen or datetime.max)
+                last = max(occurrences_left, key=lambda o: o.last_seen or datetime.min)
+                counters.append({
+                    "fp": fingerprint,
+                    "count": sum(o.occurrence_count or 0 for o in occurrences_left),
+                    "seen_first": first.first_seen,
+                    "seen_last": last.last_seen,
+                    "last_task": last.task_id,
+                    "first_task": first.task_id,
+                    "first_shard": first.shard_id
+                })
+            if counters:
+                db.execute(
+                    update(table).where(table.c.fingerprint == bindparam("fp")).values(
+                        occurrence_count=bindparam("count"),
+                        first_seen=bindparam("seen_first"),
+                        last_seen=bindparam("seen_last"),
+                        last_task_id=bindparam("last_task")
+                    ),
+                    counters
+                )
+                db.execute(
+                    update(table).where(table.c.fingerprint == bindparam("fp"), owned).values(
+                        task_id=bindparam("first_task"), shard_id=bindparam("first_shard")
+                    ),
+                    counters
+                )
+    
+    async def delete_task(self, task_id: int, db: Session):
+        """Удаление завершенной задачи
+        
+        Удаляются вклады задачи в находки (общие находки остаются у
+        других задач), ее части, статистика и файлы целей. Архивы
+        остаются в манифесте без привязки к задаче.
+        """
+        task = db.query(Task).filter(Task.id == task_id).first()
+        if not task:
+            raise Exception("Task not found")
+        
+        if task.status in ("preparing", "queued", "running"):
+            raise Exception("Task is running")
+        
+        files = [task.targets_file] + [shard.targets_file for shard in task.shards]
+        shard_ids = [shard.id for shard in task.shards]
+        
+        def delete():
+            self._release_occurrences(db, ResultOccurrence.task_id == task_id, Result.task_id == task_id)
+            if shard_ids:
+                # Части задачи удаляются вместе с ней
+                db.query(Result).filter(Result.shard_id.in_(shard_ids)).update(
+                    {Result.shard_id: None}, synchronize_session=False
+                )
+            db.query(ScanCacheEntry).filter(ScanCacheEntry.task_id == task_id).delete(synchronize_session=False)
+            db.query(ResultArchive).filter(ResultArchive.task_id == task_id).update(
+                {ResultArchive.task_id: None}, synchronize_session=False
+            )
+            db.query(ResultArchiveTask).filter(ResultArchiveTask.task_id == task_id).delete(synchronize_session=False)
+            db.expire(task, ["archives", "results"])
+            db.delete(task)
+            db.commit()
+        
+        await self.ingest_queue.run(delete)
+        
+        for path in files:
+            if path and os.path.exists(path):
+                os.remove(path)
+    
+    def _effective_shards(self, task: Task) -> List[TaskShard]:
+        """Части, определяющие итог задачи: без снятых и без незавершенных резервных копий"""
+        return [
+            s for s in task.shards
+            if s.status != "superseded" and not (s.backup_of_id and s.status != "completed")
+        ]
+    
+    def finish_task_if_done(self, task: Task, db: Session):
+        """Обновление прогресса и итог задачи, когда все ее части завершены
+        
+        Частичные находки сохраняются при любом исходе.
+        """
+        db.refresh(task)
+        self._update_progress(task)
+        
+        if any(s.status in ("pending", "running") for s in task.shards):
+            db.commit()
+            return
+        
+        if task.status == "running":
+            failed = [s for s in self._effective_shards(task) if s.status != "completed"]
+            if failed:
+                task.status = "failed"
+                task.error_message = "; ".join(
+                    f"shard {s.shard_index}: {s.error_message or s.status}" for s in failed
+                )
+            else:
+                task.status = "completed"
+                task.progress = 100.0
+            task.completed_at = datetime.utcnow()
+        
+        self.stopped_tasks.discard(task.id)
+        db.commit()
+    
+    async def ensure_template(self, worker: Worker, template: Template, db: Session):
+        """Развертывание шаблона на воркере, если он там еще не развернут"""
+        key = (worker.id, template.id)
+        lock = self._template_locks.setdefault(key, asyncio.Lock())
+        
+        async with lock:
+            deployed = db.query(WorkerTemplate).filter(
+                WorkerTemplate.worker_id == worker.id,
+                WorkerTemplate.template_id == template.id
+            ).first()
+            if deployed:
+                return
+            
+            await self.worker_manager.deploy_template(worker, template.file_path, template.filename)
+            db.add(WorkerTemplate(worker_id=worker.id, template_id=template.id))
+            db.commit()
+    
+    def record_stats(self, shard: TaskShard, log_tail: Optional[str], db: Session):
+        """Статистика nuclei из хвоста лога части: прогресс, запросы, RPS, ошибки, ETA
+        
+        Последние значения пишутся в часть и задачу, в task_stats - не чаще
+        stats_sample_interval на часть.
+        """
+        stats = self.result_parser.parse_stats_tail(log_tail)
+        if not stats:
+            return
+        
+        shard.progress = round(self.result_parser.calculate_progress(stats, shard.targets_count or 0), 2)
+        shard.requests_done = stats.get("requests", 0)
+        shard.requests_total = stats.get("total", 0)
+        shard.rps = stats.get("rps", 0.0)
+        shard.errors_count = stats.get("errors", 0)
+        shard.eta_seconds = self.result_parser.calculate_eta(stats)
+        
+        now = time.monotonic()
+        if now - self._last_sample.get(shard.id, 0) >= settings.stats_sample_interval:
+            self._last_sample[shard.id] = now
+            db.add(TaskStat(
+                task_id=shard.task_id,
+                shard_id=shard.id,
+                requests_done=shard.requests_done,
+                requests_total=shard.requests_total,
+                rps=shard.rps,
+                matched=stats.get("matched", 0),
+                errors_count=shard.errors_count,
+                progress=shard.progress,
+                eta_seconds=shard.eta_seconds
+            ))
+        
+        task = db.query(Task).filter(Task.id == shard.task_id).first()
+        self._update_progress(task)
+        db.commit()
+    
+    def _update_progress(self, task: Task):
+        """Прогресс задачи - среднее по частям, взвешенное по числу целей;
+        запросы, RPS и ошибки суммируются, ETA - по самой медленной части"""
+        shards = self._effective_shards(task)
+        total = sum(s.targets_count or 0 for s in shards)
+        if total:
+            task.progress = round(
+                sum((s.progress or 0.0) * (s.targets_count or 0) for s in shards) / total, 2
+            )
+        
+        task.requests_done = sum(s.requests_done or 0 for s in shards)
+        task.requests_total = sum(s.requests_total or 0 for s in shards)
+        task.rps = round(sum(s.rps or 0.0 for s in shards if s.status == "running"), 2)
+        task.errors_count = sum(s.errors_count or 0 for s in shards)
+        
+        etas = [s.eta_seconds for s in shards if s.status in ("pending", "running")]
+        task.eta_seconds = None if None in etas else max(etas, default=0)
+    
+    async def ingest_new_results(
+        self,
+        shard: TaskShard,
+        worker: Worker,
+        db: Session,
+        final: bool = False,
+        remote_size: Optional[int] = None
+    ) -> int:
+        """Прием новых JSONL строк из файла результатов части на воркере
+        
+        Файл читается кусками по results_chunk_size начиная с сохраненного
+        TaskShard.results_offset. Принимаются только целые строки; смещение
+        сохраняется в той же транзакции, что и находки, поэтому после
+        перезапуска чтение продолжается без дубликатов. Если после
+        завершения скана непрочитанный объем больше results_bulk_threshold,
+        файл загружается целиком сжатым и разбирается локально.
+        """
+        # Смещение могло быть продвинуто агентом в другой сессии
+        db.refresh(shard)
+        offset = shard.results_offset or 0
+        
+        if final and remote_size and remote_size - offset > settings.results_bulk_threshold:
+            local_path = os.path.join(settings.results_dir, f"task_{shard.job_id}_results.json")
+            await self.worker_manager.get_scan_results(worker, shard.job_id, local_path)
+            
+            async def read_local(offset: int, size: int) -> bytes:
+                with open(local_path, "rb") as f:
+                    f.seek(offset)
+                    return f.read(size)
+            
+            try:
+                await self._ingest_chunks(shard, db, read_local, final)
+            finally:
+                os.remove(local_path)
+        else:
+            async def read_remote(offset: int, size: int) -> bytes:
+                return await self.worker_manager.read_results_chunk(worker, shard.job_id, offset, size)
+            
+            await self._ingest_chunks(shard, db, read_remote, final)
+        
+        return shard.results_count or 0
+    
+    async def _ingest_chunks(self, shard: TaskShard, db: Session, read, final: bool):
+        """Разбор файла результатов кусками через функцию чтения read(offset, size)"""
+        chunk_size = settings.results_chunk_size
+        
+        while True:
+            offset = shard.results_offset or 0
+            chunk = await read(offset, chunk_size)
+            if not chunk:
+                break
+            
+            end = chunk.rfind(b"\n")
+            if end == -1:
+                if len(chunk) == chunk_size and chunk_size < settings.results_max_line_size:
+                    # Строка длиннее куска - читаем больше
+                    chunk_size *= 2
+                    continue
+                if not final and len(chunk) < chunk_size:
+                    # Строка еще дописывается nuclei
+                    break
+                end = len(chunk)  # Последняя строка без перевода строки
+            
+            chunk_end = offset + min(end + 1, len(chunk))
+            lines = chunk[:end].split(b"\n")
+            del chunk
+            
+            # Фиксация пакетами: смещение каждого пакета указывает на конец его последней строки
+            batch_size = max(settings.results_insert_batch_size, 1)
+            for start in range(0, len(lines), batch_size):
+                batch = lines[start:start + batch_size]
+                start_offset = offset
+                offset = min(offset + sum(len(line) + 1 for line in batch), chunk_end)
+                await self.ingest_queue.run(self.store_result_lines, shard, batch, start_offset, offset, db)
+                if (shard.results_offset or 0) != offset:
+                    break  # Диапазон уже принят агентом - чтение с актуального смещения
+            chunk_size = settings.results_chunk_size
+    
+    def store_result_lines(
+        self, shard: TaskShard, lines: list, start_offset: int, end_offset: int, db: Session
+    ) -> int:
+        """Сохранение JSONL строк находок части и нового смещения одной транзакцией
+        
+        Находки вставляются пакетной записью без ORM объектов. Смещение
+        перечитывается из БД в той же транзакции: агент и чтение по SSH
+        могут прислать один и тот же диапазон, и принимается только кусок,
+        начинающийся ровно с сохраненного смещения.
+        """
+        if shard.id in self.superseded_shards:
+            return 0  # Часть снята - ее находки уже удалены
+        
+        current = db.query(TaskShard.results_offset).filter(
+            TaskShard.id == shard.id
+        ).with_for_update().scalar() or 0
+        if current != start_offset:
+            # Диапазон уже принят другим путем; фиксация снимает блокировку
+            # строки и перечитывает смещение части в сессии
+            db.commit()
+            return 0
+        
+        parser = self.result_parser.stream_parser()
+        findings = parser.parse_lines(lines)
+        
+        seen = self._resume_keys.get(shard.id)
+        if seen is not None:
+            fresh = []
+            for finding in findings:
+                if finding.key not in seen:
+                    seen.add(finding.key)
+                    fresh.append(finding)
+            findings = fresh
+        
+        ingested = self.result_writer.write(db, self.result_writer.to_rows(findings, shard.task_id, shard.id))
+        
+        if parser.errors:
+            print(f"Skipped {parser.errors} malformed result lines for task {shard.task_id} shard {shard.shard_index}")
+            shard.parse_errors = (shard.parse_errors or 0) + parser.errors
+        
+        shard.results_offset = end_offset
+        shard.results_count = (shard.results_count or 0) + ingested
+        if ingested:
+            # Части пишут в задачу параллельно - увеличение на стороне БД
+            db.query(Task).filter(Task.id == shard.task_id).update(
+                {Task.results_count: Task.results_count + ingested},
+                synchronize_session=False
+            )
+        db.commit()
+        
+        return ingested
+    
     async def stop_task(self, task_id: int, db: Session):
         """Остановка задачи"""
         task = db.query(Task).filter(Task.id == task_id).first()
         if not task:
             raise Exception("Task not found")
         
-        if task.status != "running":
+        if task.status not in ("preparing", "queued", "running"):
             raise Exception("Task is not running")
         
         # Сигнал остановки
-        self.running_tasks[task_id] = False
+        self.stopped_tasks.add(task_id)
         
-        # Остановка на воркере
-        if task.screen_session:
-            await self.worker_manager.stop_scan(task.worker, task.screen_session)
+        # Ожидающие части снимаются с очереди, запущенные останавливаются на воркерах
+        for shard in task.shards:
+            if shard.status == "pending":
+                shard.status = "failed"
+                shard.error_message = "Task stopped by user"
+                shard.completed_at = datetime.utcnow()
+            elif shard.status == "running" and shard.screen_session:
+                # SIGINT: nuclei сохранит состояние для возобновления, часть дождется выхода
+                try:
+                    await self.worker_manager.interrupt_scan(shard.worker, shard.job_id)
+                except Exception as e:
+                    print(f"Failed to stop shard {shard.shard_index} of task {task_id}: {str(e)}")
         
         # Обновление статуса
         task.status = "failed"
         task.error_message = "Task stopped by user"
         task.completed_at = datetime.utcnow()
         db.commit()
+        
+        if not any(s.status == "running" for s in task.shards):
+            self.stopped_tasks.discard(task_id)
+    
+    async def get_shard_status(self, shard: TaskShard) -> Optional[dict]:
+        """Статус части от агента, из последнего раунда опроса или прямым запросом"""
+        if shard.status != "running" or not shard.screen_session:
+            return None
+        
+        status = self.agent_ingest.status.get(shard.job_id)
+        if status is None:
+            status = self.status_poller.last_status(shard.worker_id, shard.screen_session)
+        if status is None:
+            status = await self.worker_manager.get_scan_status(
+                shard.worker, shard.screen_session
+            )
+        return status
     
     async def get_task_progress(self, task_id: int, db: Session) -> dict:
-        """Получение прогресса задачи"""
+        """Получение прогресса задачи (общий и по частям)"""
         task = db.query(Task).filter(Task.id == task_id).first()
         if not task:
             raise Exception("Task not found")
         
-        # Если задача выполняется, получаем актуальный статус
-        if task.status == "running" and task.screen_session:
-            status = await self.worker_manager.get_scan_status(
-                task.worker, task.screen_session
-            )
-            
-            return {
-                "status": task.status,
-                "progress": task.progress,
-                "is_running": status["is_running"],
-                "log_tail": status["log_tail"]
+        shards = []
+        for shard in task.shards:
+            info = {
+                "shard_index": shard.shard_index,
+                "backup_of": shard.backup_of_id,
+                "worker_id": shard.worker_id,
+                "status": shard.status,
+                "progress": shard.progress,
+                "targets_count": shard.targets_count,
+                "results_count": shard.results_count,
+                "parse_errors": shard.parse_errors,
+                "requests_done": shard.requests_done,
+                "requests_total": shard.requests_total,
+                "rps": shard.rps,
+                "errors_count": shard.errors_count,
+                "eta_seconds": shard.eta_seconds,
+                "error_message": shard.error_message
             }
+            
+            # Если часть выполняется, берем статус от агента или из последнего раунда опроса
+            if task.status == "running":
+                status = await self.get_shard_status(shard)
+                if status is not None:
+                    info["is_running"] = status["is_running"]
+                    info["log_tail"] = status["log_tail"]
+            
+            shards.append(info)
         
         return {
             "status": task.status,
             "progress": task.progress,
-            "error_message": task.error_message
+            "results_count": task.results_count,
+            "requests_done": task.requests_done,
+            "requests_total": task.requests_total,
+            "rps": task.rps,
+            "errors_count": task.errors_count,
+            "eta_seconds": task.eta_seconds,
+            "error_message": task.error_message,
+            "is_running": any(s.get("is_running") for s in shards),
+            "log_tail": "\n".join(
+                f"=== shard {s['shard_index']} ===\n{s['log_tail']}" for s in shards if s.get("log_tail")
+            ),
+            "shards": shards
         }
     
-    def distribute_targets(self, targets: List[str], workers_count: int) -> List[List[str]]:
-        """Распределение целей между воркерами"""
-        if workers_count == 0:
-            return []
+    def get_task_stats(self, task_id: int, db: Session, since: Optional[datetime] = None) -> dict:
+        """Временной ряд статистики nuclei по частям задачи"""
+        task = db.query(Task).filter(Task.id == task_id).first()
+        if not task:
+            raise Exception("Task not found")
         
-        # Равномерное распределение
-        chunk_size = len(targets) // workers_count
-        remainder = len(targets) % workers_count
+        query = db.query(TaskStat).filter(TaskStat.task_id == task_id)
+        if since is not None:
+            query = query.filter(TaskStat.created_at > since)
         
-        chunks = []
-        start = 0
+        return {
+            "task_id": task_id,
+            "samples": [{
+                "shard_id": stat.shard_id,
+                "timestamp": stat.created_at.isoformat(),
+                "requests_done": stat.requests_done,
+                "requests_total": stat.requests_total,
+                "rps": stat.rps,
+                "matched": stat.matched,
+                "errors_count": stat.errors_count,
+                "progress": stat.progress,
+                "eta_seconds": stat.eta_seconds
+            } for stat in query.order_by(TaskStat.created_at).all()]
+        }
+    
+    def distribute_targets(
+        self, task_id: int, targets_path: str, targets_count: int, shards_count: int
+    ) -> List[Tuple[str, int]]:
+        """Распределение целей задачи по частям (и по пакетам в пакетном режиме)
         
-        for i in range(workers_count):
-            end = start + chunk_size + (1 if i < remainder else 0)
-            chunks.append(targets[start:end])
-            start = end
-        
\ No newline at end of file
+        Цели делятся поровну, первые части получают на одну цель больше.
+        Сжатые файлы частей нарезаются потоком из канонического файла
+        (split_targets) и передаются на воркеры без повторного сжатия.
+        Возвращает пары (файл части, количество целей).
+        """
+        return split_targets(
+            targets_path, targets_count, shards_count,
+            lambda index: os.path.join(settings.targets_dir, f"task_{task_id}_shard_{index}.txt.gz")
+        )
@@ -1,16 +1,18 @@
 import os
 import shutil
 from datetime import datetime
+from typing import Optional
 from fastapi import UploadFile
 from sqlalchemy.orm import Session
 
-from database import Template, Worker
+from database import Template, Worker, WorkerTemplate
 from modules.worker_manager import WorkerManager
+from modules.transfer import file_sha256
 from config import settings
 
 class TemplateManager:
-    def __init__(self):
-        self.worker_manager = WorkerManager()
+    def __init__(self, worker_manager: Optional[WorkerManager] = None):
+        self.worker_manager = worker_manager or WorkerManager()
     
     async def upload_template(self, file: UploadFile, db: Session) -> Template:
         """Загрузка и сохранение шаблона"""
@@ -40,7 +42,8 @@ class TemplateManager:
             name=file.filename,
             filename=filename,
             file_path=file_path,
-            file_size=file_size
+            file_size=file_size,
+            content_hash=file_sha256(file_path)
         )
         
         db.add(template)
@@ -49,8 +52,8 @@ class TemplateManager:
         
         return template
     
-    async def deploy_to_worker(self, template: Template, worker: Worker):
-        """Развертывание шаблона на воркере"""
+    async def deploy_to_worker(self, template: Template, worker: Worker, db: Optional[Session] = None):
+        """Развертывание шаблона на воркере (с отметкой в БД, если передана сессия)"""
         # Проверка существования файла на контроллере
         if not os.path.exists(template.file_path):
             raise Exception(f"Template file not found on controller: {template.file_path}")
@@ -63,6 +66,17 @@ class TemplateManager:
             )
         except Exception as e:
             raise Exception(f"Failed to deploy template to {worker.name}: {str(e)}")
+        
+        if db is not None:
+            deployed = db.query(WorkerTemplate).filter(
+                WorkerTemplate.worker_id == worker.id,
+                WorkerTemplate.template_id == template.id
+            ).first()
+            if deployed:
+                deployed.deployed_at = datetime.utcnow()
+            else:
+                db.add(WorkerTemplate(worker_id=worker.id, template_id=template.id))
+            db.commit()
     
     async def deploy_to_all_workers(self, template_id: int, db: Session):
         """Развертывание шаблона на всех активных воркерах"""
@@ -76,7 +90,7 @@ class TemplateManager:
         errors = []
         for worker in workers:
             try:
-                await self.deploy_to_worker(template, worker)
+                await self.deploy_to_worker(template, worker, db)
             except Exception as e:
                 errors.append(f"{worker.name}: {str(e)}")
         
@@ -135,6 +149,6 @@ class TemplateManager:
         
         for template in templates:
             try:
-                await self.deploy_to_worker(template, worker)
+                await self.deploy_to_worker(template, worker, db)
             except Exception as e:
                 print(f"Failed to sync template {template.name} with {worker.name}: {str(e)}")
\ No newline at end of file
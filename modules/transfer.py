@@ -0,0 +1,339 @@
+import asyncio
+import gzip
+import hashlib
+import os
+import shutil
+import time
+import uuid
+from typing import Dict, Optional
+
+import asyncssh
+
+from database import Worker
+from modules.ssh_pool import SSHConnectionPool, ssh_pool, RETRYABLE_ERRORS
+from config import settings
+
+# zstandard опционален, без него используется gzip
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CODEC_EXTENSIONS = {"zstd": ".zst", "gzip": ".gz", "none": ""}
+
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Потоковый SHA-256 файла"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def gzip_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Потоковый SHA-256 распакованного содержимого gzip файла"""
+    digest = hashlib.sha256()
+    with gzip.open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def shell_path(remote_path: str) -> str:
+    """Путь для shell команды (SFTP пути задаются относительно домашней директории)"""
+    return remote_path if remote_path.startswith("/") else f"~/{remote_path}"
+
+
+class TransferError(Exception):
+    pass
+
+
+class TransferManager:
+    """Передача файлов между контроллером и воркерами
+
+    Потоковая передача по SFTP кусками с докачкой после обрыва
+    соединения, сжатием (zstd при наличии, иначе gzip) и проверкой
+    SHA-256 исходного файла на принимающей стороне.
+    """
+
+    def __init__(self, pool: Optional[SSHConnectionPool] = None):
+        self.pool = pool or ssh_pool
+        self.chunk_size = settings.transfer_chunk_size
+        self._remote_codecs: Dict[tuple, str] = {}
+
+        # Счетчики
+        self.stats = {
+            "uploads": 0,
+            "downloads": 0,
+            "bytes_sent": 0,
+            "bytes_received": 0,
+            "resumed": 0,
+            "checksum_failures": 0
+        }
+
+    async def _run(self, worker: Worker, command: str, timeout: Optional[float] = None) -> str:
+        async with self.pool.connection(worker) as conn:
+            result = await asyncio.wait_for(
+                conn.run(command, check=False),
+                timeout or settings.ssh_transfer_timeout
+            )
+            if result.exit_status != 0:
+                raise TransferError(f"Remote command failed: {command}: {result.stderr}")
+            return result.stdout or ""
+
+    async def _codec(self, worker: Worker, compress: bool) -> str:
+        """Выбор кодека, доступного на обеих сторонах"""
+        if not compress or settings.transfer_compression == "none":
+            return "none"
+
+        key = (worker.ip_address, worker.ssh_port)
+        if key not in self._remote_codecs:
+            codec = "gzip"
+            if zstandard is not None and settings.transfer_compression in ("auto", "zstd"):
+                output = await self._run(worker, "command -v zstd >/dev/null && echo zstd || echo none")
+                if output.strip() == "zstd":
+                    codec = "zstd"
+            self._remote_codecs[key] = codec
+
+        return self._remote_codecs[key]
+
+    def _compress(self, source: str, target: str, codec: str):
+        """Детерминированное сжатие (для докачки повторное сжатие дает те же байты)"""
+        tmp_path = f"{target}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(source, "rb") as src, open(tmp_path, "wb") as dst:
+            if codec == "zstd":
+                zstandard.ZstdCompressor(level=3).copy_stream(src, dst)
+            else:
+                with gzip.GzipFile(filename="", fileobj=dst, mode="wb", compresslevel=6, mtime=0) as gz:
+                    shutil.copyfileobj(src, gz, self.chunk_size)
+        os.replace(tmp_path, target)
+
+    def _decompress_hash(self, source: str, target: str, codec: str) -> str:
+        """Распаковка с одновременным подсчетом SHA-256 результата"""
+        digest = hashlib.sha256()
+        tmp_path = target + ".tmp"
+
+        with open(source, "rb") as raw, open(tmp_path, "wb") as dst:
+            if codec == "zstd":
+                src = zstandard.ZstdDecompressor().stream_reader(raw)
+            elif codec == "gzip":
+                src = gzip.GzipFile(fileobj=raw, mode="rb")
+            else:
+                src = raw
+            while True:
+                chunk = src.read(self.chunk_size)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                dst.write(chunk)
+
+        os.replace(tmp_path, target)
+        return digest.hexdigest()
+
+    async def upload_file(
+        self,
+        worker: Worker,
+        local_path: str,
+        remote_path: str,
+        compress: bool = True,
+        precompressed: Optional[bool] = None
+    ) -> dict:
+        """Загрузка файла на воркер
+
+        remote_path задается относительно домашней директории. Частично
+        переданный файл хранится как remote_path.<sha>.part и дописывается
+        при повторной попытке. Уже сжатый gzip файл (части целей)
+        передается как есть и распаковывается на воркере. По умолчанию
+        так передаются файлы .gz при compress=True; с compress=False
+        файл (например, архив .tar.gz) копируется без изменений.
+        """
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+
+        if precompressed is None:
+            precompressed = compress and local_path.endswith(".gz")
+        if precompressed:
+            checksum = await loop.run_in_executor(None, gzip_sha256, local_path)
+            codec = "gzip"
+        else:
+            checksum = await loop.run_in_executor(None, file_sha256, local_path)
+            codec = await self._codec(worker, compress)
+
+        # Сжатая копия на контроллере (имя по хэшу - общая для повторных попыток)
+        if codec == "none" or precompressed:
+            payload_path = local_path
+        else:
+            os.makedirs(settings.transfer_cache_dir, exist_ok=True)
+            payload_path = os.path.join(settings.transfer_cache_dir, checksum + CODEC_EXTENSIONS[codec])
+            if not os.path.exists(payload_path):
+                await loop.run_in_executor(None, self._compress, local_path, payload_path, codec)
+
+        payload_size = os.path.getsize(payload_path)
+        part_path = f"{remote_path}.{checksum[:16]}.part"
+
+        remote_dir = os.path.dirname(remote_path)
+        if remote_dir:
+            await self._run(worker, f"mkdir -p {shell_path(remote_dir)}")
+
+        for attempt in range(settings.transfer_retries):
+            try:
+                await self._upload_chunks(worker, payload_path, part_path, payload_size)
+                break
+            except RETRYABLE_ERRORS:
+                if attempt == settings.transfer_retries - 1:
+                    raise
+                self.stats["resumed"] += 1
+
+        # Распаковка и проверка контрольной суммы на воркере
+        src = shell_path(part_path)
+        dst = shell_path(remote_path)
+        if codec == "zstd":
+            unpack = f"zstd -d -q -c {src} > {dst}.tmp"
+        elif codec == "gzip":
+            unpack = f"gzip -d -c {src} > {dst}.tmp"
+        else:
+            unpack = f"mv {src} {dst}.tmp"
+        output = await self._run(worker, f"{unpack} && sha256sum {dst}.tmp | cut -d' ' -f1")
+
+        if output.strip() != checksum:
+            self.stats["checksum_failures"] += 1
+            await self._run(worker, f"rm -f {dst}.tmp {src}")
+            raise TransferError(f"Checksum mismatch after upload to {worker.name}: {remote_path}")
+
+        await self._run(worker, f"mv {dst}.tmp {dst} && rm -f {src}")
+
+        if payload_path != local_path:
+            try:
+                os.remove(payload_path)
+            except FileNotFoundError:
+                pass  # Уже удален параллельной передачей того же файла
+
+        self.stats["uploads"] += 1
+        return {
+            "remote_path": remote_path,
+            "sha256": checksum,
+            "codec": codec,
+            "bytes": payload_size,
+            "seconds": round(time.monotonic() - started, 3)
+        }
+
+    async def _upload_chunks(self, worker: Worker, payload_path: str, part_path: str, payload_size: int):
+        async with self.pool.connection(worker) as conn:
+            async with conn.start_sftp_client() as sftp:
+                # Докачка с уже переданного размера
+                try:
+                    offset = (await sftp.stat(part_path)).size or 0
+                except asyncssh.SFTPNoSuchFile:
+                    offset = 0
+                if offset > payload_size:
+                    offset = 0
+
+                mode = "ab" if offset else "wb"
+                async with sftp.open(part_path, mode) as remote, open(payload_path, "rb") as local:
+                    local.seek(offset)
+                    while offset < payload_size:
+                        chunk = local.read(self.chunk_size)
+                        if not chunk:
+                            break
+                        await asyncio.wait_for(remote.write(chunk), settings.ssh_command_timeout)
+                        offset += len(chunk)
+                        self.stats["bytes_sent"] += len(chunk)
+
+    async def download_file(self, worker: Worker, remote_path: str, local_path: str, compress: bool = True) -> dict:
+        """Загрузка файла с воркера с проверкой контрольной суммы"""
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        codec = await self._codec(worker, compress)
+
+        # Контрольная сумма и сжатая копия на воркере
+        src = shell_path(remote_path)
+        checksum = (await self._run(worker, f"sha256sum {src} | cut -d' ' -f1")).strip()
+        if not checksum:
+            raise TransferError(f"Remote file not found: {remote_path}")
+
+        payload_remote = f"{remote_path}.{checksum[:16]}{CODEC_EXTENSIONS[codec]}"
+        if codec != "none":
+            packed = shell_path(payload_remote)
+            pack = "zstd -q -c" if codec == "zstd" else "gzip -n -c"
+            await self._run(worker, f"test -f {packed} || ({pack} {src} > {packed}.tmp && mv {packed}.tmp {packed})")
+
+        local_dir = os.path.dirname(local_path)
+        if local_dir:
+            os.makedirs(local_dir, exist_ok=True)
+        part_path = f"{local_path}.{checksum[:16]}.part"
+
+        for attempt in range(settings.transfer_retries):
+            try:
+                await self._download_chunks(worker, payload_remote, part_path)
+                break
+            except RETRYABLE_ERRORS:
+                if attempt == settings.transfer_retries - 1:
+                    raise
+                self.stats["resumed"] += 1
+
+        received = os.path.getsize(part_path)
+        actual = await loop.run_in_executor(None, self._decompress_hash, part_path, local_path, codec)
+        os.remove(part_path)
+
+        if codec != "none":
+            await self._run(worker, f"rm -f {shell_path(payload_remote)}")
+
+        if actual != checksum:
+            self.stats["checksum_failures"] += 1
+            os.remove(local_path)
+            raise TransferError(f"Checksum mismatch after download from {worker.name}: {remote_path}")
+
+        self.stats["downloads"] += 1
+        return {
+            "local_path": local_path,
+            "sha256": checksum,
+            "codec": codec,
+            "bytes": received,
+            "seconds": round(time.monotonic() - started, 3)
+        }
+
+    async def _download_chunks(self, worker: Worker, remote_path: str, part_path: str):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+
+        async with self.pool.connection(worker) as conn:
+            async with conn.start_sftp_client() as sftp:
+                size = (await sftp.stat(remote_path)).size or 0
+                if offset > size:
+                    offset = 0
+
+                async with sftp.open(remote_path, "rb") as remote, open(part_path, "ab" if offset else "wb") as local:
+                    while offset < size:
+                        chunk = await asyncio.wait_for(
+                            remote.read(self.chunk_size, offset),
+                            settings.ssh_command_timeout
+                        )
+                        if not chunk:
+                            break
+                        local.write(chunk)
+                        offset += len(chunk)
+                        self.stats["bytes_received"] += len(chunk)
+
+    async def read_range(self, worker: Worker, remote_path: str, offset: int, size: int) -> bytes:
+        """Чтение диапазона байт удаленного файла (пустой результат, если файла нет)"""
+        try:
+            async with self.pool.connection(worker) as conn:
+                async with conn.start_sftp_client() as sftp:
+                    async with sftp.open(remote_path, "rb") as f:
+                        data = await asyncio.wait_for(f.read(size, offset), settings.ssh_command_timeout)
+        except asyncssh.SFTPNoSuchFile:
+            return b""
+
+        self.stats["bytes_received"] += len(data)
+        return data
+
+    def get_stats(self) -> dict:
+        stats = dict(self.stats)
+        stats["zstd_available"] = zstandard is not None
+        return stats
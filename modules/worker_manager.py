@@ -1,124 +1,205 @@
-import paramiko
 import asyncio
-from typing import Optional, List
-import os
-from datetime import datetime
+import json
+import re
+from typing import Optional, Tuple, Dict
 from database import Worker
 from config import settings
+from modules.ssh_pool import SSHConnectionPool, ssh_pool, RETRYABLE_ERRORS
+from modules.transfer import TransferManager
 
 class WorkerManager:
-    def __init__(self):
-        self.ssh_clients = {}
+    def __init__(self, pool: Optional[SSHConnectionPool] = None):
+        self.pool = pool or ssh_pool
+        self.transfer = TransferManager(self.pool)
     
-    async def setup_worker(self, worker: Worker):
-        """Установка и настройка воркера"""
+    async def _exec(
+        self,
+        worker: Worker,
+        command: str,
+        timeout: Optional[float] = None,
+        stdin: Optional[str] = None,
+        check: bool = False
+    ) -> Tuple[str, str]:
+        """Выполнение команды через пул с таймаутом и одной попыткой переподключения
+
+        check=True - ненулевой код возврата команды считается ошибкой.
+        """
+        timeout = timeout or settings.ssh_command_timeout
+        
+        for attempt in range(2):
+            try:
+                async with self.pool.connection(worker) as conn:
+                    result = await asyncio.wait_for(
+                        conn.run(command, check=False, input=stdin),
+                        timeout
+                    )
+                if check and result.exit_status != 0:
+                    raise Exception(
+                        f"Command failed with exit code {result.exit_status} on {worker.name}: "
+                        f"{(result.stderr or result.stdout or '').strip()}"
+                    )
+                return result.stdout or "", result.stderr or ""
+            except asyncio.TimeoutError:
+                raise Exception(f"Command timed out after {timeout}s on {worker.name}")
+            except RETRYABLE_ERRORS:
+                if attempt:
+                    raise
+    
+    async def setup_worker(self, worker: Worker, artifacts, force: bool = False, progress=None) -> str:
+        """Установка и настройка воркера из кэша артефактов контроллера
+
+        artifacts - подготовленный ArtifactCache. Воркеру не нужен доступ
+        в интернет за nuclei: бинарник и бандл скриптов копируются по SFTP.
+        Возвращает "skipped", если нужная версия уже установлена.
+        """
+        def report(stage: str):
+            if progress:
+                progress(stage)
+        
         try:
-            # SSH подключение
-            ssh = self._connect_ssh(worker)
+            # Проверка установленной версии
+            report("checking")
+            installed, _ = await self._exec(worker, "cat ~/nuclei-worker/VERSION 2>/dev/null || true")
+            if installed.strip() == artifacts.version and not force:
+                if settings.agent_enabled and worker.agent_token:
+                    report("agent")
+                    await self.ensure_agent(worker)
+                report("up to date")
+                return "skipped"
+            
+            # Системные пакеты ставятся только при их отсутствии
+            report("packages")
+            _, error = await self._exec(
+                worker,
+                "command -v screen >/dev/null && command -v unzip >/dev/null && command -v unrar >/dev/null "
+                "|| (sudo apt-get update && sudo apt-get install -y screen unzip unrar)",
+                timeout=settings.worker_timeout,
+                check=True
+            )
+            if error and "already" not in error.lower():
+                print(f"Warning on {worker.name}: {error}")
             
-            # Установка необходимых пакетов
-            commands = [
-                # Обновление системы
-                "sudo apt-get update",
-                
-                # Установка зависимостей
-                "sudo apt-get install -y screen unzip unrar curl git",
-                
-                # Установка Nuclei
-                "curl -sL https://github.com/projectdiscovery/nuclei/releases/latest/download/nuclei_linux_amd64.zip -o nuclei.zip",
-                "unzip -o nuclei.zip",
-                "sudo mv nuclei /usr/local/bin/",
-                "rm nuclei.zip",
-                "nuclei -version",
-                
-                # Создание рабочих директорий
-                "mkdir -p ~/nuclei-worker/templates",
-                "mkdir -p ~/nuclei-worker/targets",
-                "mkdir -p ~/nuclei-worker/results",
-                "mkdir -p ~/nuclei-worker/logs",
-            ]
+            # Создание рабочих директорий
+            await self.ensure_remote_directory(
+                worker, "~/nuclei-worker/templates ~/nuclei-worker/targets "
+                "~/nuclei-worker/results ~/nuclei-worker/logs ~/nuclei-worker/dist"
+            )
             
-            for cmd in commands:
-                stdin, stdout, stderr = ssh.exec_command(cmd)
-                stdout.read()
-                error = stderr.read().decode()
-                if error and "already" not in error.lower():
-                    print(f"Warning on {worker.name}: {error}")
+            # Установка Nuclei (пропускается, если версия совпадает)
+            report("nuclei")
+            version_out, version_err = await self._exec(worker, "nuclei -version 2>&1 || true")
+            if force or f"v{artifacts.nuclei_version}" not in version_out + version_err:
+                await self.transfer.upload_file(
+                    worker, artifacts.nuclei_path, "nuclei-worker/dist/nuclei.zip", compress=False
+                )
+                await self._exec(
+                    worker,
+                    "cd ~/nuclei-worker/dist && unzip -o nuclei.zip nuclei "
+                    "&& sudo install -m 755 nuclei /usr/local/bin/nuclei && rm -f nuclei nuclei.zip",
+                    check=True
+                )
+            
+            # Скрипты воркера
+            report("bundle")
+            await self.transfer.upload_file(
+                worker, artifacts.bundle_path, "nuclei-worker/dist/bundle.tar.gz", compress=False
+            )
+            await self._exec(
+                worker,
+                "tar -xzf ~/nuclei-worker/dist/bundle.tar.gz -C ~/nuclei-worker "
+                "&& chmod +x ~/nuclei-worker/*.sh && rm -f ~/nuclei-worker/dist/bundle.tar.gz",
+                check=True
+            )
             
-            # Создание скрипта запуска
-            run_script = """#!/bin/bash
-TASK_ID=$1
-TEMPLATE_PATH=$2
-TARGETS_PATH=$3
-OUTPUT_PATH=$4
-
-# Запуск nuclei
-nuclei -t "$TEMPLATE_PATH" -l "$TARGETS_PATH" -o "$OUTPUT_PATH" \\
-    -rate-limit 150 -bulk-size 50 -concurrency 50 \\
-    -json -stats -silent
-
-echo "Scan completed for task $TASK_ID"
-"""
+            await self._exec(worker, f"echo '{artifacts.version}' > ~/nuclei-worker/VERSION", check=True)
             
-            stdin, stdout, stderr = ssh.exec_command(
-                f"echo '{run_script}' > ~/nuclei-worker/run_scan.sh && chmod +x ~/nuclei-worker/run_scan.sh"
-            )
-            stdout.read()
+            # Агент воркера (опционально)
+            if settings.agent_enabled and worker.agent_token:
+                report("agent")
+                await self.ensure_agent(worker, restart=True)
+            
+            report("done")
             
-            ssh.close()
-            return True
+            return "installed"
             
         except Exception as e:
             raise Exception(f"Failed to setup worker {worker.name}: {str(e)}")
     
-    def _connect_ssh(self, worker: Worker) -> paramiko.SSHClient:
-        """Создание SSH подключения"""
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    async def ensure_agent(self, worker: Worker, restart: bool = False):
+        """Запись конфигурации и запуск агента воркера (если он не запущен)"""
+        config = json.dumps({
+            "controller_url": settings.agent_controller_url,
+            "token": worker.agent_token,
+            "interval": settings.agent_push_interval,
+            "max_line_size": settings.results_max_line_size
+        })
+        await self._exec(
+            worker,
+            "umask 077 && mkdir -p ~/nuclei-worker/jobs && cat > ~/nuclei-worker/agent.json",
+            stdin=config
+        )
         
-        try:
-            ssh.connect(
-                hostname=worker.ip_address,
-                port=worker.ssh_port,
-                username=worker.username,
-                password=worker.password,
-                timeout=settings.worker_timeout
-            )
-            return ssh
-        except Exception as e:
-            raise Exception(f"SSH connection failed: {str(e)}")
+        start = "cd ~/nuclei-worker && nohup python3 nuclei_agent.py >> logs/agent.log 2>&1 < /dev/null &"
+        if restart:
+            await self._exec(worker, "pkill -f 'python3 nuclei_agent.py'; true")
+        await self._exec(worker, f"pgrep -f 'python3 nuclei_agent.py' >/dev/null || ({start})")
+        
+        # Автозапуск после перезагрузки воркера
+        await self._exec(
+            worker,
+            f"(crontab -l 2>/dev/null | grep -v nuclei_agent.py; echo '@reboot {start}') | crontab -"
+        )
     
     async def check_worker_status(self, worker: Worker) -> bool:
         """Проверка статуса воркера"""
         try:
-            ssh = self._connect_ssh(worker)
-            stdin, stdout, stderr = ssh.exec_command("echo 'ping'")
-            result = stdout.read().decode().strip()
-            ssh.close()
-            return result == "ping"
+            result, _ = await self._exec(worker, "echo 'ping'", timeout=settings.ssh_keepalive_interval)
+            return result.strip() == "ping"
         except:
             return False
     
-    async def ensure_remote_directory(self, ssh: paramiko.SSHClient, path: str):
+    async def heartbeat(self, worker: Worker, timeout: float) -> dict:
+        """Легкая проверка воркера: load average, количество CPU и занятая память"""
+        output, _ = await self._exec(
+            worker,
+            "cat /proc/loadavg; nproc; grep -E '^(MemTotal|MemAvailable):' /proc/meminfo",
+            timeout=timeout
+        )
+        lines = output.split("\n")
+        load = lines[0].split()[:3]
+        
+        meminfo = {}
+        for line in lines[2:]:
+            if ":" in line:
+                key, value = line.split(":", 1)
+                meminfo[key] = int(value.split()[0])
+        
+        mem_usage = None
+        if meminfo.get("MemTotal") and "MemAvailable" in meminfo:
+            mem_usage = round(100.0 * (1 - meminfo["MemAvailable"] / meminfo["MemTotal"]), 1)
+        
+        return {
+            "load_avg": [float(v) for v in load],
+            "cpu_count": int(lines[1].strip()) if len(lines) > 1 and lines[1].strip().isdigit() else None,
+            "mem_usage": mem_usage
+        }
+    
+    async def ensure_remote_directory(self, worker: Worker, path: str):
         """Создает удаленную директорию, если она не существует"""
-        stdin, stdout, stderr = ssh.exec_command(f"mkdir -p {path}")
-        # Дожидаемся завершения команды
-        stdout.channel.recv_exit_status()
+        await self._exec(worker, f"mkdir -p {path}", check=True)
 
 
     async def deploy_template(self, worker: Worker, template_path: str, template_name: str):
         """Развертывание шаблона на воркере"""
         try:
-            ssh = self._connect_ssh(worker)
-            sftp = ssh.open_sftp()
-            
             # Создаем директорию, если не существует
             remote_dir = "~/nuclei-worker/templates"
-            await self.ensure_remote_directory(ssh, remote_dir)
+            await self.ensure_remote_directory(worker, remote_dir)
 
-            # Копирование архива
-            remote_path = f"~/nuclei-worker/templates/{template_name}"
-            sftp.put(template_path, remote_path)
+            # Копирование архива (уже сжат - без повторного сжатия, с проверкой SHA-256)
+            await self.transfer.upload_file(
+                worker, template_path, f"nuclei-worker/templates/{template_name}", compress=False
+            )
             
             # Распаковка архива
             if template_name.endswith('.rar'):
@@ -126,73 +207,77 @@ echo "Scan completed for task $TASK_ID"
             else:
                 cmd = f"cd ~/nuclei-worker/templates && unzip -o {template_name}"
             
-            stdin, stdout, stderr = ssh.exec_command(cmd)
-            stdout.read()
-            
-            sftp.close()
-            ssh.close()
+            await self._exec(worker, cmd)
             
         except Exception as e:
             raise Exception(f"Failed to deploy template: {str(e)}")
     
-    async def deploy_targets(self, worker: Worker, targets: List[str], task_id: int) -> str:
-        """Развертывание списка целей на воркере"""
+    async def deploy_targets(self, worker: Worker, targets_path: str, job_id: str) -> str:
+        """Развертывание файла целей на воркере (сжатие, докачка, проверка SHA-256)"""
         try:
-            ssh = self._connect_ssh(worker)
+            targets_filename = f"targets_task_{job_id}.txt"
+            remote_path = f"nuclei-worker/targets/{targets_filename}"
             
-            # Создание файла с целями
-            targets_content = "\n".join(targets)
-            targets_filename = f"targets_task_{task_id}.txt"
-            remote_path = f"~/nuclei-worker/targets/{targets_filename}"
+            await self.transfer.upload_file(worker, targets_path, remote_path)
             
-            stdin, stdout, stderr = ssh.exec_command(
-                f"echo '{targets_content}' > {remote_path}"
-            )
-            stdout.read()
-            
-            ssh.close()
-            return remote_path
+            return f"~/{remote_path}"
             
         except Exception as e:
             raise Exception(f"Failed to deploy targets: {str(e)}")
     
-    async def start_scan(self, worker: Worker, task_id: int, template_path: str, targets_path: str) -> str:
-        """Запуск сканирования на воркере"""
+    async def start_scan(
+        self,
+        worker: Worker,
+        job_id: str,
+        template_path: str,
+        targets_path: str,
+        resume_path: Optional[str] = None
+    ) -> str:
+        """Запуск сканирования на воркере (resume_path - файл возобновления nuclei)"""
         try:
-            ssh = self._connect_ssh(worker)
-            
             # Формирование команды
-            output_path = f"~/nuclei-worker/results/task_{task_id}_results.json"
-            screen_name = f"nuclei_task_{task_id}"
-            
-            cmd = f"""screen -dmS {screen_name} bash -c '~/nuclei-worker/run_scan.sh {task_id} {template_path} {targets_path} {output_path}'"""
+            output_path = f"~/nuclei-worker/results/task_{job_id}_results.json"
+            screen_name = f"nuclei_task_{job_id}"
+            
+            cmd = f"""screen -dmS {screen_name} bash -c '~/nuclei-worker/run_scan.sh {job_id} {template_path} {targets_path} {output_path} {settings.nuclei_stats_interval} {resume_path or ''}'"""
+            
+            if settings.agent_enabled:
+                # Описание задания для агента воркера
+                job = json.dumps({
+                    "job_id": job_id,
+                    "screen_name": screen_name,
+                    "output_path": output_path,
+                    "log_path": f"~/nuclei-worker/logs/{screen_name}.log"
+                })
+                await self._exec(
+                    worker,
+                    f"mkdir -p ~/nuclei-worker/jobs && cat > ~/nuclei-worker/jobs/{screen_name}.json",
+                    stdin=job
+                )
+            
+            await self._exec(worker, cmd)
             
-            stdin, stdout, stderr = ssh.exec_command(cmd)
-            stdout.read()
-            
-            ssh.close()
             return screen_name
             
         except Exception as e:
             raise Exception(f"Failed to start scan: {str(e)}")
     
+    @staticmethod
+    def _session_running(screens: str, screen_name: str) -> bool:
+        """Есть ли в выводе screen -ls сессия с точно таким именем (строки вида pid.name)"""
+        return bool(re.search(rf"\.{re.escape(screen_name)}\s", screens + "\n"))
+    
     async def get_scan_status(self, worker: Worker, screen_name: str) -> dict:
         """Получение статуса сканирования"""
         try:
-            ssh = self._connect_ssh(worker)
+            # Проверка существования screen сессии (точное имя: nuclei_task_1_1 не совпадает с nuclei_task_1_10)
+            screens, _ = await self._exec(worker, "screen -ls 2>/dev/null || true")
             
-            # Проверка существования screen сессии
-            stdin, stdout, stderr = ssh.exec_command(f"screen -ls | grep {screen_name}")
-            result = stdout.read().decode().strip()
-            
-            is_running = bool(result)
+            is_running = self._session_running(screens, screen_name)
             
             # Получение последних строк лога
             log_cmd = f"tail -n 50 ~/nuclei-worker/logs/{screen_name}.log 2>/dev/null || echo ''"
-            stdin, stdout, stderr = ssh.exec_command(log_cmd)
-            log_tail = stdout.read().decode()
-            
-            ssh.close()
+            log_tail, _ = await self._exec(worker, log_cmd)
             
             return {
                 "is_running": is_running,
@@ -205,53 +290,147 @@ echo "Scan completed for task $TASK_ID"
                 "log_tail": f"Error: {str(e)}"
             }
     
-    async def get_scan_results(self, worker: Worker, task_id: int) -> str:
-        """Получение результатов сканирования"""
+    async def probe_sessions(self, worker: Worker, sessions: Dict[str, str]) -> dict:
+        """Статус всех screen сессий воркера за одно выполнение команды
+
+        sessions - {имя screen сессии: id задания}. Возвращает список
+        запущенных сессий, load average и для каждой сессии хвост лога
+        и размер файла результатов.
+        """
+        parts = ["echo '@@SCREENS'", "screen -ls 2>/dev/null", "echo '@@LOAD'", "cat /proc/loadavg"]
+        for screen_name, job_id in sessions.items():
+            parts.append(f"echo '@@LOG {screen_name}'")
+            parts.append(f"tail -n 50 ~/nuclei-worker/logs/{screen_name}.log 2>/dev/null")
+            parts.append(f"echo '@@SIZE {screen_name}'")
+            parts.append(f"stat -c %s ~/nuclei-worker/results/task_{job_id}_results.json 2>/dev/null || echo 0")
+        
+        output, _ = await self._exec(worker, "; ".join(parts))
+        
+        # Разбор вывода по секциям
+        sections = {}
+        current = None
+        for line in output.splitlines():
+            if line.startswith("@@"):
+                current = line[2:]
+                sections[current] = []
+            elif current is not None:
+                sections[current].append(line)
+        
+        screens = "\n".join(sections.get("SCREENS", []))
+        load = sections.get("LOAD", [""])
+        load_values = load[0].split()[:3] if load else []
+        
+        result = {
+            "load_avg": [float(v) for v in load_values] if len(load_values) == 3 else None,
+            "sessions": {}
+        }
+        
+        for screen_name in sessions:
+            size_lines = sections.get(f"SIZE {screen_name}", ["0"])
+            try:
+                results_size = int(size_lines[0].strip()) if size_lines else 0
+            except ValueError:
+                results_size = 0
+            
+            result["sessions"][screen_name] = {
+                "is_running": self._session_running(screens, screen_name),
+                "log_tail": "\n".join(sections.get(f"LOG {screen_name}", [])),
+                "results_size": results_size
+            }
+        
+        return result
+    
+    async def get_scan_results(self, worker: Worker, job_id: str, local_path: str) -> str:
+        """Загрузка файла результатов сканирования на контроллер"""
         try:
-            ssh = self._connect_ssh(worker)
-            
-            # Чтение файла результатов
-            results_path = f"~/nuclei-worker/results/task_{task_id}_results.json"
-            stdin, stdout, stderr = ssh.exec_command(f"cat {results_path} 2>/dev/null || echo '[]'")
-            results = stdout.read().decode()
+            results_path = f"nuclei-worker/results/task_{job_id}_results.json"
+            await self.transfer.download_file(worker, results_path, local_path)
             
-            ssh.close()
-            return results
+            return local_path
             
         except Exception as e:
             raise Exception(f"Failed to get results: {str(e)}")
     
+    async def read_results_chunk(self, worker: Worker, job_id: str, offset: int, size: int) -> bytes:
+        """Чтение куска файла результатов начиная с offset (байты)"""
+        results_path = f"nuclei-worker/results/task_{job_id}_results.json"
+        
+        try:
+            return await self.transfer.read_range(worker, results_path, offset, size)
+        except asyncio.TimeoutError:
+            raise Exception(f"Reading results timed out on {worker.name}")
+    
     async def stop_scan(self, worker: Worker, screen_name: str):
         """Остановка сканирования"""
         try:
-            ssh = self._connect_ssh(worker)
-            
             # Завершение screen сессии
-            stdin, stdout, stderr = ssh.exec_command(f"screen -X -S {screen_name} quit")
-            stdout.read()
-            
-            ssh.close()
+            await self._exec(worker, f"screen -X -S {screen_name} quit")
             
         except Exception as e:
             raise Exception(f"Failed to stop scan: {str(e)}")
     
-    async def cleanup_worker(self, worker: Worker, task_id: int):
+    async def interrupt_scan(self, worker: Worker, job_id: str):
+        """Прерывание nuclei через SIGINT (только процесс nuclei, не screen и не
+        скрипт): nuclei сохраняет файл возобновления, run_scan.sh переносит
+        его в ~/nuclei-worker/resume/{job_id}.cfg"""
+        await self._exec(
+            worker,
+            f"pkill -INT -f -- '^[^ ]*nuclei .*targets_task_{job_id}\\.txt' || true"
+        )
+    
+    async def wait_scan_exit(self, worker: Worker, screen_name: str, timeout: float) -> bool:
+        """Ожидание завершения screen сессии; по таймауту сессия закрывается принудительно"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        
+        while loop.time() < deadline:
+            status = await self.get_scan_status(worker, screen_name)
+            if not status["is_running"]:
+                return True
+            await asyncio.sleep(2)
+        
+        await self.stop_scan(worker, screen_name)
+        return False
+    
+    async def get_exit_code(self, worker: Worker, job_id: str) -> Optional[int]:
+        """Код выхода nuclei (None - скан прерван без записи кода, например перезагрузкой)"""
+        output, _ = await self._exec(
+            worker,
+            f"cat ~/nuclei-worker/results/task_{job_id}_results.json.exit 2>/dev/null || true"
+        )
+        output = output.strip()
+        return int(output) if output.lstrip("-").isdigit() else None
+    
+    async def get_resume_file(self, worker: Worker, job_id: str, local_path: str) -> Optional[str]:
+        """Загрузка файла возобновления nuclei части (None - файла нет)"""
+        remote_path = f"nuclei-worker/resume/{job_id}.cfg"
+        output, _ = await self._exec(worker, f"test -f ~/{remote_path} && echo yes || true")
+        if output.strip() != "yes":
+            return None
+        
+        await self.transfer.download_file(worker, remote_path, local_path)
+        return local_path
+    
+    async def upload_resume_file(self, worker: Worker, local_path: str, job_id: str) -> str:
+        """Загрузка файла возобновления на воркер (возможно, другой)"""
+        remote_path = f"nuclei-worker/resume/{job_id}.cfg"
+        await self.transfer.upload_file(worker, local_path, remote_path)
+        return f"~/{remote_path}"
+    
+    async def cleanup_worker(self, worker: Worker, job_id: str):
         """Очистка файлов задачи на воркере"""
         try:
-            ssh = self._connect_ssh(worker)
-            
             # Удаление файлов задачи
             commands = [
-                f"rm -f ~/nuclei-worker/targets/targets_task_{task_id}.txt",
-                f"rm -f ~/nuclei-worker/results/task_{task_id}_results.json",
-                f"rm -f ~/nuclei-worker/logs/nuclei_task_{task_id}.log"
+                f"rm -f ~/nuclei-worker/targets/targets_task_{job_id}.txt",
+                f"rm -f ~/nuclei-worker/results/task_{job_id}_results.json",
+                f"rm -f ~/nuclei-worker/results/task_{job_id}_results.json.exit",
+                f"rm -f ~/nuclei-worker/logs/nuclei_task_{job_id}.log",
+                f"rm -f ~/nuclei-worker/jobs/nuclei_task_{job_id}.json",
+                f"rm -f ~/nuclei-worker/resume/{job_id}.cfg"
             ]
             
-            for cmd in commands:
-                stdin, stdout, stderr = ssh.exec_command(cmd)
-                stdout.read()
-            
-            ssh.close()
+            await self._exec(worker, " ; ".join(commands))
             
         except:
             pass  # Игнорируем ошибки очистки
\ No newline at end of file
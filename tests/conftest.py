@@ -0,0 +1,39 @@
+import os
+import sys
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+# Модули контроллера импортируются из корня репозитория; БД по умолчанию - в памяти
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from database import Base  # noqa: E402
+
+
+@pytest.fixture
+def session_factory():
+    """Фабрика сессий SQLite в памяти со схемой из моделей"""
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    yield sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    engine.dispose()
+
+
+@pytest.fixture
+def db(session_factory):
+    session = session_factory()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def blob_root(tmp_path, monkeypatch):
+    """Хранилище blobs во временном каталоге"""
+    from modules.blob_store import blob_store
+    root = str(tmp_path / "blobs")
+    monkeypatch.setattr(blob_store, "root", root)
+    return root
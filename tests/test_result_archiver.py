@@ -0,0 +1,53 @@
+import json
+
+from config import settings
+from database import Result, ResultArchive, ResultOccurrence, Task
+from modules.result_archiver import MANIFEST_FILE, ResultArchiver
+from modules.result_query import ResultFilter
+
+
+def test_archive_batch_moves_findings_to_file(db, session_factory, tmp_path, monkeypatch):
+    monkeypatch.setattr("modules.result_archiver.SessionLocal", session_factory)
+    monkeypatch.setattr(settings, "archive_dir", str(tmp_path))
+    monkeypatch.setattr(settings, "retention_batch_size", 10)
+
+    first = Task(name="first", status="completed")
+    owner = Task(name="owner", status="completed")
+    db.add_all([first, owner])
+    db.flush()
+    for index, severity in enumerate(["high", "info"]):
+        fingerprint = f"fp{index}"
+        db.add(Result(
+            task_id=first.id, last_task_id=owner.id, severity=severity, target=f"https://h{index}",
+            fingerprint=fingerprint, raw_output=f"raw {index}", occurrence_count=2
+        ))
+        db.add_all([
+            ResultOccurrence(fingerprint=fingerprint, task_id=first.id, shard_id=index * 2 + 1, occurrence_count=1),
+            ResultOccurrence(fingerprint=fingerprint, task_id=owner.id, shard_id=index * 2 + 2, occurrence_count=1)
+        ])
+    db.commit()
+
+    archiver = ResultArchiver(ingest_queue=None)
+    assert archiver._archive_batch(owner.id, None, "task") == 2
+
+    db.expire_all()
+    assert db.query(Result).count() == 0
+    assert db.query(ResultOccurrence).count() == 0
+    assert db.get(Task, owner.id).archived_count == 2
+
+    archive = db.query(ResultArchive).one()
+    assert archive.rows_count == 2
+    assert json.loads(archive.severity_counts) == {"high": 1, "info": 1}
+    assert sorted(link.task_id for link in archive.covered_tasks) == [first.id, owner.id]
+
+    rows = list(archiver.read_archive(archive.file_path))
+    assert sorted(row["raw_output"] for row in rows) == ["raw 0", "raw 1"]
+    assert all(row["task_ids"] == [first.id, owner.id] for row in rows)
+
+    manifest = [json.loads(line) for line in (tmp_path / MANIFEST_FILE).read_text().splitlines()]
+    assert manifest[0]["id"] == archive.id and manifest[0]["task_ids"] == [first.id, owner.id]
+
+    # Архив выбирается и для задачи, где находки появились впервые
+    items = archiver.page(ResultFilter(task_id=first.id, severity="high"))["items"]
+    assert [item["target"] for item in items] == ["https://h0"]
+    assert archiver.page(ResultFilter(task_id=owner.id + 100))["items"] == []
@@ -0,0 +1,108 @@
+import json
+
+from modules.result_parser import JsonlStreamParser, ResultParser, finding_fingerprint
+
+
+def finding_line(host="https://a.example", matched_at=None, **extra) -> bytes:
+    data = {
+        "template-id": "tech-detect",
+        "host": host,
+        "matched-at": matched_at or f"{host}/",
+        "type": "http",
+        "info": {"severity": "medium", "name": "Tech"},
+        **extra
+    }
+    return json.dumps(data).encode("utf-8")
+
+
+def test_fingerprint_ignores_order_and_repeats_of_extracted_values():
+    first = finding_fingerprint("t", "https://a/", "m", ["b", "a", "a"])
+    second = finding_fingerprint("t", " https://a/ ", "m", ["a", "b"])
+    assert first == second
+    assert first != finding_fingerprint("t", "https://a/", "m", ["a"])
+    assert first != finding_fingerprint("t", "https://a/", "other", ["a", "b"])
+
+
+def test_parse_line_fields():
+    parser = JsonlStreamParser()
+    finding = parser.parse_line(finding_line(**{"matcher-name": "nginx", "extracted-results": "1.2"}))
+    assert finding.template_name == "tech-detect"
+    assert finding.protocol == "https"
+    assert finding.severity == "medium"
+    assert finding.target == "https://a.example"
+    assert finding.extracted_results == json.dumps(["1.2"])
+    assert finding.fingerprint == finding_fingerprint("tech-detect", "https://a.example/", "nginx", ["1.2"])
+
+
+def test_unknown_severity_maps_to_info():
+    finding = JsonlStreamParser().parse_line(json.dumps({
+        "template-id": "x", "host": "a", "info": {"severity": "unknown"}
+    }))
+    assert finding.severity == "info"
+    assert finding.protocol == "unknown"
+
+
+def test_malformed_lines_are_counted_and_skipped():
+    parser = JsonlStreamParser()
+    findings = list(parser.parse_lines([finding_line(), b"{broken", b"", b"[1, 2]", finding_line("https://b")]))
+    assert [f.target for f in findings] == ["https://a.example", "https://b"]
+    assert parser.errors == 2
+    assert parser.lines == 4
+
+
+def test_feed_joins_lines_split_across_chunks():
+    data = finding_line("https://a") + b"\n" + finding_line("https://b") + b"\n" + finding_line("https://c")
+    parser = JsonlStreamParser()
+    findings = []
+    for start in range(0, len(data), 7):
+        findings.extend(parser.feed(data[start:start + 7]))
+    # Последняя строка без перевода строки отдается только при закрытии
+    assert [f.target for f in findings] == ["https://a", "https://b"]
+    assert [f.target for f in parser.close()] == ["https://c"]
+    assert parser.errors == 0
+
+
+def test_oversized_line_is_dropped_without_losing_the_next_one():
+    parser = JsonlStreamParser(max_line_size=64)
+    long_line = finding_line("https://a", **{"extracted-results": ["x" * 200]})
+    findings = list(parser.feed(long_line[:100]))
+    findings += list(parser.feed(long_line[100:] + b"\n" + finding_line("https://b") + b"\n"))
+    assert [f.target for f in findings] == ["https://b"]
+    assert parser.errors == 1
+
+
+def test_parse_file(tmp_path):
+    path = tmp_path / "results.json"
+    path.write_bytes(b"\n".join(finding_line(f"https://h{i}") for i in range(50)) + b"\n")
+    parser = JsonlStreamParser()
+    assert len(list(parser.parse_file(str(path), chunk_size=100))) == 50
+    assert parser.get_stats()["findings"] == 50
+
+
+def test_parse_nuclei_stats_json():
+    stats = ResultParser().parse_nuclei_stats(json.dumps({
+        "duration": "0:01:05", "errors": "3", "hosts": "10", "matched": "2", "percent": "40",
+        "requests": "400", "rps": "6.5", "templates": "1", "total": "1000"
+    }))
+    assert stats["requests"] == 400
+    assert stats["total"] == 1000
+    assert stats["errors"] == 3
+    assert stats["rps"] == 6.5
+    assert stats["duration"] == 65
+
+
+def test_parse_nuclei_stats_text_and_invalid_input():
+    parser = ResultParser()
+    stats = parser.parse_nuclei_stats("[INF] Templates: 150 | Hosts: 100 | RPS: 145 | Matched: 25 | Requests: 40/80 | Errors: 1")
+    assert stats == {"templates": 150, "hosts": 100, "rps": 145, "matched": 25, "requests": 40, "total": 80, "errors": 1}
+    assert parser.parse_nuclei_stats('{"hosts": "1"}') == {}
+    assert parser.parse_nuclei_stats("{not json") == {}
+
+
+def test_parse_stats_tail_takes_last_stats_line():
+    tail = "\n".join([
+        json.dumps({"requests": "10", "total": "100"}),
+        "[INF] some log line",
+        json.dumps({"requests": "20", "total": "100"})
+    ])
+    assert ResultParser().parse_stats_tail(tail)["requests"] == 20
@@ -0,0 +1,114 @@
+import json
+
+import pytest
+
+from config import settings
+from database import Result, ResultOccurrence, Task, TaskShard
+from modules.result_parser import JsonlStreamParser
+from modules.result_query import ResultFilter
+from modules.result_writer import ResultWriter
+
+
+def findings(*hosts, response="HTTP/1.1 200 OK"):
+    parser = JsonlStreamParser()
+    return list(parser.parse_lines(json.dumps({
+        "template-id": "exposed-panel",
+        "host": host,
+        "matched-at": f"{host}/login",
+        "info": {"severity": "high"},
+        "response": response
+    }) for host in hosts))
+
+
+@pytest.fixture
+def tasks(db):
+    """Три задачи по одной части"""
+    created = []
+    for index in range(3):
+        task = Task(name=f"task {index}", status="completed")
+        db.add(task)
+        db.flush()
+        shard = TaskShard(task_id=task.id, shard_index=0, job_id=f"{task.id}_0", targets_file="targets.txt.gz")
+        db.add(shard)
+        db.flush()
+        created.append((task, shard))
+    db.commit()
+    return created
+
+
+@pytest.fixture
+def writer(monkeypatch):
+    monkeypatch.setattr(settings, "results_blob_store", False)
+    return ResultWriter()
+
+
+def write(db, writer, items, task, shard):
+    count = writer.write(db, writer.to_rows(items, task.id, shard.id))
+    db.commit()
+    return count
+
+
+def test_repeat_finding_updates_existing_row(db, writer, tasks):
+    (first, first_shard), (second, second_shard), _ = tasks
+    write(db, writer, findings("https://a"), first, first_shard)
+    write(db, writer, findings("https://a", "https://b"), second, second_shard)
+
+    rows = {row.target: row for row in db.query(Result).all()}
+    assert set(rows) == {"https://a", "https://b"}
+    assert rows["https://a"].occurrence_count == 2
+    assert rows["https://a"].task_id == first.id
+    assert rows["https://a"].last_task_id == second.id
+    assert rows["https://a"].first_seen <= rows["https://a"].last_seen
+
+
+def test_duplicates_in_one_batch_fold_into_one_row(db, writer, tasks):
+    task, shard = tasks[0]
+    rows = writer.to_rows(findings("https://a", "https://a", "https://a"), task.id, shard.id)
+    assert len(rows) == 1 and rows[0]["occurrence_count"] == 3
+    write(db, writer, findings("https://a", "https://a", "https://a"), task, shard)
+    assert db.query(Result).one().occurrence_count == 3
+
+
+def test_occurrences_are_recorded_per_shard(db, writer, tasks):
+    (first, first_shard), (second, second_shard), _ = tasks
+    write(db, writer, findings("https://a"), first, first_shard)
+    write(db, writer, findings("https://a"), first, first_shard)
+    write(db, writer, findings("https://a"), second, second_shard)
+
+    occurrences = {o.shard_id: o for o in db.query(ResultOccurrence).all()}
+    assert {shard_id: o.occurrence_count for shard_id, o in occurrences.items()} == {
+        first_shard.id: 2, second_shard.id: 1
+    }
+    assert occurrences[second_shard.id].task_id == second.id
+    total = sum(o.occurrence_count for o in occurrences.values())
+    assert total == db.query(Result).one().occurrence_count
+
+
+def test_task_filter_follows_occurrences(db, writer, tasks):
+    # Находка "a" встречалась во всех трех задачах, последней - в третьей
+    for (task, shard), hosts in zip(tasks, [("https://a", "https://b"), ("https://a",), ("https://a", "https://c")]):
+        write(db, writer, findings(*hosts), task, shard)
+
+    def targets(task):
+        return sorted(row.target for row in ResultFilter(task_id=task.id).apply(db.query(Result)).all())
+
+    assert targets(tasks[0][0]) == ["https://a", "https://b"]
+    assert targets(tasks[1][0]) == ["https://a"]
+    assert targets(tasks[2][0]) == ["https://a", "https://c"]
+
+
+def test_raw_output_is_stored_once_for_new_findings(db, tasks, blob_root, monkeypatch):
+    from modules.blob_store import blob_store
+    monkeypatch.setattr(settings, "results_blob_store", True)
+    writer = ResultWriter()
+    (first, first_shard), (second, second_shard), _ = tasks
+
+    write(db, writer, findings("https://a", response="first"), first, first_shard)
+    stored = blob_store.stats["written"]
+    # Повтор находки с другим ответом не оставляет блоба без ссылки
+    write(db, writer, findings("https://a", response="second"), second, second_shard)
+    assert blob_store.stats["written"] == stored
+
+    row = db.query(Result).one()
+    assert row.raw_output is None and row.curl_command is None
+    assert "first" in blob_store.get(row.raw_ref).decode("utf-8")
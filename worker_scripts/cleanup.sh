@@ -0,0 +1,6 @@
+#!/bin/bash
+
+# Cleanup old logs and results (older than 7 days)
+find $HOME/nuclei-worker/logs -name "*.log" -mtime +7 -delete
+find $HOME/nuclei-worker/results -name "*.json" -mtime +7 -delete
+find $HOME/nuclei-worker/targets -name "*.txt" -mtime +7 -delete
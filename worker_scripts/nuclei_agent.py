@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""Nuclei worker agent
+
+Supervises nuclei scans started in screen sessions on this worker and
+pushes findings, stats log lines, exit codes and resource usage to the
+controller over one persistent HTTP connection.
+
+Findings are never copied into a separate buffer: the agent only advances
+its read offset in the result file once the controller has acknowledged
+it, so the result file itself is the buffer. Other events are spooled to
+agent_buffer.jsonl while the controller is unreachable.
+
+Stdlib only, configured by ~/nuclei-worker/agent.json.
+"""
+import http.client
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.parse
+
+AGENT_VERSION = "3"
+
+BASE_DIR = os.path.expanduser("~/nuclei-worker")
+CONFIG_PATH = os.path.join(BASE_DIR, "agent.json")
+JOBS_DIR = os.path.join(BASE_DIR, "jobs")
+BUFFER_PATH = os.path.join(BASE_DIR, "agent_buffer.jsonl")
+
+MAX_BATCH_BYTES = 1024 * 1024  # Находок за одну отправку на задачу
+MAX_LINE_BYTES = 64 * 1024 * 1024  # Предел одной строки находки (results_max_line_size контроллера)
+MAX_BUFFER_BYTES = 50 * 1024 * 1024  # Предел локального буфера событий
+LOG_TAIL_LINES = 50
+
+
+def log(message):
+    sys.stdout.write(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {message}\n")
+    sys.stdout.flush()
+
+
+class Controller:
+    """Постоянное HTTP(S) подключение к контроллеру"""
+
+    def __init__(self, url, token, timeout):
+        parsed = urllib.parse.urlparse(url)
+        self.https = parsed.scheme == "https"
+        self.host = parsed.hostname
+        self.port = parsed.port or (443 if self.https else 80)
+        self.path = (parsed.path.rstrip("/") or "") + "/api/agent/ingest"
+        self.token = token
+        self.timeout = timeout
+        self.conn = None
+
+    def _connect(self):
+        if self.https:
+            self.conn = http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout)
+        else:
+            self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def post(self, payload):
+        body = json.dumps(payload).encode()
+        headers = {
+            "Content-Type": "application/json",
+            "X-Agent-Token": self.token,
+            "Connection": "keep-alive"
+        }
+
+        for attempt in range(2):
+            if self.conn is None:
+                self._connect()
+            try:
+                self.conn.request("POST", self.path, body=body, headers=headers)
+                response = self.conn.getresponse()
+                data = response.read()
+                if response.status != 200:
+                    raise RuntimeError(f"controller returned {response.status}: {data[:200]!r}")
+                return json.loads(data or b"{}")
+            except (http.client.HTTPException, OSError):
+                # Разрыв keep-alive соединения - переподключаемся один раз
+                self.close()
+                if attempt:
+                    raise
+
+    def close(self):
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except Exception:
+                pass
+            self.conn = None
+
+
+class Job:
+    """Сканирование, описанное файлом в jobs/"""
+
+    def __init__(self, path, spec):
+        self.path = path
+        self.job_id = spec["job_id"]
+        self.screen_name = spec["screen_name"]
+        self.output_path = os.path.expanduser(spec["output_path"])
+        self.log_path = os.path.expanduser(spec["log_path"])
+        self.exit_path = self.output_path + ".exit"
+        self.offset = None  # Известно после первого ответа контроллера
+        self.exit_sent = False
+
+
+class Agent:
+    def __init__(self, config):
+        self.controller = Controller(config["controller_url"], config["token"], config.get("timeout", 30))
+        self.interval = config.get("interval", 5)
+        self.max_line_size = max(config.get("max_line_size", MAX_LINE_BYTES), MAX_BATCH_BYTES)
+        self.jobs = {}
+
+    def load_jobs(self):
+        """Синхронизация списка заданий с каталогом jobs/"""
+        os.makedirs(JOBS_DIR, exist_ok=True)
+        seen = set()
+        for name in os.listdir(JOBS_DIR):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(JOBS_DIR, name)
+            seen.add(path)
+            if path in self.jobs:
+                continue
+            try:
+                with open(path) as f:
+                    self.jobs[path] = Job(path, json.load(f))
+            except (OSError, ValueError, KeyError) as e:
+                log(f"bad job file {name}: {e}")
+
+        for path in list(self.jobs):
+            if path not in seen:
+                del self.jobs[path]
+
+    def running_sessions(self):
+        try:
+            output = subprocess.run(
+                ["screen", "-ls"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=10
+            ).stdout.decode(errors="replace")
+        except Exception:
+            return None
+        sessions = set()
+        for line in output.splitlines():
+            parts = line.strip().split("\t")
+            if parts and "." in parts[0]:
+                sessions.add(parts[0].split(".", 1)[1])
+        return sessions
+
+    def read_findings(self, job, final=False):
+        """Целые JSONL строки начиная с подтвержденного смещения
+
+        Окно чтения растет для длинной строки до max_line_size; строка
+        длиннее отправляется обрезанной (контроллер считает ее
+        поврежденной), как и недописанная строка завершенной сессии
+        (final), чтобы смещение всегда доходило до конца файла.
+        """
+        if job.offset is None or not os.path.exists(job.output_path):
+            return None
+        size = MAX_BATCH_BYTES
+        with open(job.output_path, "rb") as f:
+            while True:
+                f.seek(job.offset)
+                chunk = f.read(size)
+                if not chunk:
+                    return None
+                end = chunk.rfind(b"\n")
+                if end != -1:
+                    break
+                if len(chunk) == size and size < self.max_line_size:
+                    size = min(size * 2, self.max_line_size)
+                    continue
+                if not final and len(chunk) < size:
+                    return None  # Строка еще дописывается nuclei
+                end = len(chunk) - 1
+                break
+        lines = chunk[:end + 1].decode(errors="replace").splitlines()
+        return {
+            "job_id": job.job_id,
+            "offset": job.offset,
+            "end_offset": job.offset + end + 1,
+            "lines": [line for line in lines if line.strip()]
+        }
+
+    @staticmethod
+    def log_tail(job):
+        if not os.path.exists(job.log_path):
+            return ""
+        with open(job.log_path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(f.tell() - 64 * 1024, 0))
+            data = f.read().decode(errors="replace")
+        return "\n".join(data.splitlines()[-LOG_TAIL_LINES:])
+
+    @staticmethod
+    def resources():
+        usage = {}
+        try:
+            with open("/proc/loadavg") as f:
+                usage["load_avg"] = [float(v) for v in f.read().split()[:3]]
+            with open("/proc/meminfo") as f:
+                meminfo = dict(line.split(":", 1) for line in f if ":" in line)
+            usage["mem_total_kb"] = int(meminfo["MemTotal"].split()[0])
+            usage["mem_available_kb"] = int(meminfo["MemAvailable"].split()[0])
+            ps = subprocess.run(
+                ["ps", "-C", "nuclei", "-o", "rss=,pcpu="],
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=10
+            ).stdout.decode().split()
+            usage["nuclei_processes"] = len(ps) // 2
+            usage["nuclei_rss_kb"] = sum(int(v) for v in ps[0::2])
+            usage["nuclei_cpu_percent"] = sum(float(v) for v in ps[1::2])
+        except Exception:
+            pass
+        return usage
+
+    def collect(self):
+        sessions = self.running_sessions()
+        events = []
+        findings = []
+
+        for job in self.jobs.values():
+            is_running = sessions is None or job.screen_name in sessions
+            batch = self.read_findings(job, final=not is_running)
+            if batch:
+                findings.append(batch)
+
+            status = {
+                "type": "status",
+                "job_id": job.job_id,
+                "screen_name": job.screen_name,
+                "is_running": is_running,
+                "log_tail": self.log_tail(job),
+                "results_size": os.path.getsize(job.output_path) if os.path.exists(job.output_path) else 0
+            }
+            events.append(status)
+
+            # Сессия завершилась - сообщаем код выхода. Находки того же запроса
+            # контроллер принимает раньше событий, а неподтвержденный хвост
+            # файла дочитывает сам, поэтому код выхода не ждет подтверждения
+            if not is_running and not job.exit_sent:
+                exit_code = -1
+                if os.path.exists(job.exit_path):
+                    with open(job.exit_path) as f:
+                        try:
+                            exit_code = int(f.read().strip() or -1)
+                        except ValueError:
+                            pass
+                events.append({"type": "exit", "job_id": job.job_id, "exit_code": exit_code, "ts": time.time()})
+
+        return events, findings
+
+    def read_buffer(self):
+        if not os.path.exists(BUFFER_PATH):
+            return []
+        events = []
+        with open(BUFFER_PATH) as f:
+            for line in f:
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    pass
+        return events
+
+    def buffer_events(self, events):
+        """Сохранение событий (кроме статусов) до восстановления связи"""
+        durable = [e for e in events if e.get("type") != "status"]
+        if not durable:
+            return
+        if os.path.exists(BUFFER_PATH) and os.path.getsize(BUFFER_PATH) > MAX_BUFFER_BYTES:
+            log("event buffer is full, dropping events")
+            return
+        with open(BUFFER_PATH, "a") as f:
+            for event in durable:
+                f.write(json.dumps(event) + "\n")
+
+    def step(self):
+        self.load_jobs()
+        events, findings = self.collect()
+        buffered = self.read_buffer()
+
+        payload = {
+            "agent_version": AGENT_VERSION,
+            "jobs": sorted({job.job_id for job in self.jobs.values()}),
+            "events": buffered + events,
+            "findings": findings,
+            "resources": self.resources()
+        }
+
+        try:
+            response = self.controller.post(payload)
+        except Exception as e:
+            log(f"controller unreachable: {e}")
+            self.buffer_events(events)
+            return
+
+        if buffered:
+            os.remove(BUFFER_PATH)
+
+        # Контроллер - источник истины для смещений
+        offsets = response.get("offsets", {})
+        acked_exits = set(response.get("acked_exits", []))
+
+        for path, job in list(self.jobs.items()):
+            if job.job_id in offsets:
+                job.offset = offsets[job.job_id]
+            if job.job_id in acked_exits:
+                job.exit_sent = True
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                del self.jobs[path]
+
+    def run(self):
+        log(f"agent {AGENT_VERSION} started")
+        while True:
+            try:
+                self.step()
+            except Exception as e:
+                log(f"agent error: {e}")
+            time.sleep(self.interval)
+
+
+def main():
+    with open(CONFIG_PATH) as f:
+        config = json.load(f)
+    Agent(config).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+#!/bin/bash
+
+# Nuclei scan runner script
+TASK_ID=$1
+TEMPLATE_PATH=$2
+TARGETS_PATH=$3
+OUTPUT_PATH=$4
+STATS_INTERVAL=${5:-10}
+RESUME_PATH=$6
+LOG_PATH="$HOME/nuclei-worker/logs/nuclei_task_${TASK_ID}.log"
+RESUME_DIR="$HOME/nuclei-worker/resume"
+
+# Start marker used to find the resume file written by nuclei
+mkdir -p "$RESUME_DIR"
+START_MARKER="$RESUME_DIR/.started_${TASK_ID}"
+touch "$START_MARKER"
+
+RESUME_ARGS=()
+if [ -n "$RESUME_PATH" ] && [ -f "${RESUME_PATH/#\~/$HOME}" ]; then
+    RESUME_ARGS=(-resume "${RESUME_PATH/#\~/$HOME}")
+    echo "Resuming from: ${RESUME_PATH}" | tee -a "$LOG_PATH"
+fi
+
+echo "Starting Nuclei scan for task ${TASK_ID}" | tee -a "$LOG_PATH"
+echo "Template: ${TEMPLATE_PATH}" | tee -a "$LOG_PATH"
+echo "Targets: ${TARGETS_PATH}" | tee -a "$LOG_PATH"
+echo "Output: ${OUTPUT_PATH}" | tee -a "$LOG_PATH"
+echo "===========================================" | tee -a "$LOG_PATH"
+
+# Run nuclei with logging
+nuclei \
+    -t "$TEMPLATE_PATH" \
+    -l "$TARGETS_PATH" \
+    -o "$OUTPUT_PATH" \
+    -json \
+    -rate-limit 150 \
+    -bulk-size 50 \
+    -concurrency 50 \
+    -stats \
+    -stats-json \
+    -stats-interval "$STATS_INTERVAL" \
+    -silent \
+    "${RESUME_ARGS[@]}" \
+    2>&1 | tee -a "$LOG_PATH"
+EXIT_CODE=${PIPESTATUS[0]}
+
+# On SIGINT nuclei saves its state to ~/.config/nuclei/resume-*.cfg
+NEW_RESUME=$(find "$HOME/.config/nuclei" -maxdepth 1 -name 'resume-*.cfg' -newer "$START_MARKER" 2>/dev/null | head -n 1)
+if [ -n "$NEW_RESUME" ]; then
+    mv "$NEW_RESUME" "$RESUME_DIR/${TASK_ID}.cfg"
+    echo "Resume file saved: $RESUME_DIR/${TASK_ID}.cfg" | tee -a "$LOG_PATH"
+fi
+rm -f "$START_MARKER"
+
+echo "$EXIT_CODE" > "${OUTPUT_PATH}.exit"
+
+echo "===========================================" | tee -a "$LOG_PATH"
+echo "Scan completed for task ${TASK_ID}" | tee -a "$LOG_PATH"
+echo "Results saved to: ${OUTPUT_PATH}" | tee -a "$LOG_PATH"